@@ -1,9 +1,11 @@
+import json
 import logging
 import os
+import struct
 import subprocess
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
 from flask import (
     Flask,
     Response,
@@ -12,9 +14,22 @@ from flask import (
     request,
     send_from_directory,
 )
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
 
 import config
-from retrieval_system import VideoRetrievalSystem
+from retrieval_system import VideoRetrievalSystem, restrict_to_batches
+from utils.columnar import dumps
+from utils.eval_client import EvalServerClient, EvalServerError, SubmissionQueue
+from utils.result_cache import (
+    IngestGeneration,
+    ResultCache,
+    build_page,
+    normalize_query,
+    page_params,
+    page_request,
+    query_key,
+)
 from utils.video_metadata import load_video_metadata
 
 log_file = "system.log"
@@ -32,6 +47,8 @@ VIDEO_METADATA = load_video_metadata(config.VIDEOS_DIR)
 try:
     search_system = VideoRetrievalSystem(re_ingest=False)
     logger.info("Search system initialized successfully!")
+    if config.WARMUP_ON_STARTUP:
+        search_system.warmup()
 except Exception as e:
     logger.error(f"Failed to initialize search system: {e}")
     logger.error(traceback.format_exc())
@@ -43,6 +60,145 @@ def home():
     return render_template("index.html")
 
 
+@app.route("/ready")
+def ready():
+    """Kết quả warm-up lúc khởi động; 503 nếu hệ thống chưa sẵn sàng."""
+    if not search_system:
+        return _json_response({"ready": False, "error": "Search system not initialized."}, 503)
+    payload = {"ready": search_system.ready, "warmup": search_system.warmup_report}
+    return _json_response(payload, 200 if search_system.ready else 503)
+
+
+# Cache kết quả đầy đủ của mỗi truy vấn để phân trang / sắp xếp lại không phải search lại
+RESULT_CACHE = ResultCache(
+    max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+    generation=IngestGeneration(
+        config.INGEST_GENERATION_FILE,
+        check_interval=config.INGEST_GENERATION_CHECK_SECONDS,
+    ),
+)
+
+
+# Các truy vấn con chạy song song: tổng thời gian = backend chậm nhất, không phải tổng
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=config.SEARCH_WORKERS)
+
+
+def _submit_sub_searches(query):
+    """
+    Gửi các truy vấn con (CLIP, object, transcript) vào executor.
+    Trả về dict stage -> future theo thứ tự cố định clip, objects, transcript:
+    tập đầu tiên là "baseline" của intersect nên thứ tự phải ổn định.
+    `query` là payload đã được normalize_query.
+    """
+    futures = {}
+
+    # 1. Search Text/CLIP
+    description = query.get("description")
+    if query.get("similar"):
+        # "More like this": vector lưu sẵn của các ví dụ, chỉ encode khi có kèm description
+        futures["clip"] = SEARCH_EXECUTOR.submit(
+            search_system.similar_search_frame,
+            query["similar"]["positives"],
+            query["similar"]["negatives"],
+            max_results=config.SEARCH_CLIP_MAX_RESULTS,
+            query=description or "",
+            batches=query.get("batches"),
+        )
+    elif description and query.get("description_variants"):
+        futures["clip"] = SEARCH_EXECUTOR.submit(
+            search_system.clip_search_multi_frame,
+            [description, *query["description_variants"]],
+            max_results=config.SEARCH_CLIP_MAX_RESULTS,
+            merge=query.get("clip_merge"),
+            batches=query.get("batches"),
+        )
+    elif description:
+        futures["clip"] = SEARCH_EXECUTOR.submit(
+            search_system.clip_search_frame,
+            description,
+            max_results=config.SEARCH_CLIP_MAX_RESULTS,
+            batches=query.get("batches"),
+        )
+
+    # 2. Search Objects
+    if query.get("objects"):
+        futures["objects"] = SEARCH_EXECUTOR.submit(
+            search_system.object_search_frame, query["objects"]
+        )
+
+    # 3. Search Transcript
+    transcript_text = query.get("transcript")
+    if transcript_text:
+        futures["transcript"] = SEARCH_EXECUTOR.submit(
+            search_system.transcript_search_frame,
+            transcript_text,
+            mode=query.get("transcript_mode"),
+        )
+
+    return futures
+
+
+def _to_records(frame):
+    """
+    Chuyển ResultFrame thành list dict cho JSON, kèm FPS của từng video.
+    Chỉ gọi cho một trang kết quả, không phải toàn bộ tập.
+    """
+    # Lấy FPS từ Cache RAM, mặc định 25 nếu không tìm thấy
+    fps = [VIDEO_METADATA.get(vid, 25.0) for vid in frame.video_ids]
+    return frame.to_records(fps=fps)
+
+
+def _json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype="application/json")
+
+
+def _execute_search(query):
+    """
+    Chạy các truy vấn con rồi giao các tập kết quả (ResultFrame).
+    """
+    futures = _submit_sub_searches(query)
+    frames = {stage: future.result() for stage, future in futures.items()}
+
+    # Giao các tập kết quả
+    return _finalize_frame(frames, query)
+
+
+def _finalize_frame(frames, query):
+    """
+    `frames`: stage -> ResultFrame theo thứ tự của _submit_sub_searches.
+    Giao các tập, rồi xếp hạng lại top ứng viên với bằng chứng transcript / object.
+    """
+    return search_system.finalize(frames, query)
+
+
+def _build_page(result_id, entry, offset, page_size, sort_by):
+    return build_page(result_id, entry, offset, page_size, sort_by, _to_records)
+
+
+def _search_response(query_data):
+    try:
+        page_size, sort_by = page_params(query_data)
+        query = normalize_query(query_data)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid input: {e}"}), 400
+
+    try:
+        result_id = query_key(query)
+        entry = RESULT_CACHE.get(result_id)
+        if entry is None:
+            entry = {"frame": _execute_search(query), "orders": {}}
+            RESULT_CACHE.put(result_id, entry)
+            logger.info(f"Search completed. Number of results: {len(entry['frame'])}")
+        else:
+            logger.info(f"Search served from cache: {result_id}")
+
+        return _json_response(_build_page(result_id, entry, 0, page_size, sort_by))
+    except Exception as e:
+        logger.error(f"An error occurred during search: {e}", exc_info=True)
+        return jsonify({"error": "An internal error occurred during search."}), 500
+
+
 @app.route("/search", methods=["POST"])
 def search_api():
     if not search_system:
@@ -53,42 +209,159 @@ def search_api():
         return jsonify({"error": "Invalid input: No JSON data received."}), 400
 
     logger.info(f"Received search request: {query_data}")
+    return _search_response(query_data)
+
+
+@app.route("/search/similar", methods=["POST"])
+def search_similar_api():
+    """
+    "More like this" trên vector keyframe đã lưu, không gọi text encoder.
+    Body: {"positives": [{"video_id": "L01_V001", "keyframe_index": 120}, ...],
+           "negatives": [...], "objects": [...], "transcript": "...", "page_size": 100}
+    Các trường lọc khác giống /search; kết quả phân trang qua /search/page.
+    """
+    if not search_system:
+        return jsonify({"error": "Search system is not available."}), 500
+
+    data = request.get_json(silent=True) or {}
+    logger.info(f"Received similar search request: {data}")
+    query_data = {
+        **data,
+        "similar": {"positives": data.get("positives"), "negatives": data.get("negatives")},
+    }
+    return _search_response(query_data)
+
+
+@app.route("/search/page", methods=["POST"])
+def search_page_api():
+    """
+    Lấy trang tiếp theo hoặc sắp xếp lại một tập kết quả đã cache.
+    Body: {"cursor": "..."} hoặc {"result_id": "...", "offset": 0, "sort_by": "clip_score", "page_size": 100}
+    """
+    data = request.get_json(silent=True) or {}
 
     try:
-        description = query_data.get("description", "")
-        result_sets = []
-
-        # 1. Search Text/CLIP
-        if description:
-            clip_results = search_system.clip_search(description, max_results=500)
-            result_sets.append(clip_results)
-
-        # 2. Search Objects
-        if query_data.get("objects"):
-            object_results = search_system.object_search(
-                query_data["objects"], projection={"video_id": 1, "keyframe_index": 1}
-            )
-            result_sets.append(object_results)
+        result_id, offset, page_size, sort_by = page_request(data)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid input: {e}"}), 400
+
+    entry = RESULT_CACHE.get(result_id)
+    if entry is None:
+        return jsonify({"error": "Result set expired, please search again."}), 410
 
-        # 3. Search Transcript
-        transcript_text = query_data.get("transcript") or query_data.get("audio")
-        if transcript_text:
-            transcript_results = search_system.transcript_search(transcript_text)
-            result_sets.append(transcript_results)
+    return _json_response(_build_page(result_id, entry, offset, page_size, sort_by))
 
-        # Giao các tập kết quả
-        results = search_system.intersect(result_sets)
 
-        for item in results:
-            vid = item.get("video_id")
-            # Lấy FPS từ Cache RAM, mặc định 25 nếu không tìm thấy
-            item["fps"] = VIDEO_METADATA.get(vid, 25.0)
+def _stream_event(event, **payload):
+    return dumps({"event": event, **payload}) + b"\n"
 
-        logger.info(f"Search completed. Number of results: {len(results)}")
-        return jsonify(results)
+
+def _iter_search_stream(query, result_id, page_size, sort_by):
+    """
+    Sinh các dòng NDJSON cho /search/stream:
+    - "partial": mỗi khi một truy vấn con xong, gửi trang đầu của giao các tập đã có.
+      Mỗi partial là tập cha của kết quả cuối, nên client chỉ cần vẽ lại.
+    - "done": kết quả cuối (giống response của /search, có cursor để phân trang).
+    - "error": lỗi trong quá trình search.
+    """
+    try:
+        entry = RESULT_CACHE.get(result_id)
+        if entry is None:
+            futures = _submit_sub_searches(query)
+            stages = {future: stage for stage, future in futures.items()}
+            completed = {}
+
+            for future in as_completed(stages):
+                stage = stages[future]
+                completed[stage] = future.result()
+                if len(completed) == len(futures):
+                    break
+
+                # Giữ thứ tự clip, objects, transcript cho tập baseline
+                partial = search_system.collapse_clusters(
+                    restrict_to_batches(
+                        search_system.intersect(
+                            [completed[name] for name in futures if name in completed]
+                        ),
+                        query.get("batches"),
+                    )
+                )
+                yield _stream_event(
+                    "partial",
+                    stage=stage,
+                    completed=[name for name in futures if name in completed],
+                    total=len(partial),
+                    results=_to_records(partial.head(page_size)),
+                )
+
+            frame = _finalize_frame({name: completed[name] for name in futures}, query)
+            entry = {"frame": frame, "orders": {}}
+            RESULT_CACHE.put(result_id, entry)
+            logger.info(f"Stream search completed. Number of results: {len(frame)}")
+
+        yield _stream_event(
+            "done", **_build_page(result_id, entry, 0, page_size, sort_by)
+        )
     except Exception as e:
-        logger.error(f"An error occurred during search: {e}", exc_info=True)
-        return jsonify({"error": "An internal error occurred during search."}), 500
+        logger.error(f"An error occurred during stream search: {e}", exc_info=True)
+        yield _stream_event("error", error="An internal error occurred during search.")
+
+
+@app.route("/search/stream", methods=["POST"])
+def search_stream_api():
+    """
+    Giống /search nhưng trả kết quả dần dần (NDJSON, mỗi dòng một event).
+    """
+    if not search_system:
+        return jsonify({"error": "Search system is not available."}), 500
+
+    query_data = request.get_json()
+    if not query_data:
+        return jsonify({"error": "Invalid input: No JSON data received."}), 400
+
+    logger.info(f"Received stream search request: {query_data}")
+
+    try:
+        page_size, sort_by = page_params(query_data)
+        query = normalize_query(query_data)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid input: {e}"}), 400
+
+    return Response(
+        _iter_search_stream(query, query_key(query), page_size, sort_by),
+        mimetype="application/x-ndjson",
+        # Tắt buffer của reverse proxy để event tới client ngay
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/neighbors/<string:video_id>/<int:keyframe_index>")
+def keyframe_neighbors(video_id, keyframe_index):
+    """
+    Các keyframe gần nhất đã tính sẵn (build_knn_graph.py): đọc một hàng, không search.
+    Query string: ?k=20 (tối đa config.KNN_GRAPH_K).
+    """
+    if not search_system:
+        return jsonify({"error": "Search system is not available."}), 500
+
+    try:
+        k = int(request.args.get("k") or config.KNN_GRAPH_K)
+    except ValueError:
+        return jsonify({"error": "Invalid input: k must be an integer."}), 400
+
+    try:
+        frame = search_system.neighbors_frame(video_id, keyframe_index, max(1, k))
+    except FileNotFoundError:
+        return jsonify({"error": "kNN graph not built or out of date, run build_knn_graph.py."}), 404
+
+    return _json_response({"results": _to_records(frame), "total": len(frame)})
+
+
+def _keyframe_path(video_id, keyframe_index):
+    """
+    Đường dẫn tới file keyframe, None nếu video_id không hợp lệ (path traversal)
+    """
+    return safe_join(config.KEYFRAMES_DIR, video_id, f"keyframe_{keyframe_index}.webp")
 
 
 @app.route("/keyframes/<string:video_id>/keyframe_<int:keyframe_index>.webp")
@@ -96,11 +369,112 @@ def serve_frame_image(video_id, keyframe_index):
     try:
         keyframe_dir = os.path.join(config.KEYFRAMES_DIR, video_id)
         filename = f"keyframe_{keyframe_index}.webp"
-        return send_from_directory(keyframe_dir, filename)
-    except FileNotFoundError:
+        # send_from_directory đã tự sinh ETag và trả 304 cho request có If-None-Match
+        response = send_from_directory(
+            keyframe_dir, filename, max_age=config.KEYFRAME_CACHE_MAX_AGE
+        )
+        response.headers["Cache-Control"] = (
+            f"public, max-age={config.KEYFRAME_CACHE_MAX_AGE}, immutable"
+        )
+        return response
+    except (FileNotFoundError, NotFound):
         return send_from_directory("static", "placeholder.png"), 404
 
 
+def _iter_keyframe_batch(frames):
+    """
+    Sinh response dạng length-prefixed cho nhiều keyframe:
+    [uint32 big-endian độ dài header][header JSON][ảnh `size` bytes] lặp lại.
+    Frame không tồn tại có size = 0 để client dùng placeholder.
+    Frame mà client gửi kèm đúng etag hiện tại: size = 0, "not_modified": true,
+    client dùng lại bản đã cache.
+    """
+    for video_id, keyframe_index, known_etag in frames:
+        path = _keyframe_path(video_id, keyframe_index)
+        size = 0
+        etag = None
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            size = stat.st_size
+            etag = f"{stat.st_mtime_ns:x}-{size:x}"
+        not_modified = etag is not None and etag == known_etag
+        if not_modified:
+            size = 0
+
+        header = json.dumps(
+            {
+                "video_id": video_id,
+                "keyframe_index": keyframe_index,
+                "size": size,
+                "etag": etag,
+                "not_modified": not_modified,
+            }
+        ).encode("utf-8")
+        yield struct.pack(">I", len(header)) + header
+
+        if size:
+            with open(path, "rb") as f:
+                remaining = size
+                while remaining > 0:
+                    chunk = f.read(min(65536, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+                if remaining > 0:
+                    # File bị cắt ngắn giữa chừng: đệm cho đủ size đã khai báo
+                    yield b"\0" * remaining
+
+
+@app.route("/keyframes/batch", methods=["POST"])
+def serve_frame_batch():
+    """
+    Trả nhiều keyframe trong một response.
+    Body: {"frames": [["L01_V001", 123], {"video_id": "L01_V002", "keyframe_index": 45}, ...]}
+    Mỗi frame có thể kèm etag đã cache (["L01_V001", 123, "<etag>"] hoặc khóa "etag"),
+    giống If-None-Match: frame chưa đổi chỉ trả header, không gửi lại ảnh.
+    """
+    data = request.get_json(silent=True) or {}
+    raw_frames = data.get("frames")
+    if not isinstance(raw_frames, list):
+        return jsonify({"error": "Invalid input: 'frames' must be a list."}), 400
+    if len(raw_frames) > config.KEYFRAME_BATCH_MAX_FRAMES:
+        return (
+            jsonify(
+                {
+                    "error": f"Too many frames, at most {config.KEYFRAME_BATCH_MAX_FRAMES} per request."
+                }
+            ),
+            400,
+        )
+
+    frames = []
+    try:
+        for item in raw_frames:
+            if isinstance(item, dict):
+                video_id, keyframe_index = item["video_id"], item["keyframe_index"]
+                known_etag = item.get("etag")
+            else:
+                video_id, keyframe_index, *rest = item
+                known_etag = rest[0] if len(rest) == 1 else None
+                if len(rest) > 1:
+                    raise ValueError(item)
+            frames.append((str(video_id), int(keyframe_index), known_etag))
+    except (KeyError, TypeError, ValueError):
+        return (
+            jsonify(
+                {"error": "Invalid input: each frame needs video_id and keyframe_index."}
+            ),
+            400,
+        )
+
+    return Response(
+        _iter_keyframe_batch(frames),
+        mimetype="application/octet-stream",
+        headers={"Cache-Control": "no-store"},
+    )
+
+
 @app.route("/videos/<path:video_id>")
 def serve_video_file(video_id):
     try:
@@ -131,64 +505,35 @@ def serve_hls(video_id, filename):
         return "File not found", 404
 
 
+# Kết nối keep-alive dùng chung tới server đánh giá + hàng đợi submit chạy nền
+EVAL_CLIENT = EvalServerClient(
+    config.EVAL_SERVER_URL,
+    pool_size=config.EVAL_POOL_SIZE,
+    retries=config.EVAL_RETRIES,
+    timeout=config.EVAL_TIMEOUT_SECONDS,
+    session_ttl=config.EVAL_SESSION_TTL_SECONDS,
+)
+SUBMISSION_QUEUE = SubmissionQueue(EVAL_CLIENT, workers=config.EVAL_SUBMIT_WORKERS)
+
+
 @app.route("/api/login", methods=["POST"])
 def login_proxy():
     """
-    Thực hiện Login và lấy luôn Evaluation ID
+    Thực hiện Login và lấy luôn Evaluation ID (cache lại, gửi "refresh": true để login lại)
     """
     try:
-        # 1. Login
-        login_url = f"{config.EVAL_SERVER_URL}/api/v2/login"
         creds = request.get_json() or {}
         username = creds.get("username", config.EVAL_USERNAME)
         password = creds.get("password", config.EVAL_PASSWORD)
 
-        login_resp = requests.post(
-            login_url, json={"username": username, "password": password}, verify=False
-        )
-        if login_resp.status_code != 200:
-            return (
-                jsonify(
-                    {
-                        "error": "Login failed on remote server",
-                        "details": login_resp.text,
-                    }
-                ),
-                401,
-            )
-
-        session_id = login_resp.json().get("sessionId")
-
-        # 2. Get Evaluation List
-        list_url = f"{config.EVAL_SERVER_URL}/api/v2/client/evaluation/list"
-        list_resp = requests.get(list_url, params={"session": session_id})
-
-        if list_resp.status_code != 200:
-            return (
-                jsonify(
-                    {
-                        "error": "Failed to get evaluation list",
-                        "details": list_resp.text,
-                    }
-                ),
-                400,
-            )
-
-        eval_list = list_resp.json()
-        if not eval_list:
-            return jsonify({"error": "No evaluations found"}), 404
-
-        # Lấy evaluation ID đầu tiên (theo logic submit.py mẫu)
-        evaluation_id = eval_list[0]["id"]
-
-        return jsonify(
-            {
-                "message": "Login successful",
-                "sessionId": session_id,
-                "evaluationId": evaluation_id,
-            }
-        )
+        ids = EVAL_CLIENT.login(username, password, refresh=bool(creds.get("refresh")))
+        return jsonify({"message": "Login successful", **ids})
 
+    except EvalServerError as e:
+        payload = {"error": str(e)}
+        if e.details:
+            payload["details"] = e.details
+        return jsonify(payload), e.status_code
     except Exception as e:
         logger.error(f"Login proxy error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -197,7 +542,8 @@ def login_proxy():
 @app.route("/api/submit", methods=["POST"])
 def submit_proxy():
     """
-    Gửi kết quả submit
+    Gửi kết quả submit. Với "async": true, trả về jobId ngay (202) và
+    trạng thái được lấy qua GET /api/submit/<job_id>
     """
     try:
         data = request.get_json()
@@ -209,26 +555,11 @@ def submit_proxy():
         if not all([session_id, evaluation_id, video_id, time_ms is not None]):
             return jsonify({"error": "Missing required fields"}), 400
 
-        submit_url = f"{config.EVAL_SERVER_URL}/api/v2/submit/{evaluation_id}"
-
-        payload = {
-            "answerSets": [
-                {
-                    "answers": [
-                        {
-                            "mediaItemName": video_id,
-                            "start": str(int(time_ms)),
-                            "end": str(int(time_ms)),
-                        }
-                    ]
-                }
-            ]
-        }
+        if data.get("async"):
+            job_id = SUBMISSION_QUEUE.submit(session_id, evaluation_id, video_id, time_ms)
+            return jsonify({"jobId": job_id, "status": "queued"}), 202
 
-        # Gửi request lên server đánh giá
-        response = requests.post(
-            submit_url, json=payload, params={"session": session_id}
-        )
+        response = EVAL_CLIENT.submit(session_id, evaluation_id, video_id, time_ms)
 
         if response.status_code == 200:
             return jsonify({"success": True, "remote_response": response.json()})
@@ -243,5 +574,13 @@ def submit_proxy():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/submit/<string:job_id>", methods=["GET"])
+def submit_status(job_id):
+    job = SUBMISSION_QUEUE.status(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown submission job"}), 404
+    return jsonify(job)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
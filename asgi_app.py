@@ -0,0 +1,199 @@
+"""
+API search chạy trên asyncio (AsyncVideoRetrievalSystem), thay cho mô hình
+một thread mỗi truy vấn của app.py.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5002
+
+Các endpoint giống app.py, cùng payload / response:
+  GET  /ready           kết quả warm-up
+  POST /search          truy vấn mới, trả trang đầu + cursor
+  POST /search/similar  "More like this"
+  POST /search/page     trang tiếp theo / sắp xếp lại tập đã cache
+Giao diện, ảnh keyframe, video, submit vẫn do app.py phục vụ.
+"""
+
+import json
+import logging
+import traceback
+
+import config
+from async_retrieval_system import AsyncVideoRetrievalSystem
+from utils.columnar import dumps
+from utils.result_cache import (
+    IngestGeneration,
+    ResultCache,
+    build_page,
+    normalize_query,
+    page_params,
+    page_request,
+    query_key,
+)
+from utils.video_metadata import load_video_metadata
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.FileHandler("system.log"), logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+VIDEO_METADATA = load_video_metadata(config.VIDEOS_DIR)
+
+RESULT_CACHE = ResultCache(
+    max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+    generation=IngestGeneration(
+        config.INGEST_GENERATION_FILE,
+        check_interval=config.INGEST_GENERATION_CHECK_SECONDS,
+    ),
+)
+
+# Tạo trong lifespan startup: client async phải gắn với event loop của server
+search_system = None
+
+
+def _to_records(frame):
+    fps = [VIDEO_METADATA.get(vid, 25.0) for vid in frame.video_ids]
+    return frame.to_records(fps=fps)
+
+
+async def _search_response(query_data):
+    try:
+        page_size, sort_by = page_params(query_data)
+        query = normalize_query(query_data)
+    except (KeyError, TypeError, ValueError) as e:
+        return 400, {"error": f"Invalid input: {e}"}
+
+    try:
+        result_id = query_key(query)
+        entry = RESULT_CACHE.get(result_id)
+        if entry is None:
+            entry = {"frame": await search_system.search(query), "orders": {}}
+            RESULT_CACHE.put(result_id, entry)
+            logger.info(f"Search completed. Number of results: {len(entry['frame'])}")
+        else:
+            logger.info(f"Search served from cache: {result_id}")
+
+        return 200, build_page(result_id, entry, 0, page_size, sort_by, _to_records)
+    except Exception as e:
+        logger.error(f"An error occurred during search: {e}", exc_info=True)
+        return 500, {"error": "An internal error occurred during search."}
+
+
+async def ready(data):
+    if not search_system:
+        return 503, {"ready": False, "error": "Search system not initialized."}
+    payload = {"ready": search_system.ready, "warmup": search_system.warmup_report}
+    return (200 if search_system.ready else 503), payload
+
+
+async def search(data):
+    if not data:
+        return 400, {"error": "Invalid input: No JSON data received."}
+    logger.info(f"Received search request: {data}")
+    return await _search_response(data)
+
+
+async def search_similar(data):
+    logger.info(f"Received similar search request: {data}")
+    query_data = {
+        **data,
+        "similar": {"positives": data.get("positives"), "negatives": data.get("negatives")},
+    }
+    return await _search_response(query_data)
+
+
+async def search_page(data):
+    try:
+        result_id, offset, page_size, sort_by = page_request(data)
+    except (KeyError, TypeError, ValueError) as e:
+        return 400, {"error": f"Invalid input: {e}"}
+
+    entry = RESULT_CACHE.get(result_id)
+    if entry is None:
+        return 410, {"error": "Result set expired, please search again."}
+    return 200, build_page(result_id, entry, offset, page_size, sort_by, _to_records)
+
+
+# (method, path) -> handler(json body) -> (status, payload)
+ROUTES = {
+    ("GET", "/ready"): ready,
+    ("POST", "/search"): search,
+    ("POST", "/search/similar"): search_similar,
+    ("POST", "/search/page"): search_page,
+}
+# Các endpoint search cần hệ thống đã khởi tạo
+NEEDS_SYSTEM = {search, search_similar, search_page}
+
+
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return json.loads(body) if body else {}
+
+
+async def _send_json(send, status, payload):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": dumps(payload)})
+
+
+async def _lifespan(receive, send):
+    global search_system
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                search_system = AsyncVideoRetrievalSystem()
+                logger.info("Async search system initialized successfully!")
+                if config.WARMUP_ON_STARTUP:
+                    await search_system.warmup()
+            except Exception as e:
+                logger.error(f"Failed to initialize async search system: {e}")
+                logger.error(traceback.format_exc())
+                search_system = None
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if search_system:
+                await search_system.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        await _send_json(send, 404, {"error": "Not found."})
+        return
+    if handler in NEEDS_SYSTEM and not search_system:
+        await _send_json(send, 500, {"error": "Search system is not available."})
+        return
+
+    try:
+        data = await _read_json(receive)
+    except ValueError:
+        await _send_json(send, 400, {"error": "Invalid input: body is not valid JSON."})
+        return
+    if not isinstance(data, dict):
+        await _send_json(send, 400, {"error": "Invalid input: expected a JSON object."})
+        return
+
+    status, payload = await handler(data)
+    await _send_json(send, status, payload)
@@ -0,0 +1,432 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from elasticsearch import AsyncElasticsearch
+from pymilvus import Collection, connections
+from pymongo import AsyncMongoClient
+
+import config
+from retrieval_system import (
+    OBJECT_FRAME_PROJECTION,
+    build_object_pipeline,
+    clip_frame,
+    finalize_frames,
+    local_transcript_search,
+    object_docs_to_frame,
+    restrict_to_batches,
+    run_warmup,
+    similar_search,
+    transcript_hit_count,
+    transcript_hits_to_frame,
+    transcript_search_kwargs,
+    transcript_search_tiers,
+    two_stage_clip_hits,
+    warmup_milvus,
+    warmup_ready,
+)
+from utils.columnar import ResultFrame
+from utils.keyframe_registry import KeyframeRegistry
+from utils.knn_graph import KnnGraph
+from utils.local_object_index import LocalObjectIndex
+from utils.local_text_index import LocalTextIndex
+from utils.partitions import BatchPartitions
+from utils.result_cache import (
+    GenerationalLoader,
+    IngestGeneration,
+    SubSearchCache,
+    read_ingest_generation,
+)
+from utils.text_encoder import TextEncoder
+
+# --- Setup Logging ---
+logger = logging.getLogger(__name__)
+
+
+class AsyncVideoRetrievalSystem:
+    """
+    asyncio variant of VideoRetrievalSystem, served by asgi_app.py.
+
+    MongoDB and Elasticsearch are queried with their native async clients
+    (shared connection pools). pymilvus, the text encoder and the lazy loads of
+    the registry / local indexes / kNN graph are blocking, so they run on a
+    small bounded thread pool. Many concurrent searches then share a single
+    event loop instead of one thread per in-flight request. Intersection,
+    re-ranking, collapsing and warm-up are the shared helpers of retrieval_system.
+
+    Usage:
+        system = AsyncVideoRetrievalSystem()
+        await system.warmup()
+        frame = await system.search(normalize_query({"description": "...", "transcript": "..."}))
+        await system.aclose()
+    """
+
+    def __init__(self):
+        logger.info("Initializing Async Video Retrieval System...")
+
+        # --- Milvus (blocking, chạy trên executor) ---
+        connections.connect("default", host=config.MILVUS_HOST, port=config.MILVUS_PORT)
+        logger.info("Successfully connected to Milvus.")
+        self.keyframes_collection = Collection(config.KEYFRAME_COLLECTION_NAME)
+        self.partitions = BatchPartitions(self.keyframes_collection, config.MILVUS_LOADED_BATCHES)
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.ASYNC_BLOCKING_WORKERS,
+            thread_name_prefix="retrieval-blocking",
+        )
+
+        # --- MongoDB ---
+        self.mongo_client = AsyncMongoClient(
+            config.MONGO_URI, maxPoolSize=config.ASYNC_MONGO_POOL_SIZE
+        )
+        mongo_db = self.mongo_client[config.MONGO_DB_NAME]
+        self.object_collection = mongo_db[config.MONGO_OBJECT_COLLECTION]
+        logger.info("Async MongoDB client created.")
+
+        # --- Elasticsearch ---
+        self.es_client = AsyncElasticsearch(
+            hosts=[
+                {
+                    "host": config.ELASTIC_HOST,
+                    "port": int(config.ELASTIC_PORT),
+                    "scheme": config.ELASTIC_SCHEME,
+                }
+            ],
+            request_timeout=30,
+            connections_per_node=config.ASYNC_ES_CONNECTIONS_PER_NODE,
+        )
+        logger.info("Async Elasticsearch client created.")
+
+        # Initialize the text encoder
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.encoder = TextEncoder(device=self.device)
+
+        self.generation = IngestGeneration(
+            config.INGEST_GENERATION_FILE,
+            check_interval=config.INGEST_GENERATION_CHECK_SECONDS,
+        )
+        self.sub_search_cache = SubSearchCache(
+            max_bytes=config.SUB_SEARCH_CACHE_MAX_BYTES, generation=self.generation
+        )
+        self.registry_loader = GenerationalLoader(
+            lambda: KeyframeRegistry.load(config.KEYFRAME_REGISTRY_PATH),
+            self.generation,
+            name="keyframe registry",
+        )
+        self.object_index_loader = GenerationalLoader(
+            lambda: LocalObjectIndex.load(config.LOCAL_OBJECT_INDEX_DIR),
+            self.generation,
+            name="local object index",
+        )
+        self.transcript_index_loader = GenerationalLoader(
+            lambda: LocalTextIndex.load(config.LOCAL_TRANSCRIPT_INDEX_DIR),
+            self.generation,
+            name="local transcript index",
+        )
+        self.knn_graph_loader = GenerationalLoader(
+            lambda: KnnGraph.load(
+                config.KNN_GRAPH_DIR, read_ingest_generation(config.INGEST_GENERATION_FILE)
+            ),
+            self.generation,
+            name="kNN graph",
+        )
+
+        self.warmup_report = {}
+
+    async def _cached(self, key, compute):
+        cached, generation = self.sub_search_cache.lookup(key)
+        if cached is not None:
+            return cached
+
+        results = await compute()
+        self.sub_search_cache.store(key, results, generation)
+        return results
+
+    async def _run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def _get(self, loader: GenerationalLoader):
+        # Lần get() đầu mỗi generation đọc file từ đĩa: không chạy trên event loop
+        return await self._run_blocking(loader.get)
+
+    @property
+    def ready(self) -> bool:
+        return warmup_ready(self.warmup_report)
+
+    async def warmup(self) -> dict:
+        """
+        Same steps as VideoRetrievalSystem.warmup, run on the blocking pool.
+        Async client calls are scheduled back on this event loop.
+        """
+        loop = asyncio.get_running_loop()
+
+        def on_loop(coroutine_fn):
+            return lambda: asyncio.run_coroutine_threadsafe(coroutine_fn(), loop).result()
+
+        def transcripts():
+            if config.TRANSCRIPT_BACKEND == "local":
+                self.transcript_index_loader.get()
+            else:
+                on_loop(
+                    lambda: self.es_client.search(**transcript_search_kwargs("warmup", 1, "exact"))
+                )()
+
+        def objects():
+            if config.OBJECT_BACKEND == "local":
+                self.object_index_loader.get()
+            else:
+                on_loop(lambda: self.object_collection.find_one({}, {"_id": 1}))()
+
+        self.warmup_report = await self._run_blocking(
+            run_warmup,
+            {
+                "registry": self.registry_loader.get,
+                "encoder": lambda: self.encoder.warmup(config.WARMUP_BATCH_SIZES),
+                "milvus": lambda: warmup_milvus(
+                    self.keyframes_collection, self.partitions, self.encoder
+                ),
+                "transcripts": transcripts,
+                "objects": objects,
+            },
+        )
+        return self.warmup_report
+
+    async def clip_search(
+        self, query: str = "", max_results: int = 200, batches: list = None
+    ) -> ResultFrame:
+        """
+        Searching on CLIP embeddings.
+        """
+        if not query:
+            logger.warning("Search initiated with no query data.")
+            return ResultFrame.empty()
+
+        batches = tuple(sorted(set(batches))) if batches else None
+        return await self._cached(
+            ("clip", query, max_results, batches),
+            lambda: self._run_blocking(self._clip_search, query, max_results, batches),
+        )
+
+    def _clip_search(self, query: str, max_results: int, batches=None) -> ResultFrame:
+        kf_ids, scores = two_stage_clip_hits(
+            self.keyframes_collection,
+            self.partitions,
+            self.encoder.encode(query),
+            max_results,
+            batches=batches,
+        )
+        frame = restrict_to_batches(clip_frame(self.registry_loader.get(), kf_ids, scores), batches)
+        logger.info(f"CLIP: Found {len(frame)} potential keyframes.")
+        return frame
+
+    async def clip_search_multi(
+        self, queries: list[str], max_results: int = 200, merge: str = None, batches: list = None
+    ) -> ResultFrame:
+        """
+        Same semantics as VideoRetrievalSystem.clip_search_multi_frame.
+        """
+        queries = [query for query in queries if query]
+        if len(queries) <= 1:
+            return await self.clip_search(queries[0] if queries else "", max_results, batches)
+
+        merge = merge or config.CLIP_MULTI_QUERY_MERGE
+        batches = tuple(sorted(set(batches))) if batches else None
+        return await self._cached(
+            ("clip_multi", tuple(queries), max_results, merge, batches),
+            lambda: self._run_blocking(
+                self._clip_search_multi, queries, max_results, merge, batches
+            ),
+        )
+
+    def _clip_search_multi(
+        self, queries: list[str], max_results: int, merge: str, batches=None
+    ) -> ResultFrame:
+        kf_ids, scores = two_stage_clip_hits(
+            self.keyframes_collection,
+            self.partitions,
+            self.encoder.encode_batch(queries),
+            max_results,
+            merge,
+            batches,
+        )
+        return restrict_to_batches(
+            clip_frame(self.registry_loader.get(), kf_ids, scores), batches
+        )
+
+    async def similar_search(
+        self,
+        positives: list,
+        negatives: list = (),
+        max_results: int = 200,
+        query: str = "",
+        batches: list = None,
+    ) -> ResultFrame:
+        """
+        Same semantics as VideoRetrievalSystem.similar_search_frame.
+        """
+        positives = [(video_id, int(kf)) for video_id, kf in positives]
+        negatives = [(video_id, int(kf)) for video_id, kf in negatives or ()]
+        if not positives:
+            logger.warning("Similar search initiated with no positive example.")
+            return ResultFrame.empty()
+
+        batches = tuple(sorted(set(batches))) if batches else None
+        return await self._cached(
+            ("similar", tuple(positives), tuple(negatives), max_results, query, batches),
+            lambda: self._run_blocking(
+                self._similar_search, positives, negatives, max_results, query, batches
+            ),
+        )
+
+    def _similar_search(self, positives, negatives, max_results, query, batches) -> ResultFrame:
+        return similar_search(
+            self.keyframes_collection,
+            self.registry_loader.get(),
+            positives,
+            negatives,
+            max_results,
+            self.encoder.encode(query) if query else None,
+            self.partitions,
+            batches,
+        )
+
+    async def object_search(self, queries: list[dict]) -> ResultFrame:
+        """
+        Same semantics as VideoRetrievalSystem.object_search_frame.
+        """
+        if not queries:
+            return ResultFrame.empty()
+
+        try:
+            return await self._cached(
+                ("objects", json.dumps(queries, sort_keys=True)),
+                lambda: self._object_search(queries),
+            )
+        except Exception as e:
+            logger.error(f"An error occurred during object search: {e}")
+            return ResultFrame.empty()
+
+    async def _object_search(self, queries: list[dict]) -> ResultFrame:
+        if config.OBJECT_BACKEND == "local":
+            index = await self._get(self.object_index_loader)
+            kf_ids, scores = index.search_scores(queries)
+            registry = await self._get(self.registry_loader)
+            return registry.to_frame(kf_ids, object_score=scores)
+
+        pipeline = build_object_pipeline(queries, OBJECT_FRAME_PROJECTION)
+        cursor = await self.object_collection.aggregate(pipeline)
+        docs = await cursor.to_list()
+        frame = object_docs_to_frame(docs, await self._get(self.registry_loader))
+        logger.info(f"MongoDB: Found {len(frame)} keyframes matching queries.")
+        return frame
+
+    async def transcript_search(
+        self, query: str = "", max_results: int = 200, mode: str = None
+    ) -> ResultFrame:
+        if not query:
+            return ResultFrame.empty()
+
+        try:
+            tiers = transcript_search_tiers(mode)
+            return await self._cached(
+                ("transcript", query, max_results, tuple(tiers)),
+                lambda: self._transcript_search(query, max_results, tiers),
+            )
+        except Exception as e:
+            logger.error(f"An error occurred during transcript search: {e}")
+            return ResultFrame.empty()
+
+    async def _transcript_search(
+        self, query: str, max_results: int, tiers: list[str]
+    ) -> ResultFrame:
+        if config.TRANSCRIPT_BACKEND == "local":
+            # Tra cứu local chỉ tốn dưới 1ms, gọi thẳng trên event loop (index đã nạp)
+            return local_transcript_search(
+                await self._get(self.transcript_index_loader),
+                await self._get(self.registry_loader),
+                query,
+                max_results,
+                tiers,
+            )
+
+        for tier in tiers:
+            response = await self.es_client.search(
+                **transcript_search_kwargs(query, max_results, tier)
+            )
+            if transcript_hit_count(response) >= min(
+                config.TRANSCRIPT_MIN_EXACT_HITS, max_results
+            ):
+                break
+
+        frame = transcript_hits_to_frame(response, await self._get(self.registry_loader))
+        logger.info(f"Elasticsearch: Found {len(frame)} transcript matches (tier '{tier}').")
+        return frame
+
+    async def search(self, query: dict, max_clip_results: int = None) -> ResultFrame:
+        """
+        Run the sub-searches of a normalized /search query concurrently, then
+        finalize them like app._execute_search (finalize_frames). Order of the
+        result sets (clip, objects, transcript) matches app._submit_sub_searches.
+        """
+        max_clip_results = max_clip_results or config.SEARCH_CLIP_MAX_RESULTS
+        tasks = {}
+        description = query.get("description")
+        if query.get("similar"):
+            tasks["clip"] = self.similar_search(
+                query["similar"]["positives"],
+                query["similar"]["negatives"],
+                max_results=max_clip_results,
+                query=description or "",
+                batches=query.get("batches"),
+            )
+        elif description:
+            tasks["clip"] = self.clip_search_multi(
+                [description, *(query.get("description_variants") or [])],
+                max_results=max_clip_results,
+                merge=query.get("clip_merge"),
+                batches=query.get("batches"),
+            )
+        if query.get("objects"):
+            tasks["objects"] = self.object_search(query["objects"])
+        if query.get("transcript"):
+            tasks["transcript"] = self.transcript_search(
+                query["transcript"], mode=query.get("transcript_mode")
+            )
+
+        frames = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+        # Giao / re-rank / gộp cụm là CPU + có thể nạp đồ thị kNN: chạy trên executor
+        registry = await self._get(self.registry_loader)
+        return await self._run_blocking(
+            finalize_frames, frames, query, registry, self.knn_graph_loader
+        )
+
+    async def aclose(self):
+        await self.es_client.close()
+        await self.mongo_client.close()
+        self.executor.shutdown(wait=False)
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    import time
+
+    from utils.result_cache import normalize_query
+
+    async def _demo():
+        searcher = AsyncVideoRetrievalSystem()
+        queries = [
+            {"description": "a man reading news", "transcript": "thời sự"},
+            {
+                "description": "cars on the street",
+                "objects": [{"label": "Car", "confidence": 0.5, "min_instances": 1}],
+            },
+        ]
+        start = time.time()
+        results = await asyncio.gather(*(searcher.search(normalize_query(q)) for q in queries))
+        print("Concurrent searches take: ", time.time() - start)
+        print([len(r) for r in results])
+        await searcher.aclose()
+
+    asyncio.run(_demo())
@@ -0,0 +1,108 @@
+"""
+Benchmark các chế độ suy luận CPU của TextEncoder so với fp32 eager.
+
+    python bench_encoder.py                          # mọi chế độ trong config.TEXT_ENCODER_CPU_MODES
+    python bench_encoder.py --modes int8 onnx --threads 8
+
+Truy vấn là caption của ground_truth.csv. Với mỗi chế độ:
+  - parity: cosine giữa embedding của chế độ đó và embedding fp32 (từng truy vấn),
+    đạt nếu cosine nhỏ nhất >= --min-cosine (mặc định 0.99)
+  - latency: encode từng truy vấn (nq=1, như clip_search), p50 / p95
+  - throughput: encode_batch theo lô --batch-size
+Chọn chế độ nhanh nhất đạt parity rồi đặt config.TEXT_ENCODER_CPU_MODE.
+"""
+
+import argparse
+import gc
+import time
+
+import numpy as np
+import pandas as pd
+
+import config
+from utils.text_encoder import TextEncoder
+
+
+def measure(encoder, captions, batch_size, warmup=3):
+    for caption in captions[:warmup]:
+        encoder.encode(caption)
+
+    latencies, embeddings = [], []
+    for caption in captions:
+        start = time.perf_counter()
+        embeddings.append(encoder.encode(caption))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    for i in range(0, len(captions), batch_size):
+        encoder.encode_batch(captions[i:i + batch_size])
+    throughput = len(captions) / (time.perf_counter() - start)
+
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return np.vstack(embeddings), float(p50), float(p95), throughput
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Text encoder CPU inference modes: parity + speed")
+    parser.add_argument("--queries", default="ground_truth.csv")
+    parser.add_argument("--max-queries", type=int, default=200)
+    parser.add_argument("--modes", nargs="+", default=list(config.TEXT_ENCODER_CPU_MODES))
+    parser.add_argument("--threads", type=int, default=config.TEXT_ENCODER_THREADS)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args()
+
+    config.TEXT_ENCODER_THREADS = args.threads
+    # Đo model, không đo cache: tắt cache token / embedding của TextEncoder
+    config.TEXT_TOKEN_CACHE_SIZE = 0
+    config.TEXT_EMBEDDING_CACHE_SIZE = 0
+    df = pd.read_csv(args.queries)
+    df.columns = df.columns.str.strip()
+    captions = df["caption"].dropna().astype(str).tolist()[: args.max_queries]
+    print(f"⚡ {len(captions)} truy vấn | threads={args.threads or 'mặc định'}")
+
+    results = {}
+    reference = None
+    for mode in ["fp32", *[m for m in args.modes if m != "fp32"]]:
+        print(f"🚀 Đang nạp encoder ({mode})...", end="\r")
+        start = time.time()
+        encoder = TextEncoder(device="cpu", cpu_mode=mode)
+        load_seconds = time.time() - start
+        if encoder.mode != mode:
+            print(f"⚠️ Bỏ qua '{mode}': không khởi tạo được (xem log).")
+            continue
+
+        embeddings, p50, p95, throughput = measure(encoder, captions, args.batch_size)
+        if reference is None:
+            reference = embeddings
+        cosines = np.einsum("ij,ij->i", embeddings, reference)
+        results[mode] = {
+            "min_cos": float(cosines.min()),
+            "mean_cos": float(cosines.mean()),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "qps": throughput,
+            "load_s": load_seconds,
+        }
+        # Giải phóng model trước khi nạp chế độ tiếp theo (ViT-H khá nặng)
+        del encoder
+        gc.collect()
+
+    base = results["fp32"]["p50_ms"]
+    print("\n" + "═" * 88)
+    print(
+        f"{'mode':<12}{'min cos':>9}{'mean cos':>10}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'speedup':>9}{'batch q/s':>11}{'load s':>8}   parity"
+    )
+    print("─" * 88)
+    for mode, r in results.items():
+        ok = r["min_cos"] >= args.min_cosine
+        print(
+            f"{mode:<12}{r['min_cos']:9.4f}{r['mean_cos']:10.4f}{r['p50_ms']:9.1f}{r['p95_ms']:9.1f}"
+            f"{base / r['p50_ms']:8.2f}x{r['qps']:11.1f}{r['load_s']:8.1f}   {'✅' if ok else '❌'}"
+        )
+    print("═" * 88)
+
+    passing = [mode for mode, r in results.items() if r["min_cos"] >= args.min_cosine]
+    best = min(passing, key=lambda mode: results[mode]["p50_ms"])
+    print(f"👉 Nhanh nhất đạt parity: {best}  (TEXT_ENCODER_CPU_MODE = \"{best}\")")
@@ -1,3 +1,4 @@
+import argparse
 import concurrent.futures
 import glob
 import json
@@ -93,16 +94,21 @@ def parse_keyframe_index(filename):
 
 # --- 3. Worker Function ---
 def process_query(args):
-    row, searcher, shots_map, fps_map, top_k = args
+    row, searcher, shots_map, fps_map, top_k, two_stage = args
     query_text = row["caption"]
     target_vid = row["video_id"]
     target_frame_idx = parse_keyframe_index(row["keyframe_id"])
 
     start_t = time.time()
     try:
-        results = searcher.clip_search(query_text, max_results=top_k)
+        # Không qua cache: đo thời gian từng giai đoạn (encode, first stage, rerank)
+        frame, stage_ms = searcher.clip_search_stages(
+            query_text, max_results=top_k, two_stage=two_stage
+        )
+        # Như /search: mỗi cụm near-duplicate một dòng, rồi cắt đúng top_k dòng để tính recall
+        results = searcher.collapse_clusters(frame).head(top_k).to_records()
         if not results:
-            return float("inf"), time.time() - start_t
+            return float("inf"), time.time() - start_t, stage_ms
 
         found_rank = float("inf")
         for i, res in enumerate(results):
@@ -115,21 +121,31 @@ def process_query(args):
                 found_rank = i + 1
                 break
 
-        return found_rank, time.time() - start_t
+        return found_rank, time.time() - start_t, stage_ms
 
     except Exception:
-        return float("inf"), 0
+        return float("inf"), 0, {}
 
 
 # --- 4. Main Benchmark ---
-def run_benchmark_shots(csv_file="ground_truth.csv"):
+def run_benchmark_shots(csv_file="ground_truth.csv", modes=("two-stage",), encoder_cache=False):
+    if not encoder_cache:
+        # encode_ms đo model, không đo cache: tắt cache token / embedding của TextEncoder
+        # (nếu không, warm-up và mode chạy trước làm các mode sau chỉ còn tra cache)
+        config.TEXT_TOKEN_CACHE_SIZE = 0
+        config.TEXT_EMBEDDING_CACHE_SIZE = 0
+
     print("🚀 Khởi tạo hệ thống Search...", end="\r")
     try:
         searcher = VideoRetrievalSystem(re_ingest=False)
         device_name = searcher.encoder.device.upper()
-        if "CUDA" in device_name:
-            searcher.clip_search("warmup", 1)
-        print(f"🚀 Hệ thống sẵn sàng. Thiết bị: {device_name}            ")
+        # Warm-up cho mọi thiết bị: query đầu tiên không bị tính chi phí khởi động
+        report = searcher.warmup()
+        warmup_ms = sum(step["ms"] for step in report.values())
+        print(f"🚀 Hệ thống sẵn sàng. Thiết bị: {device_name} | warm-up {warmup_ms:.0f} ms")
+        if not searcher.ready:
+            failed = [name for name, step in report.items() if not step["ok"]]
+            print(f"⚠️ Warm-up lỗi ở: {failed}")
     except Exception as e:
         print(f"\n❌ Lỗi khởi tạo: {e}")
         return
@@ -143,25 +159,34 @@ def run_benchmark_shots(csv_file="ground_truth.csv"):
         print(f"❌ Lỗi file CSV: {e}")
         return
 
+    for mode in modes:
+        run_benchmark_mode(searcher, df, shots_map, fps_map, mode)
+
+
+def run_benchmark_mode(searcher, df, shots_map, fps_map, mode):
+    two_stage = mode == "two-stage"
     tasks = [
-        (row, searcher, shots_map, fps_map, TOP_K_EVAL) for _, row in df.iterrows()
+        (row, searcher, shots_map, fps_map, TOP_K_EVAL, two_stage) for _, row in df.iterrows()
     ]
 
     print(
-        f"⚡ Bắt đầu Benchmark: {len(tasks)} queries | {NUM_WORKERS} luồng | Top {TOP_K_EVAL}"
+        f"⚡ Bắt đầu Benchmark ({mode}): {len(tasks)} queries | {NUM_WORKERS} luồng | Top {TOP_K_EVAL}"
     )
     ranks = []
     times = []
+    stage_times = {}
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
         results = list(
             tqdm(executor.map(process_query, tasks), total=len(tasks), unit="query")
         )
 
-        for r, t in results:
+        for r, t, stage_ms in results:
             if t > 0:
                 ranks.append(r)
                 times.append(t)
+                for stage, ms in stage_ms.items():
+                    stage_times.setdefault(stage, []).append(ms)
 
     if not ranks:
         print("❌ Không có kết quả nào trả về.")
@@ -193,7 +218,7 @@ def run_benchmark_shots(csv_file="ground_truth.csv"):
 
     # In kết quả đẹp
     print("\n" + "═" * 50)
-    print(f"📊 KẾT QUẢ BENCHMARK (GPU + Multi-thread)")
+    print(f"📊 KẾT QUẢ BENCHMARK ({mode}, GPU + Multi-thread)")
     print("═" * 50)
     print(f"✅ Mean Reciprocal Rank (MRR) : {mrr:.4f}")
     print("─" * 50)
@@ -209,6 +234,8 @@ def run_benchmark_shots(csv_file="ground_truth.csv"):
     print(f"🎯 Recall@200               : {r200*100:6.2f}%")
     print("─" * 50)
     print(f"⏱️  Trung bình mỗi query     : {avg_time*1000:6.1f} ms")
+    for stage, values in stage_times.items():
+        print(f"   ↳ {stage:<23}: {np.mean(values):6.1f} ms (p95 {np.percentile(values, 95):.1f})")
     print(
         f"🚀 Tốc độ xử lý (Throughput): {total/sum(times)*NUM_WORKERS:.1f} query/s (ước tính)"
     )
@@ -216,4 +243,23 @@ def run_benchmark_shots(csv_file="ground_truth.csv"):
 
 
 if __name__ == "__main__":
-    run_benchmark_shots()
+    parser = argparse.ArgumentParser(description="Recall / latency benchmark on ground_truth.csv")
+    parser.add_argument("--csv", default="ground_truth.csv")
+    parser.add_argument(
+        "--mode",
+        choices=("single", "two-stage", "both"),
+        default="two-stage" if config.RERANK_ENABLED else "single",
+        help="single: one Milvus search with MILVUS_SEARCH_PARAMS; "
+        "two-stage: cheap first stage + exact re-rank (config.RERANK_*)",
+    )
+    parser.add_argument(
+        "--encoder-cache",
+        action="store_true",
+        help="keep the text encoder caches (encode_ms then measures warm cache hits)",
+    )
+    args = parser.parse_args()
+    run_benchmark_shots(
+        args.csv,
+        ("single", "two-stage") if args.mode == "both" else (args.mode,),
+        encoder_cache=args.encoder_cache,
+    )
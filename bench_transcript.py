@@ -0,0 +1,158 @@
+"""
+A/B benchmark của transcript search: mapping "standard" vs "vietnamese".
+
+    python bench_transcript.py --prepare      # tạo 2 index A/B (reindex từ config.TRANSCRIPT_INDEX)
+    python bench_transcript.py --queries 300  # đo latency + recall
+
+Truy vấn được sinh từ chính các đoạn transcript đã index (chọn ngẫu nhiên):
+  - phrase:    3-5 âm tiết liên tiếp, giữ nguyên dấu
+  - no_accent: cùng cụm đó nhưng bỏ dấu (người dùng gõ không dấu)
+  - partial:   âm tiết cuối bị cắt dở (đang gõ)
+Một truy vấn "trúng" nếu kf_id của đoạn gốc nằm trong top K.
+"""
+
+import argparse
+import random
+import time
+import unicodedata
+
+import numpy as np
+
+import config
+from retrieval_system import (
+    transcript_hit_count,
+    transcript_search_kwargs,
+    transcript_search_tiers,
+)
+from utils.elasticsearch_client import get_elasticsearch_client, recreate_transcript_index
+
+VARIANTS = ("standard", "vietnamese")
+MODES = ("tiered", "full")
+QUERY_KINDS = ("phrase", "no_accent", "partial")
+TOP_K = 10
+
+
+def ab_index(variant):
+    return f"{config.TRANSCRIPT_INDEX}_ab_{variant}"
+
+
+def prepare_indices(client):
+    for variant in VARIANTS:
+        index = ab_index(variant)
+        print(f"🔧 Tạo index {index} ({variant}) và reindex từ {config.TRANSCRIPT_INDEX}...")
+        recreate_transcript_index(client, index=index, variant=variant)
+        start = time.time()
+        client.options(request_timeout=3600).reindex(
+            source={"index": config.TRANSCRIPT_INDEX},
+            dest={"index": index},
+            wait_for_completion=True,
+            refresh=True,
+        )
+        print(f"✅ {index}: {time.time() - start:.1f}s")
+
+
+def strip_accents(text):
+    text = text.replace("đ", "d").replace("Đ", "D")
+    normalized = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in normalized if unicodedata.category(ch) != "Mn")
+
+
+def sample_queries(client, num_queries, seed):
+    rng = random.Random(seed)
+    response = client.search(
+        index=config.TRANSCRIPT_INDEX,
+        size=num_queries * 3,
+        query={"function_score": {"random_score": {"seed": seed, "field": "_seq_no"}}},
+        _source=["kf_id", "text"],
+    )
+
+    queries = []
+    for hit in response["hits"]["hits"]:
+        source = hit["_source"]
+        words = source["text"].split()
+        if len(words) < 3:
+            continue
+        length = rng.randint(3, min(5, len(words)))
+        offset = rng.randint(0, len(words) - length)
+        phrase = words[offset:offset + length]
+
+        last = phrase[-1]
+        partial = phrase[:-1] + [last[: max(1, len(last) // 2)]]
+        queries.append(
+            {
+                "kf_id": source["kf_id"],
+                "phrase": " ".join(phrase),
+                "no_accent": strip_accents(" ".join(phrase)),
+                "partial": " ".join(partial),
+            }
+        )
+        if len(queries) >= num_queries:
+            break
+    return queries
+
+
+def run_query(client, text, variant, mode, max_results):
+    start = time.perf_counter()
+    took = 0
+    for tier in transcript_search_tiers(mode):
+        kwargs = transcript_search_kwargs(
+            text, max_results, tier, index=ab_index(variant), mapping=variant
+        )
+        kwargs["filter_path"] = kwargs["filter_path"] + ["took"]
+        response = client.search(**kwargs)
+        took += response.get("took", 0)
+        if transcript_hit_count(response) >= min(config.TRANSCRIPT_MIN_EXACT_HITS, max_results):
+            break
+
+    kf_ids = [hit["_source"]["kf_id"] for hit in response.get("hits", {}).get("hits", [])]
+    return kf_ids, time.perf_counter() - start, took
+
+
+def run_benchmark(client, queries, max_results):
+    print("\n" + "═" * 88)
+    print(
+        f"{'mapping':<11}{'mode':<8}{'query':<11}"
+        f"{'p50 (ms)':>10}{'p95 (ms)':>10}{'took (ms)':>11}{f'R@{TOP_K}':>9}{f'R@{max_results}':>10}"
+    )
+    print("─" * 88)
+    for variant in VARIANTS:
+        for mode in MODES:
+            for kind in QUERY_KINDS:
+                latencies, tooks, hits_top, hits_all = [], [], 0, 0
+                for query in queries:
+                    kf_ids, latency, took = run_query(
+                        client, query[kind], variant, mode, max_results
+                    )
+                    latencies.append(latency * 1000)
+                    tooks.append(took)
+                    hits_top += query["kf_id"] in kf_ids[:TOP_K]
+                    hits_all += query["kf_id"] in kf_ids
+
+                total = len(queries)
+                print(
+                    f"{variant:<11}{mode:<8}{kind:<11}"
+                    f"{np.percentile(latencies, 50):>10.1f}{np.percentile(latencies, 95):>10.1f}"
+                    f"{np.mean(tooks):>11.1f}{hits_top / total * 100:>8.1f}%{hits_all / total * 100:>9.1f}%"
+                )
+        print("─" * 88)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A/B benchmark of transcript index mappings")
+    parser.add_argument("--prepare", action="store_true", help="create and fill the A/B indices")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--max-results", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    es = get_elasticsearch_client()
+    if args.prepare:
+        prepare_indices(es)
+
+    benchmark_queries = sample_queries(es, args.queries, args.seed)
+    print(f"⚡ {len(benchmark_queries)} truy vấn mẫu, top {args.max_results}")
+    if benchmark_queries:
+        # Lượt chạy nháp để cache của ES không làm lệch lượt đo đầu tiên
+        for variant in VARIANTS:
+            run_query(es, benchmark_queries[0]["phrase"], variant, "full", args.max_results)
+        run_benchmark(es, benchmark_queries, args.max_results)
@@ -0,0 +1,101 @@
+"""
+Đồ thị láng giềng gần nhất (kNN) của mọi keyframe, tính offline từ data/embeddings.
+
+    python build_knn_graph.py                 # k = config.KNN_GRAPH_K
+    python build_knn_graph.py --k 64 --device cuda
+
+Chạy sau ingest_data.py (cần data/keyframe_registry.npz để hàng = kf_id).
+Cosine top-k bằng nhân ma trận theo khối (row block x column block), không
+bao giờ dựng ma trận N x N. Kết quả: config.KNN_GRAPH_DIR/neighbors.npy (int32)
+và scores.npy (float16), dùng cho /neighbors và gộp near-duplicate.
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import torch
+
+import config
+from utils.embeddings import load_embedding_corpus
+from utils.keyframe_registry import KeyframeRegistry
+from utils.knn_graph import save_knn_graph
+from utils.result_cache import read_ingest_generation
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def compute_knn_graph(corpus, valid, k, row_block=1024, col_block=65536, device="cpu"):
+    """
+    Top-k neighbors (excluding self) of every row of a normalized corpus.
+    Returns (neighbors int32, scores float16), both (N, k), -1 / 0 padded.
+    """
+    num_rows = len(corpus)
+    neighbors = np.full((num_rows, k), -1, dtype=np.int32)
+    scores = np.zeros((num_rows, k), dtype=np.float16)
+    # float16 trên GPU, float32 trên CPU (matmul float16 của CPU rất chậm)
+    dtype = torch.float16 if device.startswith("cuda") else torch.float32
+    # Chuyển corpus một lần, các khối bên dưới chỉ là view
+    matrix = torch.from_numpy(corpus).to(device, dtype)
+    invalid = torch.from_numpy(~valid).to(device)
+
+    for r0 in range(0, num_rows, row_block):
+        r1 = min(r0 + row_block, num_rows)
+        rows = matrix[r0:r1]
+        best_scores = torch.full((r1 - r0, k), -torch.inf, device=device)
+        best_ids = torch.full((r1 - r0, k), -1, dtype=torch.long, device=device)
+
+        for c0 in range(0, num_rows, col_block):
+            c1 = min(c0 + col_block, num_rows)
+            block = (rows @ matrix[c0:c1].T).float()
+            block[:, invalid[c0:c1]] = -torch.inf
+
+            # Bỏ chính nó (đường chéo nằm trong phần giao của hai khối)
+            lo, hi = max(r0, c0), min(r1, c1)
+            if lo < hi:
+                diagonal = torch.arange(lo, hi, device=device)
+                block[diagonal - r0, diagonal - c0] = -torch.inf
+
+            top_scores, top_ids = block.topk(min(k, c1 - c0), dim=1)
+            merged_scores = torch.cat([best_scores, top_scores], dim=1)
+            merged_ids = torch.cat([best_ids, top_ids + c0], dim=1)
+            best_scores, order = merged_scores.topk(k, dim=1)
+            best_ids = merged_ids.gather(1, order)
+
+        best_ids[torch.isinf(best_scores)] = -1
+        best_ids[invalid[r0:r1]] = -1
+        neighbors[r0:r1] = best_ids.cpu().numpy()
+        scores[r0:r1] = torch.nan_to_num(best_scores, neginf=0.0).clamp(-1, 1).cpu().numpy()
+
+        if (r0 // row_block) % 50 == 0:
+            logger.info(f"kNN rows {r1}/{num_rows}")
+
+    return neighbors, scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the keyframe kNN graph")
+    parser.add_argument("--k", type=int, default=config.KNN_GRAPH_K)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--row-block", type=int, default=1024)
+    parser.add_argument("--col-block", type=int, default=65536)
+    parser.add_argument("--output", default=config.KNN_GRAPH_DIR)
+    args = parser.parse_args()
+
+    registry = KeyframeRegistry.load(config.KEYFRAME_REGISTRY_PATH)
+    corpus, valid = load_embedding_corpus(registry)
+
+    start = time.time()
+    graph_neighbors, graph_scores = compute_knn_graph(
+        corpus, valid, args.k, args.row_block, args.col_block, args.device
+    )
+    logger.info(f"kNN graph computed in {time.time() - start:.1f}s on {args.device}")
+
+    save_knn_graph(
+        args.output,
+        graph_neighbors,
+        graph_scores,
+        ingest_generation=read_ingest_generation(config.INGEST_GENERATION_FILE),
+    )
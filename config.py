@@ -3,15 +3,58 @@ MILVUS_HOST = "localhost"
 MILVUS_PORT = "19530"
 KEYFRAME_COLLECTION_NAME = "video_keyframes"
 VECTOR_DIMENSION = 1024
+# Index built by ingest_data and search params of every CLIP search.
+# tune_index.py measures recall@k vs latency and rewrites these two lines (--write).
+MILVUS_INDEX_PARAMS = {"metric_type": "COSINE", "index_type": "IVF_FLAT", "params": {"nlist": 1024}}
+MILVUS_SEARCH_PARAMS = {"metric_type": "COSINE", "params": {"nprobe": 64}}
+MILVUS_TUNING_REPORT = "data/milvus_index_tuning.json"
+# One partition per video batch (L01, L02, ... = video_id prefix), see utils/partitions.py
+MILVUS_PARTITION_BY_BATCH = True
+MILVUS_LOADED_BATCHES = None  # None: load every partition; ["L20", "L21"]: only these (hot) batches
 
 # --- MongoDB settings ---
 MONGO_URI = "mongodb://localhost:27017"
 MONGO_DB_NAME = "video_metadata"
 MONGO_OBJECT_COLLECTION = "object_detection_results"
 
+# "mongodb" or "local" (in-process object index, utils/local_object_index.py)
+OBJECT_BACKEND = "mongodb"
+LOCAL_OBJECT_INDEX_DIR = "data/local_object_index"
+OBJECT_GRID_SIZE = 4  # bounding boxes are indexed on a GRID x GRID cell grid (spatial queries), at most 7 (int64 cell bitmask)
+DEFAULT_FRAME_SIZE = (1280, 720)  # used when the video file cannot be read
+
+# Multi-query CLIP search (description + description_variants): per-keyframe score merge
+CLIP_MERGE_MODES = ("max", "mean")
+CLIP_MULTI_QUERY_MERGE = "max"
+
+# "More like this" (Rocchio relevance feedback on stored keyframe vectors):
+# q = ALPHA * text + BETA * mean(positives) - GAMMA * mean(negatives)
+ROCCHIO_ALPHA = 1.0
+ROCCHIO_BETA = 0.75
+ROCCHIO_GAMMA = 0.25
+SIMILAR_MAX_EXAMPLES = 32  # positives + negatives per request
+
+# Precomputed keyframe nearest-neighbor graph (build_knn_graph.py)
+KNN_GRAPH_DIR = "data/knn_graph"
+KNN_GRAPH_K = 32
+NEAR_DUPLICATE_THRESHOLD = 0.95  # cosine; neighbors above it are collapsed in results
+
+# Two-stage retrieval: compressed indexes (IVF_SQ8, IVF_PQ...) return approximate
+# distances, so their MILVUS_SEARCH_PARAMS search fetches RERANK_FIRST_STAGE_CANDIDATES
+# hits that are re-scored with their exact stored vectors. Other indexes (IVF_FLAT,
+# HNSW...) return exact distances: they keep a single search. Results are then
+# re-ranked with cross-modal evidence.
+RERANK_ENABLED = True
+RERANK_FIRST_STAGE_CANDIDATES = 1000  # hits re-scored exactly (at least the requested count)
+RERANK_CANDIDATES = 300  # cross-modal re-rank budget (top rows of the intersected results)
+RERANK_TRANSCRIPT_WEIGHT = 0.1  # x proximity to the closest transcript hit, in [0, 1]
+RERANK_TRANSCRIPT_WINDOW = 250  # keyframe indices (frames) over which proximity decays to 0
+RERANK_OBJECT_WEIGHT = 0.05  # x object_score: mean best detection confidence of the object queries
+
 # --- Data paths ---
 CLIP_FEATURES_DIR = "data/embeddings"
 KEYFRAMES_DIR = "data/keyframes"
+KEYFRAME_REGISTRY_PATH = "data/keyframe_registry.npz"  # kf_id <-> (video_id, keyframe_index), built by ingest_data
 OBJECT_DETECTION_DIR = "data/objects"
 TRANSCRIPTS_DIR = "data/transcripts"
 VIDEOS_DIR = "data/videos"
@@ -19,6 +62,22 @@ VIDEOS_DIR = "data/videos"
 # --- Model ---
 CLIP_MODEL_NAME = "ViT-H-14-378-quickgelu"
 CLIP_PRETRAINED = "dfn5b"
+# Text encoder inference on CPU (ignored on CUDA), compare with bench_encoder.py:
+# "fp32" eager, "int8" dynamic quantization of nn.Linear, "compile" torch.compile,
+# "torchscript" traced + frozen, "onnx" ONNX Runtime (needs onnxruntime, exported on first use)
+TEXT_ENCODER_CPU_MODES = ("fp32", "int8", "compile", "torchscript", "onnx")
+TEXT_ENCODER_CPU_MODE = "fp32"
+TEXT_ENCODER_THREADS = None  # intra-op threads on CPU; None keeps the PyTorch default
+TEXT_ENCODER_ONNX_PATH = "data/text_encoder.onnx"
+# Per-query caches of the text encoder (LRU entries; 0 disables), embeddings are ~4 KB each
+TEXT_TOKEN_CACHE_SIZE = 20000
+TEXT_EMBEDDING_CACHE_SIZE = 20000
+# Encoded at startup: warms the model and pre-fills the embedding cache
+TEXT_ENCODER_WARMUP_QUERIES = ["person", "car", "building", "a person walking on the street"]
+# Startup warm-up (VideoRetrievalSystem.warmup): uncached encodes at these batch sizes,
+# a dummy Milvus search, one Elasticsearch and one MongoDB query, lazy index loads
+WARMUP_ON_STARTUP = True  # False: /ready reports ready as soon as the system is initialized
+WARMUP_BATCH_SIZES = (1, 4)  # CLIP pads every query to 77 tokens: batch size is what varies
 
 OBJECT_LABELS = [
     "Tortoise",
@@ -629,8 +688,56 @@ ELASTIC_HOST = "localhost"
 ELASTIC_PORT = "9200"
 ELASTIC_SCHEME = "http"
 TRANSCRIPT_INDEX = "video_transcripts"
+# "standard": folded text + fuzzy; "vietnamese": shingle / edge-ngram subfields
+# (exact term lookups, no fuzzy). Changing it requires re-ingesting transcripts.
+TRANSCRIPT_INDEX_MAPPING = "standard"
+# "tiered": phrase/exact first, fuzzy only when it finds < TRANSCRIPT_MIN_EXACT_HITS;
+# "exact": never fuzzy; "full": phrase + fuzzy + as-you-type in one query
+TRANSCRIPT_SEARCH_MODES = ("tiered", "exact", "full")
+TRANSCRIPT_SEARCH_MODE = "tiered"
+TRANSCRIPT_MIN_EXACT_HITS = 20
+# "elasticsearch" or "local" (in-process BM25 index, utils/local_text_index.py)
+TRANSCRIPT_BACKEND = "elasticsearch"
+LOCAL_TRANSCRIPT_INDEX_DIR = "data/local_transcript_index"
 DEFAULT_FALLBACK_FPS = 25
 
+# --- Ingestion (ingest_data.py) ---
+INGEST_WORKERS = 4  # processes parsing object / transcript CSV files
+OBJECT_INSERT_BATCH_SIZE = 5000  # documents per unordered insert_many
+TRANSCRIPT_INGEST_PARALLEL = True  # process-pool parsing + parallel_bulk
+ES_BULK_THREADS = 4
+ES_BULK_CHUNK_SIZE = 5000
+ES_BULK_MAX_CHUNK_BYTES = 50 * 1024 * 1024
+# Near-duplicate clusters of adjacent keyframes: only representatives go to Milvus,
+# CLIP hits expand back to whole clusters (KeyframeRegistry.expand_clusters)
+KEYFRAME_DEDUP = True
+KEYFRAME_DEDUP_THRESHOLD = 0.95  # cosine between adjacent keyframes
+
+# --- Keyframe serving ---
+KEYFRAME_CACHE_MAX_AGE = 31536000  # keyframe files never change once extracted
+KEYFRAME_BATCH_MAX_FRAMES = 256
+
+# --- Search result pagination ---
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_PAGE_SIZE = 500
+SEARCH_CLIP_MAX_RESULTS = 500  # CLIP hits per /search (also the default k of tune_index.py)
+RESULT_CACHE_MAX_ENTRIES = 128
+RESULT_CACHE_TTL_SECONDS = 600
+SUB_SEARCH_CACHE_MAX_BYTES = 256 * 1024 * 1024  # per-modality cache in VideoRetrievalSystem
+INGEST_GENERATION_FILE = "data/ingest_generation.json"  # bumped by ingest_data.main
+INGEST_GENERATION_CHECK_SECONDS = 5
+SEARCH_WORKERS = 8  # threads running CLIP / object / transcript sub-searches in parallel
+
+# --- Async retrieval system (async_retrieval_system.py, served by asgi_app.py) ---
+ASYNC_BLOCKING_WORKERS = 4  # text encoder + Milvus calls, lazy index loads
+ASYNC_MONGO_POOL_SIZE = 50
+ASYNC_ES_CONNECTIONS_PER_NODE = 50
+
 EVAL_SERVER_URL = "http://192.168.28.151:5000"
 EVAL_USERNAME = "team004"
 EVAL_PASSWORD = "123456"
+EVAL_POOL_SIZE = 10
+EVAL_RETRIES = 3
+EVAL_TIMEOUT_SECONDS = 10
+EVAL_SESSION_TTL_SECONDS = 3600  # cached sessionId / evaluationId lifetime
+EVAL_SUBMIT_WORKERS = 2
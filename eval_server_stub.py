@@ -0,0 +1,90 @@
+"""
+Stub của server đánh giá (DRES API v2) để chạy thử login / submit ở local.
+
+    python eval_server_stub.py --port 5001
+    # rồi đặt EVAL_SERVER_URL = "http://localhost:5001" trong config.py
+
+Server ghi lại mọi submission và có thể giả lập độ trễ / lỗi 503 để kiểm tra retry.
+"""
+
+import argparse
+import itertools
+import threading
+import time
+import uuid
+
+from flask import Flask, jsonify, request
+
+
+def create_app(latency=0.0, fail_every=0, evaluation_id="stub-evaluation"):
+    """
+    latency: số giây trễ cho mỗi request.
+    fail_every: trả 503 cho mỗi request thứ N của evaluation list (0 = không bao giờ).
+    """
+    app = Flask(__name__)
+    app.config["submissions"] = []
+    app.config["counters"] = {"login": 0, "evaluation_list": 0, "submit": 0}
+    # Xóa tập này để giả lập session hết hạn phía server (401)
+    sessions = app.config["sessions"] = set()
+    list_calls = itertools.count(1)
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            app.config["counters"][name] += 1
+        if latency:
+            time.sleep(latency)
+
+    @app.route("/api/v2/login", methods=["POST"])
+    def login():
+        count("login")
+        data = request.get_json() or {}
+        if not data.get("username") or not data.get("password"):
+            return jsonify({"status": False, "description": "Invalid credentials"}), 401
+        session_id = uuid.uuid4().hex
+        sessions.add(session_id)
+        return jsonify({"sessionId": session_id, "username": data["username"]})
+
+    @app.route("/api/v2/client/evaluation/list")
+    def evaluation_list():
+        count("evaluation_list")
+        if fail_every and next(list_calls) % fail_every == 0:
+            return jsonify({"description": "Service unavailable"}), 503
+        if request.args.get("session") not in sessions:
+            return jsonify({"description": "Unauthorized"}), 401
+        return jsonify([{"id": evaluation_id, "name": "Stub evaluation"}])
+
+    @app.route("/api/v2/submit/<string:eval_id>", methods=["POST"])
+    def submit(eval_id):
+        count("submit")
+        if request.args.get("session") not in sessions:
+            return jsonify({"description": "Unauthorized"}), 401
+        if eval_id != evaluation_id:
+            return jsonify({"description": "Unknown evaluation"}), 404
+
+        with lock:
+            app.config["submissions"].append(request.get_json())
+        return jsonify({"status": True, "submission": "CORRECT", "description": "Stub"})
+
+    @app.route("/stub/stats")
+    def stats():
+        return jsonify(
+            {
+                "counters": app.config["counters"],
+                "submissions": app.config["submissions"],
+            }
+        )
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the evaluation server")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+
+    create_app(latency=args.latency, fail_every=args.fail_every).run(
+        host="0.0.0.0", port=args.port, threaded=True
+    )
@@ -1,23 +1,34 @@
 import logging
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import cv2  # Import thư viện OpenCV để đọc metadata video
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import torch
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import bulk, parallel_bulk
 from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
-from pymongo import MongoClient, UpdateOne
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 
 import config
 from utils.elasticsearch_client import (
+    bulk_indexing,
     get_elasticsearch_client,
     recreate_transcript_index,
 )
+from utils.embeddings import cluster_adjacent, embedding_files, iter_video_embeddings, video_dirs
+from utils.keyframe_registry import KeyframeRegistry
+from utils.local_object_index import LocalObjectIndexBuilder
+from utils.local_text_index import LocalTextIndexBuilder
+from utils.partitions import batch_partition, video_batch
+from utils.result_cache import bump_ingest_generation
+from utils.spatial import box_grid
 
 BULK_CHUNK_SIZE = 2000
+OBJECT_CSV_SUFFIX = "_rfdetr_results.csv"
 logger = logging.getLogger(__name__)
 
 # --- Helper Functions ---
@@ -41,6 +52,23 @@ def get_video_fps(video_id: str) -> float:
             
     return 25.0  # Fallback default value
 
+def get_video_frame_size(video_id: str) -> tuple[int, int]:
+    """(width, height) của video, mặc định config.DEFAULT_FRAME_SIZE nếu không đọc được."""
+    video_path = os.path.join(config.VIDEOS_DIR, f"{video_id}.mp4")
+    if os.path.exists(video_path):
+        try:
+            cap = cv2.VideoCapture(video_path)
+            if cap.isOpened():
+                width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+                height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+                cap.release()
+                if width > 0 and height > 0:
+                    return int(width), int(height)
+        except Exception as e:
+            logger.warning(f"Error reading frame size for {video_id}: {e}")
+
+    return config.DEFAULT_FRAME_SIZE
+
 def _load_keyframe_map(video_id: str):
     maps_dir = Path(config.KEYFRAMES_DIR) / "maps"
     map_file = maps_dir / f"{video_id}_map.csv"
@@ -79,6 +107,23 @@ def _resolve_frames_from_map(mapping, target_seconds: np.ndarray):
     return frame_ids[best_idx].astype(int), seconds[best_idx].astype(float)
 
 
+def build_keyframe_registry() -> KeyframeRegistry:
+    """
+    Register every embedded keyframe, video by video in sorted order, so kf_id
+    is also the row of the keyframe in the embedding corpus. Keyframes that only
+    appear in object/transcript data are appended later by their ingesters.
+    """
+    registry = KeyframeRegistry()
+    for video_path in video_dirs():
+        frame_indices = [frame_idx for frame_idx, _ in embedding_files(video_path)]
+        registry.ids_for(video_path.name, frame_indices)
+
+    logger.info(
+        f"Keyframe registry built: {len(registry)} keyframes in {registry.num_videos} videos."
+    )
+    return registry
+
+
 # --- Ingestion Functions ---
 
 def setup_milvus_collection(collection_name, schema, index_field, index_params):
@@ -95,42 +140,34 @@ def setup_milvus_collection(collection_name, schema, index_field, index_params):
     logger.info("Index created and data flushed.")
     return collection
 
-def ingest_keyframe_data(collection: Collection):
+def ingest_keyframe_data(collection: Collection, registry: KeyframeRegistry):
     logger.info("Ingesting keyframe data into Milvus...")
-    root = Path(config.CLIP_FEATURES_DIR)
-    
-    # Kiểm tra thư mục embedding có tồn tại không
-    if not root.exists():
-        logger.error(f"Embeddings directory not found: {root}")
-        return
 
-    for video_path in list(root.iterdir()):
-        if not video_path.is_dir():
-            continue
-            
-        video_id = video_path.name
-        vectors = []
-        frame_indices = []
-        
-        for pt_file in list(video_path.glob("*.pt")):
-            try:
-                frame_idx = int(pt_file.stem.split("_")[-1])
-                vec = torch.load(str(pt_file), map_location="cpu").numpy().astype(np.float32)
-                vec = vec.reshape(1, -1)
-                vectors.append(vec)
-                frame_indices.append(frame_idx)
-            except Exception as e:
-                logger.error(f"Error processing {pt_file}: {e}")
-                continue
+    total_keyframes = total_vectors = 0
+    for video_id, frame_indices, vectors in iter_video_embeddings():
+        kf_ids = registry.ids_for(video_id, frame_indices)
+        total_keyframes += len(kf_ids)
+        if config.KEYFRAME_DEDUP:
+            # Chỉ đại diện của mỗi cụm near-duplicate được đưa vào Milvus
+            representatives = kf_ids[cluster_adjacent(vectors, config.KEYFRAME_DEDUP_THRESHOLD)]
+            registry.set_representatives(kf_ids, representatives)
+            keep = representatives == kf_ids
+            kf_ids, vectors = kf_ids[keep], vectors[keep]
+
+        if config.MILVUS_PARTITION_BY_BATCH:
+            partition = batch_partition(video_batch(video_id))
+            if not collection.has_partition(partition):
+                collection.create_partition(partition)
+            collection.insert([kf_ids.tolist(), vectors], partition_name=partition)
+        else:
+            collection.insert([kf_ids.tolist(), vectors])
+        total_vectors += len(vectors)
+        logger.info(f"Inserted {len(vectors)} vectors for video '{video_id}'.")
 
-        if vectors:
-            vectors = np.vstack(vectors)
-            num_vectors = len(vectors)
-            entities = [[video_id] * num_vectors, frame_indices, vectors]
-            collection.insert(entities)
-            
     collection.flush()
-    logger.info("Keyframe data ingestion complete.")
+    logger.info(
+        f"Keyframe data ingestion complete: {total_vectors} vectors for {total_keyframes} keyframes."
+    )
 
 def setup_mongodb_collection(mongo_client, db_name, collection_name, drop_existing=True):
     """
@@ -144,78 +181,299 @@ def setup_mongodb_collection(mongo_client, db_name, collection_name, drop_existi
     
     collection = db[collection_name]
     
-    # Create indexes for efficient querying
-    collection.create_index([("video_id", 1), ("keyframe_index", 1)], unique=True)
+    # Create indexes for efficient querying (_id = kf_id, đã unique sẵn)
     collection.create_index([("objects.label", 1)])
     collection.create_index([("objects.confidence", 1)])
+    collection.create_index([("objects.class", 1), ("objects.grid.cells", 1)])
     
     logger.info(f"MongoDB collection '{collection_name}' created with indexes.")
     return collection
 
-def ingest_object_detection_data(mongo_collection, folder_path):
+def parse_object_csv(full_path: str):
     """
-    Ingest object detection metadata into MongoDB.
+    Parse một file *_rfdetr_results.csv thành danh sách objects theo từng frame.
+    Chạy trong process pool nên chỉ dùng thao tác theo cột, không apply từng dòng.
+
+    Returns (video_id, frame_indices, objects_per_frame, num_detections).
     """
-    logger.info("Ingesting object detection data into MongoDB...")
-    
+    video_id = os.path.basename(full_path).replace(OBJECT_CSV_SUFFIX, "")
+    df = pd.read_csv(full_path)
+    df.columns = df.columns.str.strip()
+
+    # Clean frame index string ("keyframe_12.webp" -> 12)
+    frame_str = (
+        df["frame"].astype(str)
+        .str.replace("keyframe_", "", regex=False)
+        .str.replace(".webp", "", regex=False)
+    )
+    frames = pd.to_numeric(frame_str, errors="coerce")
+    valid = frames.notna().to_numpy()
+    if not valid.all():
+        df = df[valid]
+        frames = frames[valid]
+
+    frames = frames.to_numpy(dtype=np.int64)
+    order = np.argsort(frames, kind="stable")
+    frames = frames[order]
+
+    boxes = {
+        name: df[name].to_numpy().astype(np.int64)[order]
+        for name in ("x", "y", "width", "height")
+    }
+    # Ô lưới / diện tích / tâm của từng box, dùng cho truy vấn không gian
+    grid = box_grid(
+        boxes["x"], boxes["y"], boxes["width"], boxes["height"],
+        *get_video_frame_size(video_id),
+    )
+
+    objects = [
+        {
+            "class": label,
+            "confidence": confidence,
+            "bounding_box": {"x": x, "y": y, "width": width, "height": height},
+            "grid": {"cell": cell, "cells": cells, "area": area, "cx": cx, "cy": cy},
+        }
+        for label, confidence, x, y, width, height, cell, cells, area, cx, cy in zip(
+            df["class"].to_numpy()[order].tolist(),
+            df["confidence"].to_numpy(dtype=np.float64)[order].tolist(),
+            boxes["x"].tolist(),
+            boxes["y"].tolist(),
+            boxes["width"].tolist(),
+            boxes["height"].tolist(),
+            grid["cell"].tolist(),
+            grid["cells"].tolist(),
+            np.round(grid["area"], 4).tolist(),
+            np.round(grid["cx"], 4).tolist(),
+            np.round(grid["cy"], 4).tolist(),
+        )
+    ]
+
+    # Cắt danh sách đã sort theo ranh giới frame
+    frame_indices, starts = np.unique(frames, return_index=True)
+    bounds = np.append(starts, len(frames)).tolist()
+    objects_per_frame = [objects[bounds[i]:bounds[i + 1]] for i in range(len(starts))]
+    return video_id, frame_indices, objects_per_frame, len(objects)
+
+
+def _parse_object_csv_safe(full_path: str):
+    try:
+        return parse_object_csv(full_path)
+    except Exception as e:
+        return full_path, e
+
+
+def _insert_object_documents(mongo_collection, documents) -> int:
+    try:
+        result = mongo_collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        details = e.details
+        logger.error(
+            f"Object batch had {len(details.get('writeErrors', []))} write errors "
+            f"(first: {details.get('writeErrors', [{}])[0].get('errmsg')})"
+        )
+        return details.get("nInserted", 0)
+
+
+def _object_csv_files(folder_path):
     if not os.path.isdir(folder_path):
         logger.error(f"Object detection directory not found: {folder_path}")
+        return []
+
+    csv_files = sorted(
+        os.path.join(folder_path, filename)
+        for filename in os.listdir(folder_path)
+        if filename.endswith(OBJECT_CSV_SUFFIX)
+    )
+    if not csv_files:
+        logger.warning("No object detection CSV files found.")
+    return csv_files
+
+
+def _parsed_object_frames(csv_files, registry: KeyframeRegistry, workers: int):
+    """
+    Parse object CSVs in a process pool.
+    Yields (kf_ids, objects_per_frame, num_detections) per file.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map giữ thứ tự file nên kf_id gán cho keyframe mới là tất định
+        for parsed in executor.map(_parse_object_csv_safe, csv_files, chunksize=4):
+            if isinstance(parsed[1], Exception):
+                logger.error(f"An error occurred while processing {parsed[0]}: {parsed[1]}")
+                continue
+
+            video_id, frame_indices, objects_per_frame, num_detections = parsed
+            kf_ids = registry.ids_for(video_id, frame_indices).tolist()
+            yield kf_ids, objects_per_frame, num_detections
+
+
+def ingest_object_detection_data(
+    mongo_collection, folder_path, registry: KeyframeRegistry, workers: int = None
+):
+    """
+    Ingest object detection metadata into MongoDB.
+
+    CSV files are parsed in a process pool (parse_object_csv). This process
+    assigns kf_ids and writes the documents with unordered insert_many batches.
+    The collection is expected to be freshly created (setup_mongodb_collection).
+    """
+    logger.info("Ingesting object detection data into MongoDB...")
+
+    csv_files = _object_csv_files(folder_path)
+    if not csv_files:
         return
+
+    workers = workers or config.INGEST_WORKERS
+    start_time = time.perf_counter()
+    total_detections = 0
+    total_frames = 0
+    total_inserted = 0
+    batch = []
+
+    for kf_ids, objects_per_frame, num_detections in _parsed_object_frames(
+        csv_files, registry, workers
+    ):
+        batch.extend(
+            {"_id": kf_id, "objects": objects}
+            for kf_id, objects in zip(kf_ids, objects_per_frame)
+        )
+        total_detections += num_detections
+        total_frames += len(kf_ids)
+
+        if len(batch) >= config.OBJECT_INSERT_BATCH_SIZE:
+            total_inserted += _insert_object_documents(mongo_collection, batch)
+            batch = []
+
+    if batch:
+        total_inserted += _insert_object_documents(mongo_collection, batch)
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Object detection data ingestion complete: {total_detections} detections, "
+        f"{total_inserted}/{total_frames} frames from {len(csv_files)} files in {elapsed:.1f}s "
+        f"({total_detections / max(elapsed, 1e-9):.0f} detections/s, {workers} workers)."
+    )
+
+
+def build_local_object_index(
+    folder_path, registry: KeyframeRegistry, directory: str, workers: int = None
+) -> None:
+    """Build the in-process object index (config.OBJECT_BACKEND = "local")."""
+    logger.info("Building local object index...")
+
+    csv_files = _object_csv_files(folder_path)
+    start_time = time.perf_counter()
+    builder = LocalObjectIndexBuilder()
+    for kf_ids, objects_per_frame, _ in _parsed_object_frames(
+        csv_files, registry, workers or config.INGEST_WORKERS
+    ):
+        for kf_id, objects in zip(kf_ids, objects_per_frame):
+            builder.add_frame(kf_id, objects)
+
+    builder.save(directory)
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Local object index built: {builder.num_detections} detections in {elapsed:.1f}s "
+        f"({builder.num_detections / max(elapsed, 1e-9):.0f} detections/s)."
+    )
     
-    for filename in os.listdir(folder_path):
-        if filename.endswith("_rfdetr_results.csv"):
-            full_path = os.path.join(folder_path, filename)
-            video_id = filename.replace("_rfdetr_results.csv", "")
-            
-            logger.info(f"--- Processing file: {os.path.basename(full_path)} ---")
-
-            try:
-                df = pd.read_csv(full_path)
-                df.columns = df.columns.str.strip()
-                grouped = df.groupby('frame')
-
-                bulk_operations = []
-                for frame_index, group in grouped:
-                    # Clean frame index string
-                    frame_idx_str = str(frame_index).replace("keyframe_", "").replace(".webp", "")
-                    try:
-                        frame_idx_int = int(frame_idx_str)
-                    except ValueError:
-                        continue
-
-                    objects_list = group.apply(
-                        lambda row: {
-                            'class': row['class'],
-                            'confidence': float(row['confidence']),
-                            'bounding_box': {
-                                'x': int(row['x']),
-                                'y': int(row['y']),
-                                'width': int(row['width']),
-                                'height': int(row['height'])
-                            }
-                        },
-                        axis=1
-                    ).tolist()
-                    
-                    bulk_operations.append(
-                        UpdateOne(
-                            {"video_id": video_id, "keyframe_index": frame_idx_int},
-                            {"$set": {"objects": objects_list}},
-                            upsert=True
-                        )
-                    )
-
-                if bulk_operations:
-                    logger.info(f"Executing bulk upsert for {len(bulk_operations)} frames for video_id '{video_id}'...")
-                    result = mongo_collection.bulk_write(bulk_operations)
-                    logger.info(f"Insert/Update complete for '{video_id}'. Inserted: {result.upserted_count}, Updated: {result.modified_count}\n")
-            
-            except Exception as e:
-                logger.error(f"An error occurred while processing {full_path}: {e}")
-    
-    logger.info(f"Object detection data ingestion complete.")
+def parse_transcript_csv(csv_path: str):
+    """
+    Parse một file transcript CSV thành các cột đã căn về keyframe.
+    Chạy được trong process pool (đọc FPS + keyframe map của video ngay trong worker).
+
+    Returns (video_id, frames, starts, ends, texts, row_ids) hoặc None nếu bỏ qua file.
+    """
+    video_id = Path(csv_path).stem
     
-def ingest_transcript_data(es_client: Elasticsearch, folder_path: str) -> None:
+    # --- CẬP NHẬT: Lấy FPS thực tế thay vì dùng config cứng ---
+    fps = get_video_fps(video_id)
+    # --------------------------------------------------------
+
+    df = pd.read_csv(csv_path)
+    df.columns = [col.strip().title() for col in df.columns]
+    required_columns = {"Start", "End", "Text"}
+    if not required_columns.issubset(df.columns):
+        logger.warning(f"Transcript file {csv_path} missing required columns; skipping")
+        return None
+
+    df = df.dropna(subset=["Text"])
+    df["Text"] = df["Text"].astype(str).str.strip()
+    df = df[df["Text"] != ""]
+    if df.empty:
+        return None
+
+    start_secs = pd.to_numeric(df["Start"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float32)
+    end_secs = pd.to_numeric(df["End"], errors="coerce").to_numpy(dtype=np.float32)
+    end_secs = np.where(np.isnan(end_secs), start_secs, end_secs)
+    end_secs = np.maximum(end_secs, start_secs)
+
+    # Tính toán frame dựa trên FPS thực tế của từng video
+    resolved_frames = np.maximum(0, np.rint(start_secs * fps).astype(np.int32))
+    resolved_starts = start_secs
+
+    # Nếu có map, cố gắng khớp với keyframe có sẵn
+    frame_map = _load_keyframe_map(video_id)
+    if frame_map:
+        resolved = _resolve_frames_from_map(frame_map, start_secs)
+        if resolved[0] is not None:
+            resolved_frames = resolved[0]
+            resolved_starts = resolved[1]
+
+    return (
+        video_id,
+        np.asarray(resolved_frames, dtype=np.int64),
+        np.round(np.asarray(resolved_starts, dtype=np.float64), 3),
+        np.round(end_secs.astype(np.float64), 3),
+        df["Text"].tolist(),
+        df.index.to_numpy(),
+    )
+
+
+def _parse_transcript_csv_safe(csv_path: str):
+    try:
+        return parse_transcript_csv(csv_path)
+    except Exception as exc:
+        logger.error(f"Failed to read {csv_path}: {exc}")
+        return None
+
+
+def _transcript_actions(parsed_files, registry: KeyframeRegistry):
+    """Bulk actions (generator) cho các file đã parse; kf_id được gán ở process chính."""
+    for parsed in parsed_files:
+        if parsed is None:
+            continue
+
+        video_id, frames, starts, ends, texts, row_ids = parsed
+        kf_ids = registry.ids_for(video_id, frames).tolist()
+        for kf_id, start, end, text, row_id in zip(
+            kf_ids, starts.tolist(), ends.tolist(), texts, row_ids.tolist()
+        ):
+            yield {
+                "_index": config.TRANSCRIPT_INDEX,
+                "_id": f"{kf_id}_{row_id}",
+                "_source": {
+                    "kf_id": kf_id,
+                    "start": start,
+                    "end": end,
+                    "text": text,
+                },
+            }
+
+
+def ingest_transcript_data(
+    es_client: Elasticsearch,
+    folder_path: str,
+    registry: KeyframeRegistry,
+    parallel: bool = None,
+) -> None:
+    """
+    Ingest transcript CSVs into Elasticsearch.
+
+    parallel=True (mặc định theo config.TRANSCRIPT_INGEST_PARALLEL) parse file
+    trong process pool và đẩy document qua parallel_bulk, với refresh/replicas
+    tắt trong lúc nạp. parallel=False giữ cách cũ: tuần tự, bulk từng chunk.
+    """
     logger.info("Ingesting transcript data into Elasticsearch...")
 
     transcripts_dir = Path(folder_path)
@@ -223,91 +481,81 @@ def ingest_transcript_data(es_client: Elasticsearch, folder_path: str) -> None:
         logger.error(f"Transcript directory not found: {transcripts_dir}")
         return
 
-    csv_files = sorted(transcripts_dir.glob("*.csv"))
+    csv_files = sorted(str(p) for p in transcripts_dir.glob("*.csv"))
     if not csv_files:
         logger.warning("No transcript CSV files found.")
         return
 
-    # Biến để đếm tổng số docs đã ingest
-    total_docs = 0
-    map_cache: dict[str, tuple[np.ndarray, np.ndarray] | None] = {}
-
-    for csv_path in csv_files:
-        video_id = csv_path.stem
-        
-        # --- CẬP NHẬT: Lấy FPS thực tế thay vì dùng config cứng ---
-        fps = get_video_fps(video_id)
-        # --------------------------------------------------------
-
-        try:
-            df = pd.read_csv(csv_path)
-        except Exception as exc:
-            logger.error(f"Failed to read {csv_path}: {exc}")
-            continue
-
-        df.columns = [col.strip().title() for col in df.columns]
-        required_columns = {"Start", "End", "Text"}
-        if not required_columns.issubset(df.columns):
-            logger.warning(f"Transcript file {csv_path} missing required columns; skipping")
-            continue
+    if parallel is None:
+        parallel = config.TRANSCRIPT_INGEST_PARALLEL
 
-        df = df.dropna(subset=["Text"])
-        df["Text"] = df["Text"].astype(str).str.strip()
-        df = df[df["Text"] != ""]
-        if df.empty:
-            continue
+    start_time = time.perf_counter()
+    total_docs = 0
+    failed_docs = 0
+
+    if not parallel:
+        parsed_files = (_parse_transcript_csv_safe(path) for path in csv_files)
+        success, errors = bulk(
+            es_client,
+            _transcript_actions(parsed_files, registry),
+            chunk_size=BULK_CHUNK_SIZE,
+            refresh=False,
+            raise_on_error=False,
+        )
+        total_docs, failed_docs = success, len(errors)
+        es_client.indices.refresh(index=config.TRANSCRIPT_INDEX)
+    else:
+        with ProcessPoolExecutor(max_workers=config.INGEST_WORKERS) as executor, \
+                bulk_indexing(es_client, config.TRANSCRIPT_INDEX):
+            parsed_files = executor.map(_parse_transcript_csv_safe, csv_files, chunksize=4)
+            for ok, item in parallel_bulk(
+                es_client,
+                _transcript_actions(parsed_files, registry),
+                thread_count=config.ES_BULK_THREADS,
+                chunk_size=config.ES_BULK_CHUNK_SIZE,
+                max_chunk_bytes=config.ES_BULK_MAX_CHUNK_BYTES,
+                queue_size=config.ES_BULK_THREADS * 2,
+                raise_on_error=False,
+            ):
+                if ok:
+                    total_docs += 1
+                else:
+                    failed_docs += 1
+                    if failed_docs <= 10:
+                        logger.error(f"Failed to index transcript document: {item}")
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Transcript ingestion complete. Total documents: {total_docs} "
+        f"({failed_docs} failed) in {elapsed:.1f}s ({total_docs / max(elapsed, 1e-9):.0f} docs/s)"
+    )
 
-        start_secs = pd.to_numeric(df["Start"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float32)
-        end_secs = pd.to_numeric(df["End"], errors="coerce").to_numpy(dtype=np.float32)
-        end_secs = np.where(np.isnan(end_secs), start_secs, end_secs)
-        end_secs = np.maximum(end_secs, start_secs)
-
-        # Tính toán frame dựa trên FPS thực tế của từng video
-        start_frames = np.maximum(0, np.rint(start_secs * fps).astype(np.int32))
-
-        if video_id not in map_cache:
-            map_cache[video_id] = _load_keyframe_map(video_id)
-        frame_map = map_cache[video_id]
-
-        resolved_frames = start_frames
-        resolved_starts = start_secs
-        
-        # Nếu có map, cố gắng khớp với keyframe có sẵn
-        if frame_map:
-            resolved = _resolve_frames_from_map(frame_map, start_secs)
-            if resolved[0] is not None:
-                resolved_frames = resolved[0]
-                resolved_starts = resolved[1]
-
-        texts = df["Text"].tolist()
-        row_ids = df.index.to_numpy()
-
-        actions = []
-        for idx in range(len(texts)):
-            action = {
-                "_index": config.TRANSCRIPT_INDEX,
-                "_id": f"{video_id}_{resolved_frames[idx]}_{row_ids[idx]}",
-                "_source": {
-                    "video_id": video_id,
-                    "keyframe_index": int(resolved_frames[idx]),
-                    "start": float(round(resolved_starts[idx], 3)),
-                    "end": float(round(end_secs[idx], 3)),
-                    "text": texts[idx],
-                },
-            }
-            actions.append(action)
+def build_local_transcript_index(
+    folder_path: str, registry: KeyframeRegistry, directory: str
+) -> None:
+    """
+    Build the in-process transcript index (config.TRANSCRIPT_BACKEND = "local")
+    from the same parsed CSVs as ingest_transcript_data.
+    """
+    logger.info("Building local transcript index...")
 
-            if len(actions) >= BULK_CHUNK_SIZE:
-                success, _ = bulk(es_client, actions, refresh=False)
-                total_docs += success
-                actions.clear()
+    transcripts_dir = Path(folder_path)
+    if not transcripts_dir.exists():
+        logger.error(f"Transcript directory not found: {transcripts_dir}")
+        return
 
-        if actions:
-            success, _ = bulk(es_client, actions, refresh=False)
-            total_docs += success
+    csv_files = sorted(str(p) for p in transcripts_dir.glob("*.csv"))
+    start_time = time.perf_counter()
+    builder = LocalTextIndexBuilder()
+    with ProcessPoolExecutor(max_workers=config.INGEST_WORKERS) as executor:
+        parsed_files = executor.map(_parse_transcript_csv_safe, csv_files, chunksize=4)
+        for action in _transcript_actions(parsed_files, registry):
+            source = action["_source"]
+            builder.add(source["kf_id"], source["start"], source["end"], source["text"])
 
-    es_client.indices.refresh(index=config.TRANSCRIPT_INDEX)
-    logger.info(f"Transcript ingestion complete. Total documents: {total_docs}")
+    builder.save(directory)
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"Local transcript index built: {len(builder)} segments in {elapsed:.1f}s")
 
 def main():
     # Cấu hình logging để hiện ra console khi chạy trực tiếp
@@ -317,39 +565,55 @@ def main():
         handlers=[logging.StreamHandler()]
     )
 
-    # --- Elasticsearch Ingestion ---
-    es_client = get_elasticsearch_client()
-    recreate_transcript_index(es_client) # Xóa index cũ và tạo lại
-    ingest_transcript_data(es_client, config.TRANSCRIPTS_DIR)
+    # --- Keyframe registry: kf_id dùng chung cho Milvus / MongoDB / Elasticsearch ---
+    registry = build_keyframe_registry()
+
+    # --- Transcript Ingestion (Elasticsearch hoặc index local) ---
+    if config.TRANSCRIPT_BACKEND == "local":
+        build_local_transcript_index(
+            config.TRANSCRIPTS_DIR, registry, config.LOCAL_TRANSCRIPT_INDEX_DIR
+        )
+    else:
+        es_client = get_elasticsearch_client()
+        recreate_transcript_index(es_client) # Xóa index cũ và tạo lại
+        ingest_transcript_data(es_client, config.TRANSCRIPTS_DIR, registry)
 
     # --- Milvus Ingestion ---
     connections.connect("default", host=config.MILVUS_HOST, port=config.MILVUS_PORT)
     kf_fields = [
-        FieldSchema(name="pk", dtype=DataType.INT64, is_primary=True, auto_id=True),
-        FieldSchema(name="video_id", dtype=DataType.VARCHAR, max_length=20),
-        FieldSchema(name="keyframe_index", dtype=DataType.INT64),
+        FieldSchema(name="kf_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
         FieldSchema(name="keyframe_vector", dtype=DataType.FLOAT_VECTOR, dim=config.VECTOR_DIMENSION)
     ]
     kf_schema = CollectionSchema(kf_fields, "Keyframe vectors")
-    kf_index_params = {"metric_type": "COSINE", "index_type": "IVF_FLAT", "params": {"nlist": 128}}
     
-    kf_collection = setup_milvus_collection(config.KEYFRAME_COLLECTION_NAME, kf_schema, "keyframe_vector", kf_index_params)
-    ingest_keyframe_data(kf_collection)
-
-    # --- MongoDB Ingestion ---
-    mongo_client = MongoClient(config.MONGO_URI)
-    object_collection = setup_mongodb_collection(
-        mongo_client,
-        config.MONGO_DB_NAME,
-        config.MONGO_OBJECT_COLLECTION,
-        drop_existing=True # Xóa collection cũ
-    )
-    ingest_object_detection_data(object_collection, folder_path=config.OBJECT_DETECTION_DIR)
-
-    logger.info("--- DATA INGESTION COMPLETE ---")
+    kf_collection = setup_milvus_collection(config.KEYFRAME_COLLECTION_NAME, kf_schema, "keyframe_vector", config.MILVUS_INDEX_PARAMS)
+    ingest_keyframe_data(kf_collection, registry)
+
+    # --- Object Ingestion (MongoDB hoặc index local) ---
+    mongo_client = None
+    if config.OBJECT_BACKEND == "local":
+        build_local_object_index(
+            config.OBJECT_DETECTION_DIR, registry, config.LOCAL_OBJECT_INDEX_DIR
+        )
+    else:
+        mongo_client = MongoClient(config.MONGO_URI)
+        object_collection = setup_mongodb_collection(
+            mongo_client,
+            config.MONGO_DB_NAME,
+            config.MONGO_OBJECT_COLLECTION,
+            drop_existing=True # Xóa collection cũ
+        )
+        ingest_object_detection_data(object_collection, folder_path=config.OBJECT_DETECTION_DIR, registry=registry)
+
+    registry.save(config.KEYFRAME_REGISTRY_PATH)
+
+    # Báo cho các server đang chạy rằng cache kết quả đã cũ
+    generation = bump_ingest_generation(config.INGEST_GENERATION_FILE)
+    logger.info(f"--- DATA INGESTION COMPLETE (generation {generation}) ---")
 
     # Close connections
-    mongo_client.close()
+    if mongo_client is not None:
+        mongo_client.close()
 
 if __name__ == "__main__":
     main()
@@ -1,13 +1,29 @@
 import json
 import logging
+import time
 
+import numpy as np
 from bson import json_util
 from elasticsearch import Elasticsearch
 from pymilvus import Collection, connections
 from pymongo import MongoClient
 
 import config
+from utils.columnar import ResultFrame, intersect_frames
 from utils.elasticsearch_client import get_elasticsearch_client
+from utils.keyframe_registry import KeyframeRegistry
+from utils.knn_graph import KnnGraph
+from utils.local_object_index import LocalObjectIndex
+from utils.local_text_index import LocalTextIndex
+from utils.partitions import BatchPartitions, batch_mask
+from utils.rerank import rerank_frame, rescore_exact
+from utils.result_cache import (
+    GenerationalLoader,
+    IngestGeneration,
+    SubSearchCache,
+    read_ingest_generation,
+)
+from utils.spatial import RELATIONS, region_mask
 from utils.text_encoder import TextEncoder
 from bson import json_util
 import json
@@ -16,6 +32,611 @@ import torch
 # --- Setup Logging ---
 logger = logging.getLogger(__name__)
 
+TRANSCRIPT_SOURCE_FIELDS = ["kf_id", "start", "end", "text"]
+
+
+def clip_frame(registry: KeyframeRegistry, kf_ids, scores) -> ResultFrame:
+    """
+    ResultFrame of CLIP hits. Milvus only holds near-duplicate cluster
+    representatives, so each hit expands to its cluster with the same clip_score.
+    """
+    kf_ids, columns = registry.expand_clusters(
+        kf_ids, clip_score=np.asarray(scores, dtype=np.float64)
+    )
+    return registry.to_frame(kf_ids, **columns)
+
+
+def clip_hits_to_frame(search_results, registry: KeyframeRegistry) -> ResultFrame:
+    """Convert a single-vector Milvus search result (primary key = kf_id) to a ResultFrame."""
+
+    if not search_results:
+        return ResultFrame.empty()
+
+    hits = search_results[0]
+    return clip_frame(registry, np.asarray(hits.ids, dtype=np.int64), hits.distances)
+
+
+def merge_clip_hits(search_results, merge: str, max_results: int):
+    """
+    Merge the hit lists of a multi-vector Milvus search per kf_id.
+    Returns (kf_ids, scores) sorted by merged score, at most max_results.
+
+    merge "max": best score over the query variants.
+    merge "mean": mean over variants; a keyframe missing from a variant's top-k
+    gets that variant's lowest returned score (an upper bound of its real score).
+    """
+    id_parts = [np.asarray(hits.ids, dtype=np.int64) for hits in search_results]
+    score_parts = [np.asarray(hits.distances, dtype=np.float64) for hits in search_results]
+    if not id_parts or not sum(len(ids) for ids in id_parts):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    kf_ids, inverse = np.unique(np.concatenate(id_parts), return_inverse=True)
+    all_scores = np.concatenate(score_parts)
+    if merge == "max":
+        scores = np.full(len(kf_ids), -np.inf)
+        np.maximum.at(scores, inverse, all_scores)
+    elif merge == "mean":
+        floors = [part.min() if len(part) else 0.0 for part in score_parts]
+        matrix = np.repeat(np.asarray(floors)[:, None], len(kf_ids), axis=1)
+        rows = np.repeat(np.arange(len(id_parts)), [len(ids) for ids in id_parts])
+        matrix[rows, inverse] = all_scores
+        scores = matrix.mean(axis=0)
+    else:
+        raise ValueError(f"Unknown merge mode '{merge}'.")
+
+    order = np.argsort(-scores, kind="stable")[:max_results]
+    return kf_ids[order], scores[order]
+
+
+def search_keyframes(
+    collection: Collection,
+    partitions: BatchPartitions,
+    data,
+    limit: int,
+    batches=None,
+    param: dict = None,
+):
+    """Milvus search on the keyframe vectors, restricted to the partitions of `batches`."""
+
+    partition_names = partitions.resolve(batches) if partitions is not None else None
+    if partition_names is not None and not partition_names:
+        return []
+    param = param or config.MILVUS_SEARCH_PARAMS
+    # HNSW: ef < limit bị Milvus từ chối, nâng lên đúng limit (vd. similar_search xin thêm hit)
+    if param.get("params", {}).get("ef", limit) < limit:
+        param = {**param, "params": {**param["params"], "ef": limit}}
+    return collection.search(
+        data=data,
+        anns_field="keyframe_vector",
+        param=param,
+        limit=limit,
+        output_fields=[],
+        partition_names=partition_names,
+    )
+
+
+# Index trả về cosine chính xác cho các hit: bước 2 không cần lấy lại vector
+EXACT_INDEX_TYPES = ("FLAT", "IVF_FLAT", "HNSW")
+
+
+def two_stage_clip_hits(
+    collection: Collection,
+    partitions: BatchPartitions,
+    query_vectors,
+    max_results: int,
+    merge: str = "max",
+    batches=None,
+    two_stage: bool = None,
+    timings: dict = None,
+):
+    """
+    CLIP hits as (kf_ids, scores), best first.
+
+    Compressed indexes (IVF_SQ8, IVF_PQ...) return approximate distances: stage 1
+    runs the tuned MILVUS_SEARCH_PARAMS but asks for RERANK_FIRST_STAGE_CANDIDATES
+    hits, stage 2 re-scores them with their exact stored vectors and keeps the
+    best max_results. Indexes that already return exact distances run a single
+    search. `timings` receives the milliseconds spent in each stage.
+    """
+    two_stage = config.RERANK_ENABLED if two_stage is None else two_stage
+    two_stage = two_stage and config.MILVUS_INDEX_PARAMS.get("index_type") not in EXACT_INDEX_TYPES
+    # Cùng nprobe đã tune, chỉ lấy nhiều ứng viên hơn cho bước chấm lại chính xác
+    limit = max(max_results, config.RERANK_FIRST_STAGE_CANDIDATES) if two_stage else max_results
+    timings = {} if timings is None else timings
+
+    start = time.perf_counter()
+    search_results = search_keyframes(collection, partitions, query_vectors, limit, batches)
+    kf_ids, scores = merge_clip_hits(search_results, merge, limit)
+    timings["first_stage_ms"] = (time.perf_counter() - start) * 1000
+
+    if not two_stage:
+        return kf_ids, scores
+
+    start = time.perf_counter()
+    found_ids, vectors = fetch_keyframe_vectors(collection, kf_ids)
+    kf_ids, scores = rescore_exact(kf_ids, scores, found_ids, vectors, query_vectors, merge)
+    timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+    return kf_ids[:max_results], scores[:max_results]
+
+
+def rerank_results(
+    frame: ResultFrame, transcript_frame: ResultFrame = None, object_frame: ResultFrame = None
+) -> ResultFrame:
+    """Second stage on the intersected results: CLIP score + transcript / object evidence."""
+
+    if not config.RERANK_ENABLED:
+        return frame
+    return rerank_frame(
+        frame,
+        config.RERANK_CANDIDATES,
+        transcript_frame,
+        object_frame,
+        transcript_weight=config.RERANK_TRANSCRIPT_WEIGHT,
+        object_weight=config.RERANK_OBJECT_WEIGHT,
+        transcript_window=config.RERANK_TRANSCRIPT_WINDOW,
+    )
+
+
+def restrict_to_batches(frame: ResultFrame, batches=None) -> ResultFrame:
+    # Cụm near-duplicate / collection chưa chia partition: lọc lại theo batch
+    if not batches or not len(frame):
+        return frame
+    return frame.take(np.flatnonzero(batch_mask(frame, batches)))
+
+
+def collapse_clusters(frame: ResultFrame, registry: KeyframeRegistry) -> ResultFrame:
+    """Keep the best-ranked row of each near-duplicate cluster (ingestion clusters)."""
+
+    keep = registry.cluster_first_mask(frame)
+    if keep.all():
+        return frame
+    return frame.take(np.flatnonzero(keep))
+
+
+def collapse_near_duplicates(
+    frame: ResultFrame,
+    registry: KeyframeRegistry,
+    knn_graph_loader: GenerationalLoader,
+    threshold: float = None,
+) -> ResultFrame:
+    """Keep the best-ranked keyframe of each group of near-duplicates (kNN graph)."""
+
+    if not len(frame):
+        return frame
+    try:
+        graph = knn_graph_loader.get()
+    except FileNotFoundError as e:
+        logger.warning(f"kNN graph unavailable, near-duplicates are not collapsed: {e}")
+        return frame
+
+    keep = graph.duplicate_mask(registry.frame_ids(frame), threshold)
+    logger.info(f"Near-duplicate collapse: {len(frame)} -> {int(keep.sum())} keyframes.")
+    return frame.take(np.flatnonzero(keep))
+
+
+def finalize_frames(
+    frames: dict,
+    query: dict,
+    registry: KeyframeRegistry,
+    knn_graph_loader: GenerationalLoader = None,
+) -> ResultFrame:
+    """
+    Final result set of a /search query (sync and async systems alike).
+    `frames`: stage -> ResultFrame in the fixed order clip, objects, transcript
+    (the first one is the baseline of the intersection). `query` is normalized.
+    """
+    logger.info(f"Intersecting {len(frames)} result sets.")
+    frame = intersect_frames(list(frames.values()))
+    # Object / transcript không chia partition: lọc batch trên tập kết quả cuối
+    frame = restrict_to_batches(frame, query.get("batches"))
+    frame = rerank_results(frame, frames.get("transcript"), frames.get("objects"))
+    # Cụm near-duplicate lúc ingest: CLIP trả cả cụm để giao, hiển thị một dòng mỗi cụm
+    frame = collapse_clusters(frame, registry)
+    # Gộp các frame gần như trùng nhau (đồ thị kNN), giữ frame xếp hạng cao nhất
+    if query.get("collapse_duplicates") and knn_graph_loader is not None:
+        frame = collapse_near_duplicates(frame, registry, knn_graph_loader)
+    return frame
+
+
+def warmup_milvus(collection: Collection, partitions: BatchPartitions, encoder: TextEncoder) -> None:
+    """Warm-up step: encode one query and run both CLIP search stages."""
+
+    query = (config.TEXT_ENCODER_WARMUP_QUERIES or ["warmup"])[0]
+    two_stage_clip_hits(collection, partitions, encoder.encode(query), 10)
+
+
+def run_warmup(steps: dict) -> dict:
+    """
+    Run the warm-up steps (name -> callable) in order and time them.
+    Returns {step: {ok, ms, error}}; a failing step is logged, not raised.
+    """
+    report = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            step()
+            report[name] = {"ok": True}
+        except Exception as e:
+            logger.warning(f"Warm-up step '{name}' failed: {e}")
+            report[name] = {"ok": False, "error": str(e)}
+        report[name]["ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    summary = ", ".join(f"{name} {step['ms']:.0f}ms" for name, step in report.items())
+    if warmup_ready(report):
+        logger.info(f"Search system ready (warm-up: {summary}).")
+    else:
+        failed = [name for name, step in report.items() if not step["ok"]]
+        logger.warning(f"Search system warmed up with failures {failed} ({summary}).")
+    return report
+
+
+def warmup_ready(report: dict) -> bool:
+    """Every warm-up step succeeded; without warm-up at startup, ready once initialized."""
+
+    if not report:
+        return not config.WARMUP_ON_STARTUP
+    return all(step["ok"] for step in report.values())
+
+
+def fetch_keyframe_vectors(collection: Collection, kf_ids: np.ndarray):
+    """Stored CLIP vectors of keyframes, by primary key: (kf_ids, vectors) in Milvus order."""
+
+    if not len(kf_ids):
+        return np.empty(0, dtype=np.int64), np.empty((0, config.VECTOR_DIMENSION), np.float32)
+
+    rows = collection.query(
+        expr=f"kf_id in {[int(kf_id) for kf_id in kf_ids]}",
+        output_fields=["kf_id", "keyframe_vector"],
+    )
+    found = np.asarray([row["kf_id"] for row in rows], dtype=np.int64)
+    vectors = np.asarray([row["keyframe_vector"] for row in rows], dtype=np.float32)
+    return found, vectors.reshape(len(found), -1)
+
+
+def rocchio_vector(positives: np.ndarray, negatives: np.ndarray = None, query_vector=None):
+    """
+    Rocchio query: ALPHA * text + BETA * mean(positives) - GAMMA * mean(negatives),
+    L2-normalized for the COSINE index. Returns shape (1, dim), float32.
+    """
+    vector = config.ROCCHIO_BETA * positives.mean(axis=0)
+    if negatives is not None and len(negatives):
+        vector = vector - config.ROCCHIO_GAMMA * negatives.mean(axis=0)
+    if query_vector is not None:
+        vector = vector + config.ROCCHIO_ALPHA * np.asarray(query_vector, dtype=np.float32).reshape(-1)
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    return vector.astype(np.float32)[None, :]
+
+
+def similar_search(
+    collection: Collection,
+    registry: KeyframeRegistry,
+    positives: list,
+    negatives: list = (),
+    max_results: int = 200,
+    query_vector=None,
+    partitions: BatchPartitions = None,
+    batches=None,
+) -> ResultFrame:
+    """
+    "More like this": one Milvus query for the example vectors, one search with
+    the Rocchio vector. The examples themselves are left out of the results.
+    """
+    # Ví dụ có thể là thành viên của một cụm: vector trong Milvus là của đại diện
+    positive_ids = registry.representative_of(registry.find_ids(positives))
+    negative_ids = registry.representative_of(registry.find_ids(negatives))
+    positive_ids = positive_ids[positive_ids >= 0]
+    negative_ids = negative_ids[negative_ids >= 0]
+
+    found, vectors = fetch_keyframe_vectors(
+        collection, np.concatenate([positive_ids, negative_ids])
+    )
+    is_positive = np.isin(found, positive_ids)
+    if not is_positive.any():
+        logger.warning("Similar search: none of the positive examples is indexed.")
+        return ResultFrame.empty()
+
+    search_results = search_keyframes(
+        collection,
+        partitions,
+        rocchio_vector(vectors[is_positive], vectors[~is_positive], query_vector),
+        max_results + len(found),
+        batches,
+    )
+    if not search_results:
+        return ResultFrame.empty()
+
+    hits = search_results[0]
+    kf_ids = np.asarray(hits.ids, dtype=np.int64)
+    scores = np.asarray(hits.distances, dtype=np.float64)
+    keep = np.flatnonzero(~np.isin(kf_ids, found))[:max_results]
+    frame = restrict_to_batches(clip_frame(registry, kf_ids[keep], scores[keep]), batches)
+
+    logger.info(
+        f"Similar: Found {len(frame)} keyframes from {int(is_positive.sum())} positive / "
+        f"{int((~is_positive).sum())} negative examples."
+    )
+    return frame
+
+
+def object_docs_to_frame(docs, registry: KeyframeRegistry) -> ResultFrame:
+    """Convert MongoDB documents projected on _id (= kf_id) and object_score to a ResultFrame."""
+
+    docs = list(docs)
+    kf_ids = np.fromiter((doc["_id"] for doc in docs), dtype=np.int64, count=len(docs))
+    if not any("object_score" in doc for doc in docs):
+        return registry.to_frame(kf_ids)
+    return registry.to_frame(kf_ids, object_score=[doc.get("object_score") for doc in docs])
+
+
+def _object_filter_expr(
+    label: str, min_confidence: float, region=None, min_area=None, var: str = "obj"
+) -> dict:
+    """$filter over `objects` for one label, confidence threshold and spatial constraints."""
+
+    conditions = [
+        {"$eq": [f"$${var}.class", label]},
+        {"$gte": [f"$${var}.confidence", min_confidence]},
+    ]
+    if region is not None:
+        # Box chồng lên ít nhất một ô của vùng (bitmask grid.cells)
+        conditions.append({"$ne": [{"$bitAnd": [f"$${var}.grid.cells", region_mask(region)]}, 0]})
+    if min_area is not None:
+        conditions.append({"$gte": [f"$${var}.grid.area", min_area]})
+
+    return {"$filter": {"input": "$objects", "as": var, "cond": {"$and": conditions}}}
+
+
+def _relation_expr(subject_expr: dict, relation: dict) -> dict:
+    """
+    Có ít nhất một cặp (subject, object) thỏa quan hệ vị trí.
+    left_of: min(subject.cx) < max(object.cx), tương tự cho các quan hệ khác.
+    """
+    axis, direction = RELATIONS[relation["position"]]
+    object_expr = _object_filter_expr(
+        relation["label"], relation.get("confidence", 0.0), var="rel"
+    )
+
+    def coords(expr, var):
+        return {"$map": {"input": expr, "as": var, "in": f"$${var}.grid.{axis}"}}
+
+    if direction < 0:
+        compare = {"$lt": [{"$min": coords(subject_expr, "s")}, {"$max": coords(object_expr, "o")}]}
+    else:
+        compare = {"$gt": [{"$max": coords(subject_expr, "s")}, {"$min": coords(object_expr, "o")}]}
+
+    # $min/$max của mảng rỗng là null, nên phải chặn trường hợp không có box
+    return {
+        "$and": [
+            {"$gt": [{"$size": subject_expr}, 0]},
+            {"$gt": [{"$size": object_expr}, 0]},
+            compare,
+        ]
+    }
+
+
+def build_object_pipeline(queries: list[dict], projection: dict = None) -> list[dict]:
+    """
+    MongoDB aggregation pipeline for object_search (see VideoRetrievalSystem.object_search).
+    An "object_score" field in the projection is computed: the mean over queries
+    of the best matching detection confidence (0 for a query without match).
+    """
+    # Extract all labels for pre-filtering
+    labels = list(set(q["label"] for q in queries))
+
+    pre_filter = {"objects.class": {"$in": labels}}
+
+    # Query bắt buộc có box trong vùng / đủ lớn: lọc sớm bằng $elemMatch
+    # (dùng index objects.class + objects.grid.cells) trước khi tính $expr
+    required_boxes = []
+    for query in queries:
+        if (query.get("min_instances") or 0) < 1:
+            continue
+        if query.get("region") is None and query.get("min_area") is None:
+            continue
+        elem = {"class": query["label"], "confidence": {"$gte": query.get("confidence", 0.0)}}
+        if query.get("region") is not None:
+            elem["grid.cells"] = {"$bitsAnySet": region_mask(query["region"])}
+        if query.get("min_area") is not None:
+            elem["grid.area"] = {"$gte": query["min_area"]}
+        required_boxes.append({"objects": {"$elemMatch": elem}})
+    if required_boxes:
+        pre_filter = {"$and": [pre_filter, *required_boxes]}
+
+    pipeline = [
+        # Pre-filter: Only documents that have at least one of the required labels
+        {"$match": pre_filter}
+    ]
+
+    # Build aggregation conditions
+    all_conditions = []
+    best_confidences = []
+
+    for query in queries:
+        label = query["label"]
+        min_confidence = query.get("confidence", 0.0)
+        min_instances = query.get("min_instances")
+        max_instances = query.get("max_instances")
+
+        if min_instances is None and max_instances is None:
+            raise ValueError(
+                f"Query for label '{label}' must have at least min_instances or max_instances."
+            )
+
+        filter_expr = _object_filter_expr(
+            label,
+            min_confidence,
+            region=query.get("region"),
+            min_area=query.get("min_area"),
+        )
+
+        size_expr = {"$size": filter_expr}
+        # $max của mảng rỗng là null -> 0
+        best_confidences.append(
+            {"$ifNull": [{"$max": {"$map": {"input": filter_expr, "as": "m", "in": "$$m.confidence"}}}, 0]}
+        )
+
+        query_conditions = []
+        if min_instances is not None:
+            query_conditions.append({"$gte": [size_expr, min_instances]})
+        if max_instances is not None:
+            query_conditions.append({"$lte": [size_expr, max_instances]})
+        if query.get("relation"):
+            query_conditions.append(_relation_expr(filter_expr, query["relation"]))
+
+        if len(query_conditions) == 1:
+            all_conditions.append(query_conditions[0])
+        else:
+            all_conditions.append({"$and": query_conditions})
+
+    # Add the expression match
+    pipeline.append(
+        {
+            "$match": {
+                "$expr": (
+                    {"$and": all_conditions}
+                    if len(all_conditions) > 1
+                    else all_conditions[0]
+                )
+            }
+        }
+    )
+
+    # Add projection if specified
+    if projection:
+        if "object_score" in projection:
+            projection = {**projection, "object_score": {"$avg": best_confidences}}
+        pipeline.append({"$project": projection})
+
+    return pipeline
+
+
+# Chỉ lấy các trường cần cho ResultFrame trong response của Elasticsearch
+TRANSCRIPT_FILTER_PATH = ["hits.hits._score", "hits.hits._source"]
+
+
+def build_transcript_query(query: str, tier: str = "full", mapping: str = None) -> dict:
+    """
+    Elasticsearch query for transcript_search.
+
+    tier "exact": phrase match, plus all terms present (no fuzzy expansion).
+    tier "full": phrase + fuzzy match + search-as-you-type (the original query).
+    `mapping` is the index mapping variant (config.TRANSCRIPT_INDEX_MAPPING).
+    """
+    mapping = mapping or config.TRANSCRIPT_INDEX_MAPPING
+    if mapping == "vietnamese":
+        return _build_vietnamese_transcript_query(query, tier)
+
+    if tier == "exact":
+        return {
+            "bool": {
+                "should": [
+                    {"match_phrase": {"text": {"query": query, "boost": 2.0}}},
+                    {"match": {"text": {"query": query, "operator": "and"}}},
+                ],
+                "minimum_should_match": 1,
+            }
+        }
+
+    return {
+        "bool": {
+            "should": [
+                {"match": {"text": {"query": query, "fuzziness": "AUTO"}}},
+                {"match_phrase": {"text": {"query": query}}},
+                {"match": {"text.as_you_type": {"query": query}}},
+            ],
+            "minimum_should_match": 1,
+        }
+    }
+
+
+def _build_vietnamese_transcript_query(query: str, tier: str) -> dict:
+    # Shingle khớp cụm 2-3 âm tiết bằng term lookup; câu 1 âm tiết không sinh shingle
+    should = [
+        {"match_phrase": {"text": {"query": query, "boost": 3.0}}},
+        {"match": {"text.shingle": {"query": query, "boost": 2.0}}},
+        {"match": {"text.shingle_folded": {"query": query, "boost": 1.5}}},
+        {"match": {"text.folded": {"query": query, "operator": "and"}}},
+    ]
+    if tier == "full":
+        # Từ gõ dở / thiếu dấu: edge n-gram thay cho fuzzy
+        should.append(
+            {"match": {"text.prefix": {"query": query, "operator": "and", "boost": 0.5}}}
+        )
+    return {"bool": {"should": should, "minimum_should_match": 1}}
+
+
+def transcript_search_tiers(mode: str = None) -> list[str]:
+    """Query tiers to run, in order, for a transcript search mode."""
+
+    mode = mode or config.TRANSCRIPT_SEARCH_MODE
+    if mode not in config.TRANSCRIPT_SEARCH_MODES:
+        raise ValueError(f"Unknown transcript search mode '{mode}'.")
+    return {"tiered": ["exact", "full"], "exact": ["exact"], "full": ["full"]}[mode]
+
+
+def transcript_search_kwargs(
+    query: str, max_results: int, tier: str, index: str = None, mapping: str = None
+) -> dict:
+    """Arguments of es_client.search for one tier of transcript_search."""
+
+    return {
+        "index": index or config.TRANSCRIPT_INDEX,
+        "size": max_results,
+        "query": build_transcript_query(query, tier, mapping),
+        "_source": TRANSCRIPT_SOURCE_FIELDS,
+        "track_total_hits": False,
+        "filter_path": TRANSCRIPT_FILTER_PATH,
+    }
+
+
+def transcript_hit_count(response) -> int:
+    return len(response.get("hits", {}).get("hits", []))
+
+
+def local_transcript_search(
+    index: LocalTextIndex,
+    registry: KeyframeRegistry,
+    query: str,
+    max_results: int,
+    tiers: list[str],
+) -> ResultFrame:
+    """transcript_search on the local index, with the same tier fallback as Elasticsearch."""
+
+    for tier in tiers:
+        columns = index.search(query, max_results, tier)
+        if len(columns["kf_id"]) >= min(config.TRANSCRIPT_MIN_EXACT_HITS, max_results):
+            break
+
+    logger.info(f"Local index: Found {len(columns['kf_id'])} transcript matches (tier '{tier}').")
+    return registry.to_frame(columns.pop("kf_id"), **columns)
+
+
+def transcript_hits_to_frame(response, registry: KeyframeRegistry) -> ResultFrame:
+    kf_ids, starts, ends, texts, scores = [], [], [], [], []
+    for hit in response.get("hits", {}).get("hits", []):
+        source = hit.get("_source", {})
+        kf_ids.append(source.get("kf_id"))
+        starts.append(source.get("start"))
+        ends.append(source.get("end"))
+        texts.append(source.get("text"))
+        scores.append(hit.get("_score"))
+
+    return registry.to_frame(
+        np.asarray(kf_ids, dtype=np.int64),
+        start=starts,
+        end=ends,
+        transcript_text=np.array(texts, dtype=object),
+        transcript_score=scores,
+    )
+
+
+# Projection mà object_search trả được trực tiếp từ ResultFrame
+FRAME_PROJECTION_FIELDS = {"_id", "video_id", "keyframe_index"}
+OBJECT_FRAME_PROJECTION = {"_id": 1, "object_score": 1}
+
 
 class VideoRetrievalSystem:
     def __init__(self, re_ingest=False):
@@ -30,7 +651,8 @@ class VideoRetrievalSystem:
         connections.connect("default", host=config.MILVUS_HOST, port=config.MILVUS_PORT)
         logger.info("Successfully connected to Milvus.")
         self.keyframes_collection = Collection(config.KEYFRAME_COLLECTION_NAME)
-        self.keyframes_collection.load()
+        # Nạp toàn bộ hoặc chỉ các batch "nóng" (config.MILVUS_LOADED_BATCHES)
+        self.partitions = BatchPartitions(self.keyframes_collection, config.MILVUS_LOADED_BATCHES)
 
         # --- MongoDB ---
         mongo_client = MongoClient(config.MONGO_URI)
@@ -46,41 +668,264 @@ class VideoRetrievalSystem:
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.encoder = TextEncoder(device=self.device)
 
-    def clip_search(self, query: str = "", max_results: int = 200) -> list:
+        # Cache kết quả từng truy vấn con, tự xoá khi ingest_data.main tăng generation
+        self.generation = IngestGeneration(
+            config.INGEST_GENERATION_FILE,
+            check_interval=config.INGEST_GENERATION_CHECK_SECONDS,
+        )
+        self.sub_search_cache = SubSearchCache(
+            max_bytes=config.SUB_SEARCH_CACHE_MAX_BYTES, generation=self.generation
+        )
+        self.registry_loader = GenerationalLoader(
+            lambda: KeyframeRegistry.load(config.KEYFRAME_REGISTRY_PATH),
+            self.generation,
+            name="keyframe registry",
+        )
+        # Backend "local": index trong process thay cho MongoDB / Elasticsearch
+        self.object_index_loader = GenerationalLoader(
+            lambda: LocalObjectIndex.load(config.LOCAL_OBJECT_INDEX_DIR),
+            self.generation,
+            name="local object index",
+        )
+        self.transcript_index_loader = GenerationalLoader(
+            lambda: LocalTextIndex.load(config.LOCAL_TRANSCRIPT_INDEX_DIR),
+            self.generation,
+            name="local transcript index",
+        )
+
+        # Đồ thị kNN dựng offline bởi build_knn_graph.py
+        self.knn_graph_loader = GenerationalLoader(
+            lambda: KnnGraph.load(
+                config.KNN_GRAPH_DIR, read_ingest_generation(config.INGEST_GENERATION_FILE)
+            ),
+            self.generation,
+            name="kNN graph",
+        )
+
+        self.warmup_report = {}
+
+    @property
+    def registry(self) -> KeyframeRegistry:
+        return self.registry_loader.get()
+
+    @property
+    def ready(self) -> bool:
+        return warmup_ready(self.warmup_report)
+
+    def warmup(self) -> dict:
+        """
+        Pay the first-query costs at startup: encoder kernels, lazy index loads,
+        Milvus / Elasticsearch / MongoDB connections. Returns {step: {ok, ms, error}}.
+        """
+        def transcripts():
+            if config.TRANSCRIPT_BACKEND == "local":
+                self.transcript_index_loader.get()
+            else:
+                self.es_client.search(**transcript_search_kwargs("warmup", 1, "exact"))
+
+        def objects():
+            if config.OBJECT_BACKEND == "local":
+                self.object_index_loader.get()
+            else:
+                self.object_collection.find_one({}, {"_id": 1})
+
+        self.warmup_report = run_warmup(
+            {
+                "registry": lambda: self.registry,
+                "encoder": lambda: self.encoder.warmup(config.WARMUP_BATCH_SIZES),
+                "milvus": lambda: warmup_milvus(
+                    self.keyframes_collection, self.partitions, self.encoder
+                ),
+                "transcripts": transcripts,
+                "objects": objects,
+            }
+        )
+        return self.warmup_report
+
+    def clip_search(self, query: str = "", max_results: int = 200, batches: list = None) -> list:
         """
         Searching on CLIP embeddings.
+        batches: only search these video batches (e.g. ["L01", "L02"]), one Milvus partition each.
         """
+        return self.clip_search_frame(query, max_results, batches).to_records()
+
+    def clip_search_frame(
+        self, query: str = "", max_results: int = 200, batches: list = None
+    ) -> ResultFrame:
         logger.info(f"--- Start searching on CLIP embeddings with query: '{query}' ---")
 
         if not query:
             logger.warning("Search initiated with no query data.")
-            return []
+            return ResultFrame.empty()
+
+        batches = tuple(sorted(set(batches))) if batches else None
+        return self.sub_search_cache.get_or_compute(
+            ("clip", query, max_results, batches),
+            lambda: self._clip_search(query, max_results, batches),
+        )
 
+    def _clip_search(self, query: str, max_results: int, batches=None) -> ResultFrame:
+        frame, _ = self.clip_search_stages(query, max_results, batches)
+        logger.info(f"CLIP: Found {len(frame)} potential keyframes.")
+        return frame
+
+    def clip_search_stages(
+        self, query: str, max_results: int = 200, batches: list = None, two_stage: bool = None
+    ):
+        """
+        Uncached CLIP search returning (frame, milliseconds per stage), as
+        measured by bench_mark.py. two_stage=None follows config.RERANK_ENABLED.
+        """
+        start = time.perf_counter()
         query_vector = self.encoder.encode(query)
+        timings = {"encode_ms": (time.perf_counter() - start) * 1000}
 
-        search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
+        kf_ids, scores = two_stage_clip_hits(
+            self.keyframes_collection,
+            self.partitions,
+            query_vector,
+            max_results,
+            batches=batches,
+            two_stage=two_stage,
+            timings=timings,
+        )
+        frame = restrict_to_batches(clip_frame(self.registry, kf_ids, scores), batches)
+        return frame, timings
+
+    def clip_search_multi(
+        self, queries: list[str], max_results: int = 200, merge: str = None, batches: list = None
+    ) -> list:
+        return self.clip_search_multi_frame(queries, max_results, merge, batches).to_records()
 
-        search_results = self.keyframes_collection.search(
-            data=query_vector,
-            anns_field="keyframe_vector",
-            param=search_params,
-            limit=max_results,
-            output_fields=["video_id", "keyframe_index"],
+    def clip_search_multi_frame(
+        self, queries: list[str], max_results: int = 200, merge: str = None, batches: list = None
+    ) -> ResultFrame:
+        """
+        CLIP search for several phrasings of the same query: one encoder batch,
+        one Milvus request with N vectors, scores merged per keyframe (max/mean).
+        """
+        queries = [query for query in queries if query]
+        if not queries:
+            return ResultFrame.empty()
+        if len(queries) == 1:
+            return self.clip_search_frame(queries[0], max_results, batches)
+
+        merge = merge or config.CLIP_MULTI_QUERY_MERGE
+        batches = tuple(sorted(set(batches))) if batches else None
+        logger.info(f"--- Start multi-query CLIP search ({len(queries)} variants, {merge}) ---")
+        return self.sub_search_cache.get_or_compute(
+            ("clip_multi", tuple(queries), max_results, merge, batches),
+            lambda: self._clip_search_multi(queries, max_results, merge, batches),
         )
 
-        keyframe_scores = []
-        if search_results:
-            for hit in search_results[0]:
-                keyframe_scores.append(
-                    {
-                        "video_id": hit.entity.get("video_id"),
-                        "keyframe_index": hit.entity.get("keyframe_index"),
-                        "clip_score": hit.distance,
-                    }
-                )
+    def _clip_search_multi(
+        self, queries: list[str], max_results: int, merge: str, batches=None
+    ) -> ResultFrame:
+        query_vectors = self.encoder.encode_batch(queries)
+
+        kf_ids, scores = two_stage_clip_hits(
+            self.keyframes_collection,
+            self.partitions,
+            query_vectors,
+            max_results,
+            merge,
+            batches,
+        )
+        frame = restrict_to_batches(clip_frame(self.registry, kf_ids, scores), batches)
+        logger.info(f"CLIP: Found {len(frame)} potential keyframes for {len(queries)} variants.")
+        return frame
+
+    def similar_search(
+        self,
+        positives: list,
+        negatives: list = (),
+        max_results: int = 200,
+        query: str = "",
+        batches: list = None,
+    ) -> list:
+        return self.similar_search_frame(
+            positives, negatives, max_results, query, batches
+        ).to_records()
+
+    def similar_search_frame(
+        self,
+        positives: list,
+        negatives: list = (),
+        max_results: int = 200,
+        query: str = "",
+        batches: list = None,
+    ) -> ResultFrame:
+        """
+        Query-by-example on the stored keyframe vectors (video_id, keyframe_index).
+        The text encoder only runs when `query` is given (Rocchio with a text term).
+        """
+        positives = [(video_id, int(kf)) for video_id, kf in positives]
+        negatives = [(video_id, int(kf)) for video_id, kf in negatives or ()]
+        if not positives:
+            logger.warning("Similar search initiated with no positive example.")
+            return ResultFrame.empty()
+
+        logger.info(
+            f"--- Start similar search: {len(positives)} positive, {len(negatives)} negative ---"
+        )
+        batches = tuple(sorted(set(batches))) if batches else None
+        return self.sub_search_cache.get_or_compute(
+            ("similar", tuple(positives), tuple(negatives), max_results, query, batches),
+            lambda: similar_search(
+                self.keyframes_collection,
+                self.registry,
+                positives,
+                negatives,
+                max_results,
+                self.encoder.encode(query) if query else None,
+                self.partitions,
+                batches,
+            ),
+        )
+
+    def load_batches(self, batches: list) -> list:
+        """Load the Milvus partitions of these batches into memory."""
+        return self.partitions.load(batches)
+
+    def release_batches(self, batches: list) -> list:
+        """Release the Milvus partitions of these batches; later searches skip them."""
+        return self.partitions.release(batches)
+
+    def neighbors_frame(self, video_id: str, keyframe_index: int, k: int = None) -> ResultFrame:
+        """
+        Precomputed nearest keyframes (clip_score = cosine), one row of the kNN graph.
+        Raises FileNotFoundError if build_knn_graph.py has not been run (or the
+        graph is from an older ingestion, StaleKnnGraphError).
+        """
+        registry = self.registry
+        kf_id = int(registry.find_ids([(video_id, keyframe_index)])[0])
+        if kf_id < 0:
+            return ResultFrame.empty()
+
+        kf_ids, scores = self.knn_graph_loader.get().neighbors_of(kf_id, k)
+        return registry.to_frame(kf_ids, clip_score=scores)
+
+    def rerank(
+        self,
+        frame: ResultFrame,
+        transcript_frame: ResultFrame = None,
+        object_frame: ResultFrame = None,
+    ) -> ResultFrame:
+        """Re-rank the top RERANK_CANDIDATES results with transcript proximity / object evidence."""
+
+        return rerank_results(frame, transcript_frame, object_frame)
+
+    def collapse_clusters(self, frame: ResultFrame) -> ResultFrame:
+        """Keep the best-ranked row of each near-duplicate cluster (ingestion clusters)."""
+        return collapse_clusters(frame, self.registry)
+
+    def collapse_near_duplicates(self, frame: ResultFrame, threshold: float = None) -> ResultFrame:
+        """Keep the best-ranked keyframe of each group of near-duplicates (kNN graph)."""
+        return collapse_near_duplicates(frame, self.registry, self.knn_graph_loader, threshold)
 
-        logger.info(f"CLIP: Found {len(keyframe_scores)} potential keyframes.")
-        return keyframe_scores
+    def finalize(self, frames: dict, query: dict) -> ResultFrame:
+        """Intersect, re-rank and collapse the sub-search results (see finalize_frames)."""
+        return finalize_frames(frames, query, self.registry, self.knn_graph_loader)
 
     def object_search(self, queries: list[dict], projection: dict = None) -> list[dict]:
         """
@@ -97,167 +942,100 @@ class VideoRetrievalSystem:
         if not queries:
             return []
 
-        try:
-            # Extract all labels for pre-filtering
-            labels = list(set(q["label"] for q in queries))
-
-            pipeline = [
-                # Pre-filter: Only documents that have at least one of the required labels
-                {"$match": {"objects.class": {"$in": labels}}}
-            ]
-
-            # Build aggregation conditions
-            all_conditions = []
-
-            for query in queries:
-                label = query["label"]
-                min_confidence = query.get("confidence", 0.0)
-                min_instances = query.get("min_instances")
-                max_instances = query.get("max_instances")
-
-                if min_instances is None and max_instances is None:
-                    raise ValueError(
-                        f"Query for label '{label}' must have at least min_instances or max_instances."
-                    )
-
-                filter_expr = {
-                    "$filter": {
-                        "input": "$objects",
-                        "as": "obj",
-                        "cond": {
-                            "$and": [
-                                {"$eq": ["$$obj.class", label]},
-                                {"$gte": ["$$obj.confidence", min_confidence]},
-                            ]
-                        },
-                    }
-                }
-
-                size_expr = {"$size": filter_expr}
-
-                query_conditions = []
-                if min_instances is not None:
-                    query_conditions.append({"$gte": [size_expr, min_instances]})
-                if max_instances is not None:
-                    query_conditions.append({"$lte": [size_expr, max_instances]})
-
-                if len(query_conditions) == 1:
-                    all_conditions.append(query_conditions[0])
-                else:
-                    all_conditions.append({"$and": query_conditions})
-
-            # Add the expression match
-            pipeline.append(
-                {
-                    "$match": {
-                        "$expr": (
-                            {"$and": all_conditions}
-                            if len(all_conditions) > 1
-                            else all_conditions[0]
-                        )
-                    }
-                }
-            )
-
-            # Add projection if specified
-            if projection:
-                pipeline.append({"$project": projection})
+        if (
+            projection and set(projection) <= FRAME_PROJECTION_FIELDS
+        ) or config.OBJECT_BACKEND == "local":
+            return self.object_search_frame(queries).to_records()
 
+        # Cần các trường khác (vd. objects): trả nguyên document, không cache
+        try:
+            pipeline = build_object_pipeline(queries, projection)
             results = list(self.object_collection.aggregate(pipeline))
+            registry = self.registry
+            for doc in results:
+                # _id là kf_id, trả lại video_id / keyframe_index cho client
+                if "_id" in doc:
+                    doc["video_id"], doc["keyframe_index"] = registry.decode(doc["_id"])
             logger.info(f"MongoDB: Found {len(results)} keyframes matching queries.")
             return json.loads(json_util.dumps(results))
-
         except Exception as e:
             logger.error(f"An error occurred during object search: {e}")
             return []
 
-    def transcript_search(self, query: str = "", max_results: int = 200) -> list[dict]:
-        if not query:
-            return []
+    def object_search_frame(self, queries: list[dict]) -> ResultFrame:
+        if not queries:
+            return ResultFrame.empty()
 
         try:
-            response = self.es_client.search(
-                index=config.TRANSCRIPT_INDEX,
-                size=max_results,
-                query={
-                    "bool": {
-                        "should": [
-                            {"match": {"text": {"query": query, "fuzziness": "AUTO"}}},
-                            {"match_phrase": {"text": {"query": query}}},
-                            {"match": {"text.as_you_type": {"query": query}}},
-                        ],
-                        "minimum_should_match": 1,
-                    }
-                },
-                _source=["video_id", "keyframe_index", "start", "end", "text"],
+            # Lỗi không được cache: chỉ kết quả hợp lệ mới đi vào get_or_compute
+            return self.sub_search_cache.get_or_compute(
+                ("objects", json.dumps(queries, sort_keys=True)),
+                lambda: self._object_search(queries),
             )
+        except Exception as e:
+            logger.error(f"An error occurred during object search: {e}")
+            return ResultFrame.empty()
 
-            hits = []
-            for hit in response.get("hits", {}).get("hits", []):
-                source = hit.get("_source", {})
-                hits.append(
-                    {
-                        "video_id": source.get("video_id"),
-                        "keyframe_index": source.get("keyframe_index"),
-                        "start": source.get("start"),
-                        "end": source.get("end"),
-                        "transcript_text": source.get("text"),
-                        "transcript_score": hit.get("_score"),
-                    }
-                )
+    def _object_search(self, queries: list[dict]) -> ResultFrame:
+        if config.OBJECT_BACKEND == "local":
+            kf_ids, scores = self.object_index_loader.get().search_scores(queries)
+            frame = self.registry.to_frame(kf_ids, object_score=scores)
+            logger.info(f"Local index: Found {len(frame)} keyframes matching queries.")
+            return frame
 
-            logger.info(f"Elasticsearch: Found {len(hits)} transcript matches.")
-            return hits
-        except Exception as e:
-            logger.error(f"An error occurred during transcript search: {e}")
-            return []
+        pipeline = build_object_pipeline(queries, OBJECT_FRAME_PROJECTION)
+        frame = object_docs_to_frame(self.object_collection.aggregate(pipeline), self.registry)
+        logger.info(f"MongoDB: Found {len(frame)} keyframes matching queries.")
+        return frame
 
-    def intersect(self, list_results: list[list[dict]]) -> list[dict]:
-        logger.info(f"Intersecting {len(list_results)} result sets.")
-        if not list_results:
-            return []
+    def transcript_search(
+        self, query: str = "", max_results: int = 200, mode: str = None
+    ) -> list[dict]:
+        return self.transcript_search_frame(query, max_results, mode).to_records()
+
+    def transcript_search_frame(
+        self, query: str = "", max_results: int = 200, mode: str = None
+    ) -> ResultFrame:
+        """
+        mode: "tiered" / "exact" / "full" (mặc định config.TRANSCRIPT_SEARCH_MODE).
+        """
+        if not query:
+            return ResultFrame.empty()
 
-        if len(list_results) == 1:
-            return list_results[0]
-
-        # --- Step 1: Create a lookup map and an initial set of identifiers ---
-        # We use the first list as our baseline. Any keyframe in the final
-        # intersection MUST be present in this first list.
-        # The lookup map allows us to reconstruct the full dictionary at the end.
-
-        first_list = list_results[0]
-        # The key is a tuple (video_id, keyframe_index), which is hashable.
-        # The value is the original keyframe dictionary.
-        lookup_map = {(kf["video_id"], kf["keyframe_index"]): kf for kf in first_list}
-
-        # This set contains the unique identifiers from the first list.
-        # This will be our "running intersection".
-        intersecting_ids = set(lookup_map.keys())
-
-        # --- Step 2: Iterate and intersect with the rest of the lists ---
-        # We start from the second list (index 1).
-        for other_list in list_results[1:]:
-            # Convert the current list into a set of its unique identifiers.
-            other_list_ids = set(
-                (kf["video_id"], kf["keyframe_index"]) for kf in other_list
+        try:
+            tiers = transcript_search_tiers(mode)
+            return self.sub_search_cache.get_or_compute(
+                ("transcript", query, max_results, tuple(tiers)),
+                lambda: self._transcript_search(query, max_results, tiers),
             )
+        except Exception as e:
+            logger.error(f"An error occurred during transcript search: {e}")
+            return ResultFrame.empty()
 
-            # Perform the core intersection logic.
-            # The "&=" operator updates a set with the intersection of itself
-            # and another set. It's highly efficient.
-            intersecting_ids &= other_list_ids
+    def _transcript_search(
+        self, query: str, max_results: int, tiers: list[str]
+    ) -> ResultFrame:
+        if config.TRANSCRIPT_BACKEND == "local":
+            return local_transcript_search(
+                self.transcript_index_loader.get(), self.registry, query, max_results, tiers
+            )
 
-            # Optimization: If the intersection ever becomes empty,
-            # we can stop early as the final result will also be empty.
-            if not intersecting_ids:
+        for tier in tiers:
+            response = self.es_client.search(
+                **transcript_search_kwargs(query, max_results, tier)
+            )
+            hits = transcript_hit_count(response)
+            # Đủ kết quả exact thì bỏ qua tầng fuzzy (đắt nhất)
+            if hits >= min(config.TRANSCRIPT_MIN_EXACT_HITS, max_results):
                 break
 
-        # --- Step 3: Convert the final set of identifiers back to a list of dicts ---
-        # We use our lookup_map to retrieve the original, full dictionary
-        # for each identifier that survived the intersection process.
-        final_results = [lookup_map[id_tuple] for id_tuple in intersecting_ids]
+        frame = transcript_hits_to_frame(response, self.registry)
+        logger.info(f"Elasticsearch: Found {len(frame)} transcript matches (tier '{tier}').")
+        return frame
 
-        return final_results
+    def intersect(self, frames: list[ResultFrame]) -> ResultFrame:
+        logger.info(f"Intersecting {len(frames)} result sets.")
+        return intersect_frames(frames)
 
 
 # --- Example Usage ---
@@ -1,5 +1,6 @@
 import { elements } from "./elements.js";
 
+// Trả về trang đầu: { result_id, results, total, offset, sort_by, cursor }
 export async function searchAPI(queryData) {
   elements.resultsContainer.innerHTML = "<p>Searching...</p>";
 
@@ -21,10 +22,79 @@ export async function searchAPI(queryData) {
   } catch (error) {
     console.error("Search failed:", error);
     elements.resultsContainer.innerHTML = `<p style="color: red;">An error occurred: ${error.message}</p>`;
-    return [];
+    return { results: [], total: 0, cursor: null };
   }
 }
 
+// Search dạng stream (/search/stream, NDJSON): gọi onEvent cho mỗi event
+// "partial" / "done", trả về event "done" (cùng dạng với searchAPI).
+export async function searchStreamAPI(queryData, onEvent) {
+  elements.resultsContainer.innerHTML = "<p>Searching...</p>";
+
+  try {
+    const response = await fetch("/search/stream", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(queryData),
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(
+        errorData.error || `HTTP error! status: ${response.status}`,
+      );
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let finalEvent = null;
+
+    const handleLine = (line) => {
+      if (!line.trim()) return;
+      const event = JSON.parse(line);
+      if (event.event === "error") throw new Error(event.error);
+      if (event.event === "done") finalEvent = event;
+      onEvent(event);
+    };
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let newline;
+      while ((newline = buffer.indexOf("\n")) >= 0) {
+        handleLine(buffer.slice(0, newline));
+        buffer = buffer.slice(newline + 1);
+      }
+    }
+    handleLine(buffer + decoder.decode());
+
+    if (!finalEvent) throw new Error("Search stream ended unexpectedly");
+    return finalEvent;
+  } catch (error) {
+    console.error("Search failed:", error);
+    elements.resultsContainer.innerHTML = `<p style="color: red;">An error occurred: ${error.message}</p>`;
+    return { results: [], total: 0, cursor: null };
+  }
+}
+
+// Lấy trang tiếp theo (cursor) hoặc sắp xếp lại ({ result_id, sort_by }) từ cache server
+export async function fetchPageAPI(pageRequest) {
+  const response = await fetch("/search/page", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(pageRequest),
+  });
+
+  const data = await response.json();
+  if (!response.ok) {
+    throw new Error(data.error || `HTTP error! status: ${response.status}`);
+  }
+  return data;
+}
+
 export async function loginAPI() {
   try {
     const response = await fetch("/api/login", {
@@ -1,10 +1,50 @@
 import { elements } from "./elements.js";
 import { initFilters, getObjectQueries } from "./filters.js";
-import { searchAPI, loginAPI } from "./api.js";
+import { searchStreamAPI, loginAPI, fetchPageAPI } from "./api.js";
 import { displayResults } from "./results.js";
 import { initVideoModal } from "./video-player.js";
 
 let currentResults = [];
+let nextCursor = null;
+
+// Nút "Load more" ở cuối danh sách, chỉ hiện khi server còn trang tiếp theo
+function renderLoadMore(total) {
+  document.getElementById("load-more-btn")?.remove();
+  if (!nextCursor) return;
+
+  const button = document.createElement("button");
+  button.id = "load-more-btn";
+  button.type = "button";
+  button.textContent = `Load more (${currentResults.length}/${total})`;
+  button.addEventListener("click", async () => {
+    button.disabled = true;
+    button.textContent = "Loading...";
+    try {
+      const page = await fetchPageAPI({ cursor: nextCursor });
+      nextCursor = page.cursor;
+      currentResults = currentResults.concat(page.results);
+      button.remove();
+      displayResults(page.results, true);
+      renderLoadMore(page.total);
+    } catch (error) {
+      // Cache hết hạn (410) hoặc lỗi mạng: yêu cầu search lại
+      button.disabled = false;
+      button.textContent = `Load more failed: ${error.message}`;
+    }
+  });
+  elements.resultsContainer.appendChild(button);
+}
+
+async function runSearch(queryData) {
+  // Hiển thị kết quả CLIP ngay khi có, sau đó lọc dần theo object / transcript
+  const page = await searchStreamAPI(queryData, (event) => {
+    if (event.event === "partial") displayResults(event.results);
+  });
+  currentResults = page.results || [];
+  nextCursor = page.cursor;
+  displayResults(currentResults);
+  renderLoadMore(page.total);
+}
 
 document.addEventListener("DOMContentLoaded", () => {
   // Initialize UI Logic
@@ -44,9 +84,17 @@ document.addEventListener("DOMContentLoaded", () => {
       audio: formData.get("audio"),
     };
 
-    const results = await searchAPI(queryData);
-    currentResults = results;
-    displayResults(currentResults);
+    await runSearch(queryData);
+  });
+
+  // "More like this" từ nút Similar trên card: dùng vector đã lưu của frame,
+  // vẫn giữ bộ lọc object đang chọn
+  document.addEventListener("similar-search", async (e) => {
+    await runSearch({
+      similar: { positives: [e.detail] },
+      objects: getObjectQueries(),
+    });
+    window.scrollTo({ top: 0, behavior: "instant" });
   });
 
   // 2. Scroll to Top Logic
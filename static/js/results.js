@@ -2,16 +2,21 @@ import { elements } from "./elements.js";
 import { openModal } from "./video-player.js";
 import { submitResultAPI } from "./api.js";
 
-export function displayResults(results) {
+// append = true: nối thêm trang mới vào cuối thay vì vẽ lại toàn bộ
+export function displayResults(results, append = false) {
   if (!results || results.length === 0) {
-    elements.resultsContainer.innerHTML =
-      '<p style="padding:10px;">No results found.</p>';
+    if (!append) {
+      elements.resultsContainer.innerHTML =
+        '<p style="padding:10px;">No results found.</p>';
+    }
     return;
   }
 
   // Mock variable để giữ màu highlight cho Clip Score
   const isSorted = true;
-  elements.resultsContainer.innerHTML = "";
+  if (!append) {
+    elements.resultsContainer.innerHTML = "";
+  }
 
   results.forEach((item) => {
     const resultElement = document.createElement("div");
@@ -23,6 +28,7 @@ export function displayResults(results) {
     resultElement.dataset.fps = item.fps;
     resultElement.style.cursor = "pointer";
 
+    // URL từng frame: ETag + Cache-Control immutable, trình duyệt chỉ tải mỗi frame một lần
     const imageUrl = `/keyframes/${item.video_id}/keyframe_${item.keyframe_index}.webp`;
 
     // Hover Preview Setup (Video ẩn để hover)
@@ -42,6 +48,8 @@ export function displayResults(results) {
     resultElement.innerHTML = `
         <img 
             src="${imageUrl}" 
+            loading="lazy" 
+            decoding="async" 
             alt="Frame from ${item.video_id}" 
             class="result-item-image" 
             onerror="this.onerror=null;this.src='/static/placeholder.png';"
@@ -57,6 +65,7 @@ export function displayResults(results) {
                   })
                   .join("")}
             </div>
+            <button class="card-similar-btn" type="button">Similar</button>
             <button class="card-submit-btn" type="button">Submit</button>
         </div>`;
 
@@ -154,7 +163,21 @@ export function displayResults(results) {
       }
     });
 
-    // 2. Click vào vùng còn lại -> Mở Video Modal
+    // 2. "More like this": main.js chạy /search/similar với frame này làm ví dụ
+    const similarBtn = resultElement.querySelector(".card-similar-btn");
+    similarBtn.addEventListener("click", (e) => {
+      e.stopPropagation(); // Ngăn mở modal
+      document.dispatchEvent(
+        new CustomEvent("similar-search", {
+          detail: {
+            video_id: item.video_id,
+            keyframe_index: item.keyframe_index,
+          },
+        }),
+      );
+    });
+
+    // 3. Click vào vùng còn lại -> Mở Video Modal
     resultElement.addEventListener("click", () => {
       const fps = parseFloat(item.fps) || 25;
       let startTime = item.keyframe_index / fps;
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from eval_server_stub import create_app
+from utils.eval_client import EvalServerClient, EvalServerError, SubmissionQueue
+
+
+@pytest.fixture
+def stub_server():
+    """Start eval_server_stub on a free local port, yield a function (url, app) taking create_app kwargs."""
+
+    servers = []
+
+    def start(**kwargs):
+        app = create_app(**kwargs)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}", app
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def make_client(url):
+    return EvalServerClient(url, retries=3, backoff_factor=0, timeout=5)
+
+
+def test_get_is_retried_on_503(stub_server):
+    url, app = stub_server(fail_every=2)
+    client = make_client(url)
+
+    ids = client.login("team", "secret")
+    # Lần gọi evaluation list thứ 2 trả 503, urllib3 gửi lại và nhận 200
+    assert client.get_evaluation_id(ids["sessionId"]) == "stub-evaluation"
+    assert app.config["counters"]["evaluation_list"] == 3
+
+
+def test_login_is_cached_per_credentials(stub_server):
+    url, app = stub_server()
+    client = make_client(url)
+
+    first = client.login("team", "secret")
+    assert client.login("team", "secret") == first
+    assert app.config["counters"] == {"login": 1, "evaluation_list": 1, "submit": 0}
+
+    # Mật khẩu khác hoặc refresh: phải login lại trên server
+    client.login("team", "other")
+    refreshed = client.login("team", "secret", refresh=True)
+    assert refreshed["sessionId"] != first["sessionId"]
+    assert app.config["counters"]["login"] == 3
+
+
+def test_login_failure_is_not_cached(stub_server):
+    url, app = stub_server()
+    client = make_client(url)
+
+    with pytest.raises(EvalServerError) as error:
+        client.login("team", "")
+    assert error.value.status_code == 401
+    client.login("team", "secret")
+    assert app.config["counters"]["login"] == 2
+
+
+def test_401_on_submit_invalidates_cached_login(stub_server):
+    url, app = stub_server()
+    client = make_client(url)
+
+    ids = client.login("team", "secret")
+    app.config["sessions"].clear()  # session hết hạn phía server
+
+    response = client.submit(ids["sessionId"], ids["evaluationId"], "L01_V001", 1000)
+    assert response.status_code == 401
+
+    fresh = client.login("team", "secret")
+    assert fresh["sessionId"] != ids["sessionId"]
+    assert app.config["counters"]["login"] == 2
+    response = client.submit(fresh["sessionId"], fresh["evaluationId"], "L01_V001", 1000)
+    assert response.status_code == 200
+
+
+def test_submission_queue_keeps_order(stub_server):
+    url, app = stub_server()
+    client = make_client(url)
+    ids = client.login("team", "secret")
+    submissions = SubmissionQueue(client, workers=1)
+
+    video_ids = [f"L01_V00{i}" for i in range(5)]
+    job_ids = [
+        submissions.submit(ids["sessionId"], ids["evaluationId"], video_id, 1000 * i)
+        for i, video_id in enumerate(video_ids)
+    ]
+    failed_job = submissions.submit("expired", ids["evaluationId"], "L01_V009", 0)
+    submissions._queue.join()
+
+    sent = [s["answerSets"][0]["answers"][0]["mediaItemName"] for s in app.config["submissions"]]
+    assert sent == video_ids
+    assert job_ids == sorted(job_ids, key=int)
+    for job_id in job_ids:
+        job = submissions.status(job_id)
+        assert job["status"] == "success"
+        assert job["remote_response"]["submission"] == "CORRECT"
+
+    failed = submissions.status(failed_job)
+    assert failed["status"] == "failed"
+    assert failed["status_code"] == 401
+    assert submissions.status("missing") is None
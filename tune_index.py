@@ -0,0 +1,306 @@
+"""
+Dò tham số index Milvus: recall@k so với latency trên các truy vấn của ground_truth.csv.
+
+    python tune_index.py                         # đo, in bảng + biên Pareto
+    python tune_index.py --plot pareto.png       # vẽ biểu đồ (cần matplotlib)
+    python tune_index.py --write                 # ghi cấu hình được chọn vào config.py
+    python tune_index.py --write --apply         # ... và build lại index của collection thật
+
+Các bước:
+  1. Encode caption của ground_truth.csv (một batch), nạp corpus vector giống
+     ingest_data (chỉ đại diện của các cụm near-duplicate).
+  2. Top-k chính xác (brute force, nhân ma trận theo khối) làm ground truth cho recall.
+  3. Với mỗi index ứng viên (IVF_FLAT / IVF_SQ8 / HNSW), build trên một collection
+     tạm, quét tham số search (nprobe / ef) và đo latency từng truy vấn (nq=1).
+  4. Chọn cấu hình nhanh nhất có recall >= --target-recall.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from pymilvus import Collection, connections, utility
+
+import config
+from utils.embeddings import load_embedding_corpus
+from utils.keyframe_registry import KeyframeRegistry
+from utils.text_encoder import TextEncoder
+
+INSERT_BATCH_SIZE = 10000
+EXACT_BLOCK_ROWS = 65536
+
+
+def load_index_corpus(registry):
+    """(kf_ids, float32 vectors) exactly as ingest_data puts them into Milvus."""
+
+    corpus, valid = load_embedding_corpus(registry)
+    kf_ids = np.arange(len(corpus), dtype=np.int64)
+    keep = valid & (registry.representative_of(kf_ids) == kf_ids)
+    return kf_ids[keep], corpus[keep]
+
+
+def exact_top_k(queries, corpus, k):
+    """Row positions of the exact cosine top-k (vectors are normalized)."""
+
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(corpus), EXACT_BLOCK_ROWS):
+        block = queries @ corpus[start:start + EXACT_BLOCK_ROWS].astype(np.float32).T
+        scores = np.concatenate([best_scores, block], axis=1)
+        rows = np.concatenate(
+            [best_rows, np.broadcast_to(np.arange(start, start + block.shape[1]), block.shape)],
+            axis=1,
+        )
+        top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return best_rows
+
+
+def candidate_indexes(num_vectors, k):
+    """(index_params, search param name, values to sweep) for every candidate index."""
+
+    # Gợi ý thường dùng: nlist ~ 4 * sqrt(N), thử thêm một mức lớn hơn
+    base_nlist = 2 ** max(6, round(math.log2(4 * math.sqrt(max(num_vectors, 1)))))
+    candidates = []
+    for index_type in ("IVF_FLAT", "IVF_SQ8"):
+        for nlist in (base_nlist, base_nlist * 4):
+            nprobes = [n for n in (8, 16, 32, 64, 128, 256) if n <= nlist]
+            candidates.append(
+                ({"index_type": index_type, "params": {"nlist": nlist}}, "nprobe", nprobes)
+            )
+    # HNSW: ef phải >= limit, kể cả limit lúc serving (/search lấy SEARCH_CLIP_MAX_RESULTS hit)
+    base_ef = max(k, config.SEARCH_CLIP_MAX_RESULTS)
+    for m in (16, 32):
+        index_params = {"index_type": "HNSW", "params": {"M": m, "efConstruction": 256}}
+        candidates.append((index_params, "ef", [base_ef, 2 * base_ef, 4 * base_ef]))
+    for index_params, _, _ in candidates:
+        index_params["metric_type"] = "COSINE"
+    return candidates
+
+
+def create_tuning_collection(name, kf_ids, vectors):
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    schema = Collection(config.KEYFRAME_COLLECTION_NAME).schema
+    collection = Collection(name, schema)
+    for start in range(0, len(kf_ids), INSERT_BATCH_SIZE):
+        end = start + INSERT_BATCH_SIZE
+        collection.insert([kf_ids[start:end].tolist(), vectors[start:end].astype(np.float32)])
+    collection.flush()
+    print(f"📦 Collection tạm '{name}': {collection.num_entities} vectors")
+    return collection
+
+
+def measure(collection, queries, exact_ids, k, search_params):
+    recalls, latencies = [], []
+    for query, truth in zip(queries, exact_ids):
+        start = time.perf_counter()
+        hits = collection.search(
+            data=query[None, :],
+            anns_field="keyframe_vector",
+            param=search_params,
+            limit=k,
+            output_fields=[],
+        )[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(hits.ids) & set(truth.tolist())) / len(truth))
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return float(np.mean(recalls)), float(p50), float(p95)
+
+
+def sweep(collection, candidates, queries, exact_ids, k):
+    results = []
+    for index_params, param_name, values in candidates:
+        collection.release()
+        collection.drop_index()
+        start = time.time()
+        collection.create_index(field_name="keyframe_vector", index_params=index_params)
+        utility.wait_for_index_building_complete(collection.name)
+        build_seconds = time.time() - start
+        collection.load()
+
+        # Vài lượt nháp cho cache / segment đã nạp
+        for query in queries[:5]:
+            collection.search(
+                data=query[None, :],
+                anns_field="keyframe_vector",
+                param={"metric_type": "COSINE", "params": {param_name: values[0]}},
+                limit=k,
+            )
+
+        for value in values:
+            search_params = {"metric_type": "COSINE", "params": {param_name: value}}
+            recall, p50, p95 = measure(collection, queries, exact_ids, k, search_params)
+            results.append(
+                {
+                    "index_params": index_params,
+                    "search_params": search_params,
+                    "recall": recall,
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "build_seconds": build_seconds,
+                }
+            )
+            print(
+                f"{index_params['index_type']:<9}{json.dumps(index_params['params']):<34}"
+                f"{param_name}={value:<6}{f'R@{k}':>7} {recall:6.3f}{p50:>9.2f}{p95:>9.2f}"
+            )
+    return results
+
+
+def pareto_frontier(results):
+    """Configurations no other configuration beats on both latency and recall."""
+
+    frontier, best_recall = [], -1.0
+    for result in sorted(results, key=lambda r: (r["p50_ms"], -r["recall"])):
+        if result["recall"] > best_recall:
+            frontier.append(result)
+            best_recall = result["recall"]
+    return frontier
+
+
+def choose(frontier, target_recall):
+    for result in frontier:
+        if result["recall"] >= target_recall:
+            return result
+    return frontier[-1]
+
+
+def plot(results, frontier, chosen, k, path):
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("⚠️ Chưa cài matplotlib, bỏ qua biểu đồ.")
+        return
+
+    fig, ax = plt.subplots(figsize=(9, 6))
+    for index_type in sorted({r["index_params"]["index_type"] for r in results}):
+        points = [r for r in results if r["index_params"]["index_type"] == index_type]
+        ax.scatter(
+            [r["p50_ms"] for r in points], [r["recall"] for r in points], label=index_type, alpha=0.7
+        )
+    ax.plot([r["p50_ms"] for r in frontier], [r["recall"] for r in frontier], "k--", label="Pareto")
+    ax.scatter(
+        [chosen["p50_ms"]], [chosen["recall"]],
+        s=160, facecolors="none", edgecolors="red", label="chosen",
+    )
+    ax.set_xlabel("p50 latency (ms, nq=1)")
+    ax.set_ylabel(f"recall@{k}")
+    ax.grid(True, alpha=0.3)
+    ax.legend()
+    fig.savefig(path, dpi=120, bbox_inches="tight")
+    print(f"📈 Đã lưu biểu đồ: {path}")
+
+
+def write_config(chosen, path="config.py"):
+    """Rewrite the MILVUS_INDEX_PARAMS / MILVUS_SEARCH_PARAMS lines of config.py."""
+
+    with open(path, "r", encoding="utf-8") as f:
+        source = f.read()
+    settings = (("MILVUS_INDEX_PARAMS", "index_params"), ("MILVUS_SEARCH_PARAMS", "search_params"))
+    for name, key in settings:
+        source, count = re.subn(
+            rf"^{name} = .*$", f"{name} = {json.dumps(chosen[key])}", source, count=1, flags=re.M
+        )
+        if not count:
+            raise RuntimeError(f"{name} not found in {path}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(source)
+    print(f"📝 Đã ghi cấu hình vào {path}")
+
+
+def apply_index(index_params):
+    """Rebuild the index of the live collection (no re-ingest needed)."""
+
+    collection = Collection(config.KEYFRAME_COLLECTION_NAME)
+    collection.release()
+    collection.drop_index()
+    collection.create_index(field_name="keyframe_vector", index_params=index_params)
+    utility.wait_for_index_building_complete(collection.name)
+    collection.load()
+    print(f"✅ Đã build lại index của '{collection.name}': {index_params}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep Milvus index / search parameters")
+    parser.add_argument("--queries", default="ground_truth.csv")
+    parser.add_argument("--max-queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=config.SEARCH_CLIP_MAX_RESULTS)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--plot", default=None, help="path of the Pareto plot (PNG)")
+    parser.add_argument("--write", action="store_true", help="write the chosen settings to config.py")
+    parser.add_argument("--apply", action="store_true", help="rebuild the live collection's index")
+    parser.add_argument("--keep-collection", action="store_true")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.queries)
+    df.columns = df.columns.str.strip()
+    captions = df["caption"].dropna().astype(str).tolist()[: args.max_queries]
+
+    encoder = TextEncoder(device="cuda" if torch.cuda.is_available() else "cpu")
+    query_vectors = np.vstack(
+        [encoder.encode_batch(captions[i:i + 64]) for i in range(0, len(captions), 64)]
+    )
+
+    registry = KeyframeRegistry.load(config.KEYFRAME_REGISTRY_PATH)
+    corpus_ids, corpus = load_index_corpus(registry)
+    print(f"⚡ {len(captions)} truy vấn, {len(corpus_ids)} vectors, k={args.k}")
+
+    exact_ids = corpus_ids[exact_top_k(query_vectors, corpus, args.k)]
+
+    connections.connect("default", host=config.MILVUS_HOST, port=config.MILVUS_PORT)
+    tuning_collection = create_tuning_collection(
+        f"{config.KEYFRAME_COLLECTION_NAME}_tuning", corpus_ids, corpus
+    )
+    try:
+        print("\n" + "─" * 80)
+        candidates = candidate_indexes(len(corpus_ids), args.k)
+        results = sweep(tuning_collection, candidates, query_vectors, exact_ids, args.k)
+    finally:
+        if not args.keep_collection:
+            tuning_collection.release()
+            utility.drop_collection(tuning_collection.name)
+
+    frontier = pareto_frontier(results)
+    chosen = choose(frontier, args.target_recall)
+    print("─" * 80 + "\nPareto:")
+    for result in frontier:
+        marker = "👉" if result is chosen else "  "
+        print(
+            f"{marker} {json.dumps(result['index_params'])} "
+            f"{json.dumps(result['search_params']['params'])} R@{args.k}={result['recall']:.3f} "
+            f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms"
+        )
+
+    os.makedirs(os.path.dirname(config.MILVUS_TUNING_REPORT) or ".", exist_ok=True)
+    with open(config.MILVUS_TUNING_REPORT, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "k": args.k,
+                "num_queries": len(captions),
+                "num_vectors": len(corpus_ids),
+                "chosen": chosen,
+                "pareto": frontier,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"📝 Báo cáo: {config.MILVUS_TUNING_REPORT}")
+
+    if args.plot:
+        plot(results, frontier, chosen, args.k, args.plot)
+    if args.write:
+        write_config(chosen)
+    if args.apply:
+        apply_index(chosen["index_params"])
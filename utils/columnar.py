@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import orjson
+
+
+class VideoIdTable:
+    """Process-wide interning of video_id strings to dense int32 codes."""
+
+    def __init__(self):
+        self._codes: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._lock = threading.Lock()
+
+    def encode(self, video_ids: Iterable[str]) -> np.ndarray:
+        video_ids = list(video_ids)
+        codes = self._codes
+        out = []
+        missing = False
+        for video_id in video_ids:
+            code = codes.get(video_id)
+            if code is None:
+                missing = True
+                break
+            out.append(code)
+
+        if missing:
+            # Đường chậm, chỉ khi có video_id chưa gặp
+            with self._lock:
+                out = []
+                for video_id in video_ids:
+                    code = codes.get(video_id)
+                    if code is None:
+                        code = len(self._ids)
+                        codes[video_id] = code
+                        self._ids.append(video_id)
+                    out.append(code)
+        return np.asarray(out, dtype=np.int32)
+
+    def decode(self, codes: np.ndarray) -> List[str]:
+        ids = self._ids
+        return [ids[code] for code in codes.tolist()]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+VIDEO_IDS = VideoIdTable()
+
+
+class ResultFrame:
+    """
+    Columnar search result: one row per keyframe hit.
+
+    `video_codes` are VIDEO_IDS codes, `keyframe_indices` the keyframe numbers,
+    and `columns` holds per-row values such as clip_score (float64 arrays) or
+    transcript_text (object arrays). Frames are treated as immutable, so they
+    can be shared between caches and requests without copying. Dicts are only
+    built at serialization time by to_records().
+    """
+
+    __slots__ = ("video_codes", "keyframe_indices", "columns", "_keys")
+
+    def __init__(
+        self,
+        video_codes: np.ndarray,
+        keyframe_indices: np.ndarray,
+        columns: Optional[Dict[str, np.ndarray]] = None,
+    ):
+        self.video_codes = np.asarray(video_codes, dtype=np.int32)
+        self.keyframe_indices = np.asarray(keyframe_indices, dtype=np.int64)
+        self.columns = columns or {}
+        self._keys = None
+
+    @classmethod
+    def empty(cls) -> "ResultFrame":
+        return cls(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def from_arrays(
+        cls,
+        video_ids: Sequence[str],
+        keyframe_indices: Sequence[int],
+        **columns: Any,
+    ) -> "ResultFrame":
+        return cls(
+            VIDEO_IDS.encode(video_ids),
+            np.asarray(keyframe_indices, dtype=np.int64),
+            {name: _as_column(values) for name, values in columns.items()},
+        )
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "ResultFrame":
+        if not records:
+            return cls.empty()
+
+        names = [
+            name for name in records[0] if name not in ("video_id", "keyframe_index")
+        ]
+        return cls.from_arrays(
+            [r["video_id"] for r in records],
+            [r["keyframe_index"] for r in records],
+            **{name: [r.get(name) for r in records] for name in names},
+        )
+
+    def __len__(self) -> int:
+        return len(self.keyframe_indices)
+
+    @property
+    def keys(self) -> np.ndarray:
+        """int64 join key per row: (video code << 32) | keyframe_index."""
+
+        if self._keys is None:
+            self._keys = (self.video_codes.astype(np.int64) << 32) | self.keyframe_indices
+        return self._keys
+
+    @property
+    def nbytes(self) -> int:
+        size = self.video_codes.nbytes + self.keyframe_indices.nbytes
+        for values in self.columns.values():
+            size += values.nbytes
+            if values.dtype == object:
+                size += sum(len(v) for v in values.tolist() if isinstance(v, str))
+        return size
+
+    @property
+    def video_ids(self) -> List[str]:
+        return VIDEO_IDS.decode(self.video_codes)
+
+    def take(self, indices) -> "ResultFrame":
+        return ResultFrame(
+            self.video_codes[indices],
+            self.keyframe_indices[indices],
+            {name: values[indices] for name, values in self.columns.items()},
+        )
+
+    def head(self, n: int) -> "ResultFrame":
+        return self.take(slice(0, n))
+
+    def with_columns(self, **columns: Any) -> "ResultFrame":
+        merged = dict(self.columns)
+        merged.update({name: _as_column(values) for name, values in columns.items()})
+        return ResultFrame(self.video_codes, self.keyframe_indices, merged)
+
+    def order(self, sort_by: str) -> np.ndarray:
+        """
+        Row order for sort_by: "relevance" (current order), "video"
+        (video_id, keyframe_index) or a score column, descending with
+        missing values last.
+        """
+        if sort_by == "relevance":
+            return np.arange(len(self))
+        if sort_by == "video":
+            video_ids = np.array(self.video_ids, dtype=str)
+            return np.lexsort((self.keyframe_indices, video_ids))
+
+        values = self.columns.get(sort_by)
+        if values is None:
+            return np.arange(len(self))
+        values = values.astype(np.float64)
+        return np.argsort(np.where(np.isnan(values), np.inf, -values), kind="stable")
+
+    def to_records(self, **extra: Sequence[Any]) -> List[Dict[str, Any]]:
+        """Materialize rows as dicts; `extra` adds per-row fields (e.g. fps)."""
+
+        names = ["video_id", "keyframe_index", *self.columns, *extra]
+        values = [
+            self.video_ids,
+            self.keyframe_indices.tolist(),
+            *(_column_values(v) for v in self.columns.values()),
+            *(list(v) for v in extra.values()),
+        ]
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def _as_column(values: Any) -> np.ndarray:
+    if isinstance(values, np.ndarray):
+        return values
+
+    values = list(values)
+    if all(v is None or isinstance(v, (int, float, np.number)) for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array(values, dtype=object)
+
+
+def _column_values(values: np.ndarray) -> list:
+    # NaN là "không có giá trị" trong cột số, xuất ra JSON thành null
+    if values.dtype.kind == "f":
+        return [None if v != v else v for v in values.tolist()]
+    return values.tolist()
+
+
+def _first_occurrence(keys: np.ndarray) -> np.ndarray:
+    """Row indices of the first occurrence of each key, in original row order."""
+
+    _, first = np.unique(keys, return_index=True)
+    return np.sort(first)
+
+
+def intersect_frames(frames: List[ResultFrame]) -> ResultFrame:
+    """
+    Keyframes present in every frame.
+
+    The first frame is the baseline: its row order is kept (first occurrence
+    of each keyframe). Columns from the other frames are merged in, taking
+    each keyframe's first row there, which is the best one when the frame is
+    sorted by score.
+    """
+    if not frames:
+        return ResultFrame.empty()
+    if len(frames) == 1:
+        return frames[0]
+
+    base = frames[0].take(_first_occurrence(frames[0].keys))
+    mask = np.ones(len(base), dtype=bool)
+    for other in frames[1:]:
+        mask &= np.isin(base.keys, other.keys)
+        if not mask.any():
+            return ResultFrame.empty()
+
+    result = base.take(np.flatnonzero(mask))
+    merged = {}
+    for other in frames[1:]:
+        other_first = other.take(_first_occurrence(other.keys))
+        order = np.argsort(other_first.keys)
+        positions = order[np.searchsorted(other_first.keys, result.keys, sorter=order)]
+        for name, values in other_first.columns.items():
+            if name not in result.columns and name not in merged:
+                merged[name] = values[positions]
+
+    return result.with_columns(**merged) if merged else result
+
+
+def dumps(payload: Any) -> bytes:
+    """Fast JSON serialization for API responses (numpy scalars/arrays allowed)."""
+
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import logging
+from contextlib import contextmanager
 from functools import lru_cache
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from elasticsearch import BadRequestError, Elasticsearch
 
@@ -22,8 +23,21 @@ def get_elasticsearch_client() -> Elasticsearch:
     return Elasticsearch(hosts=[host], request_timeout=30)
 
 
-def transcript_index_mapping() -> Dict[str, Any]:
-    """Default mapping/settings for the transcript index."""
+def transcript_index_mapping(variant: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Mapping/settings for the transcript index.
+
+    variant "standard" (default): one folded analyzer, fuzzy + search-as-you-type.
+    variant "vietnamese": unfolded `text` plus subfields for folded terms,
+    2-3 syllable shingles (folded / unfolded) and edge n-gram prefixes, so
+    multi-syllable words and partial queries are exact term lookups.
+    """
+
+    variant = variant or config.TRANSCRIPT_INDEX_MAPPING
+    if variant == "vietnamese":
+        return _vietnamese_transcript_mapping()
+    if variant != "standard":
+        raise ValueError(f"Unknown transcript index mapping '{variant}'")
 
     return {
         "settings": {
@@ -39,8 +53,7 @@ def transcript_index_mapping() -> Dict[str, Any]:
         },
         "mappings": {
             "properties": {
-                "video_id": {"type": "keyword"},
-                "keyframe_index": {"type": "integer"},
+                "kf_id": {"type": "long"},
                 "start": {"type": "float"},
                 "end": {"type": "float"},
                 "text": {
@@ -53,29 +66,118 @@ def transcript_index_mapping() -> Dict[str, Any]:
     }
 
 
-def recreate_transcript_index(client: Elasticsearch) -> None:
+def _vietnamese_transcript_mapping() -> Dict[str, Any]:
+    def analyzer(*filters: str) -> Dict[str, Any]:
+        return {"type": "custom", "tokenizer": "standard", "filter": list(filters)}
+
+    return {
+        "settings": {
+            "analysis": {
+                "filter": {
+                    # Từ tiếng Việt thường gồm 2-3 âm tiết
+                    "vi_shingle": {
+                        "type": "shingle",
+                        "min_shingle_size": 2,
+                        "max_shingle_size": 3,
+                        "output_unigrams": False,
+                    },
+                    "vi_edge_ngram": {"type": "edge_ngram", "min_gram": 1, "max_gram": 15},
+                },
+                "analyzer": {
+                    "transcript_unfolded": analyzer("lowercase"),
+                    "transcript_folded": analyzer("lowercase", "asciifolding"),
+                    "transcript_shingle": analyzer("lowercase", "vi_shingle"),
+                    "transcript_shingle_folded": analyzer(
+                        "lowercase", "asciifolding", "vi_shingle"
+                    ),
+                    "transcript_prefix": analyzer(
+                        "lowercase", "asciifolding", "vi_edge_ngram"
+                    ),
+                },
+            }
+        },
+        "mappings": {
+            "properties": {
+                "kf_id": {"type": "long"},
+                "start": {"type": "float"},
+                "end": {"type": "float"},
+                "text": {
+                    "type": "text",
+                    "analyzer": "transcript_unfolded",
+                    "fields": {
+                        "folded": {"type": "text", "analyzer": "transcript_folded"},
+                        "shingle": {"type": "text", "analyzer": "transcript_shingle"},
+                        "shingle_folded": {
+                            "type": "text",
+                            "analyzer": "transcript_shingle_folded",
+                        },
+                        "prefix": {
+                            "type": "text",
+                            "analyzer": "transcript_prefix",
+                            "search_analyzer": "transcript_folded",
+                        },
+                    },
+                },
+            }
+        },
+    }
+
+
+def recreate_transcript_index(
+    client: Elasticsearch,
+    index: Optional[str] = None,
+    variant: Optional[str] = None,
+) -> None:
     """Drop and recreate the transcript index for deterministic ingestion."""
 
-    mapping = transcript_index_mapping()
+    index = index or config.TRANSCRIPT_INDEX
+    mapping = transcript_index_mapping(variant)
 
     try:
         client.indices.delete(
-            index=config.TRANSCRIPT_INDEX,
+            index=index,
             ignore_unavailable=True,
         )
     except BadRequestError as exc:
         logger.warning(
             "Failed to delete transcript index '%s' before recreate: %s",
-            config.TRANSCRIPT_INDEX,
+            index,
             exc,
         )
 
     try:
-        client.indices.create(index=config.TRANSCRIPT_INDEX, body=mapping)
+        client.indices.create(index=index, body=mapping)
     except BadRequestError as exc:
         logger.error(
             "Failed to create transcript index '%s': %s",
-            config.TRANSCRIPT_INDEX,
+            index,
             exc,
         )
         raise
+
+
+@contextmanager
+def bulk_indexing(client: Elasticsearch, index: str):
+    """
+    Disable refresh and replicas on `index` while bulk loading, then restore
+    the previous values (null resets to the cluster default) and refresh once.
+    """
+
+    names = ("index.refresh_interval", "index.number_of_replicas")
+    current = client.indices.get_settings(
+        index=index, name=",".join(names), flat_settings=True
+    )
+    previous = current.get(index, {}).get("settings", {})
+    restore = {name: previous.get(name) for name in names}
+
+    client.indices.put_settings(
+        index=index,
+        settings={"index.refresh_interval": "-1", "index.number_of_replicas": 0},
+    )
+    logger.info("Bulk indexing on '%s': refresh and replicas disabled", index)
+    try:
+        yield
+    finally:
+        client.indices.put_settings(index=index, settings=restore)
+        client.indices.refresh(index=index)
+        logger.info("Bulk indexing on '%s' finished, settings restored: %s", index, restore)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+import config
+from utils.keyframe_registry import KeyframeRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_files(video_path: Path) -> List[Tuple[int, Path]]:
+    """(frame_idx, path) của các file .pt trong thư mục video, sắp theo frame_idx."""
+    files = []
+    for pt_file in video_path.glob("*.pt"):
+        try:
+            files.append((int(pt_file.stem.split("_")[-1]), pt_file))
+        except ValueError:
+            logger.warning(f"Skipping embedding with unexpected name: {pt_file}")
+    return sorted(files)
+
+
+def video_dirs(root: Optional[str] = None) -> List[Path]:
+    root = Path(root or config.CLIP_FEATURES_DIR)
+    if not root.exists():
+        logger.error(f"Embeddings directory not found: {root}")
+        return []
+    return sorted(p for p in root.iterdir() if p.is_dir())
+
+
+def load_video_embeddings(video_path: Path) -> Tuple[List[int], np.ndarray]:
+    """Frame indices and (n, dim) float32 vectors of one video; unreadable files are skipped."""
+
+    vectors, frame_indices = [], []
+    for frame_idx, pt_file in embedding_files(video_path):
+        try:
+            vec = torch.load(str(pt_file), map_location="cpu").numpy().astype(np.float32)
+            vectors.append(vec.reshape(1, -1))
+            frame_indices.append(frame_idx)
+        except Exception as e:
+            logger.error(f"Error processing {pt_file}: {e}")
+
+    if not vectors:
+        return [], np.empty((0, config.VECTOR_DIMENSION), dtype=np.float32)
+    return frame_indices, np.vstack(vectors)
+
+
+def iter_video_embeddings(root: Optional[str] = None) -> Iterator[Tuple[str, List[int], np.ndarray]]:
+    """(video_id, frame_indices, vectors) per video, in the registry's sorted order."""
+
+    for video_path in video_dirs(root):
+        frame_indices, vectors = load_video_embeddings(video_path)
+        if frame_indices:
+            yield video_path.name, frame_indices, vectors
+
+
+def cluster_adjacent(vectors: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Near-duplicate clusters of one video's keyframes, in frame order: a keyframe
+    joins the current cluster if its cosine with the previous keyframe and with
+    the cluster's first keyframe are both >= threshold (no drift along slow pans).
+    Returns, per keyframe, the position of its cluster representative (medoid).
+    """
+    if not len(vectors):
+        return np.empty(0, dtype=np.int64)
+
+    normalized = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    adjacent = np.einsum("ij,ij->i", normalized[1:], normalized[:-1])
+
+    starts = [0]
+    for i in range(1, len(normalized)):
+        if adjacent[i - 1] < threshold or normalized[i] @ normalized[starts[-1]] < threshold:
+            starts.append(i)
+    starts.append(len(normalized))
+
+    representatives = np.empty(len(normalized), dtype=np.int64)
+    for start, end in zip(starts[:-1], starts[1:]):
+        members = normalized[start:end]
+        medoid = int(np.argmax((members @ members.T).sum(axis=1)))
+        representatives[start:end] = start + medoid
+    return representatives
+
+
+def load_embedding_corpus(
+    registry: KeyframeRegistry, root: Optional[str] = None, dtype=np.float16
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    L2-normalized embedding matrix indexed by kf_id, plus a mask of the rows
+    that have a vector. Rows cover the embedded keyframes (the first kf_ids
+    of the registry); float16 halves the memory of large corpora.
+    """
+    parts = []
+    for video_id, frame_indices, vectors in iter_video_embeddings(root):
+        kf_ids = registry.find_ids([(video_id, frame_idx) for frame_idx in frame_indices])
+        known = kf_ids >= 0
+        if not known.all():
+            logger.warning(f"{int((~known).sum())} embeddings of '{video_id}' are not in the registry.")
+        parts.append((kf_ids[known], vectors[known]))
+
+    num_rows = max((int(kf_ids.max()) + 1 for kf_ids, _ in parts if len(kf_ids)), default=0)
+    corpus = np.zeros((num_rows, config.VECTOR_DIMENSION), dtype=dtype)
+    valid = np.zeros(num_rows, dtype=bool)
+    for kf_ids, vectors in parts:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        corpus[kf_ids] = vectors / np.maximum(norms, 1e-12)
+        valid[kf_ids] = True
+
+    logger.info(f"Embedding corpus loaded: {int(valid.sum())} vectors, {num_rows} rows.")
+    return corpus, valid
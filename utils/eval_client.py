@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class EvalServerError(Exception):
+    """Error response from the evaluation server, carries the HTTP status to forward."""
+
+    def __init__(self, message: str, status_code: int, details: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+class EvalServerClient:
+    """
+    Client for the evaluation server (login, evaluation list, submit).
+
+    A single requests.Session keeps pooled keep-alive connections to
+    EVAL_SERVER_URL. Idempotent GETs are retried on connection errors and 5xx.
+    POST is only retried when the connection could not be opened, so a
+    submission is never sent twice. Session and evaluation ids are cached, so
+    repeated logins during a round do not hit the server again.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff_factor: float = 0.2,
+        timeout: float = 10.0,
+        session_ttl: float = 3600.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session_ttl = session_ttl
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.http = requests.Session()
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        # (username, sha256(password)) -> (expires_at, session_id, evaluation_id)
+        self._logins: Dict[Tuple[str, str], Tuple[float, str, str]] = {}
+
+    def login(self, username: str, password: str, refresh: bool = False) -> Dict[str, str]:
+        """Return {"sessionId", "evaluationId"}, from cache unless `refresh`."""
+
+        # Khóa theo cả mật khẩu: sai mật khẩu không được dùng lại session đã cache
+        key = (username, hashlib.sha256((password or "").encode("utf-8")).hexdigest())
+        now = time.monotonic()
+        with self._lock:
+            cached = self._logins.get(key)
+        if cached and not refresh and cached[0] > now:
+            return {"sessionId": cached[1], "evaluationId": cached[2]}
+
+        # 1. Login
+        login_resp = self.http.post(
+            f"{self.base_url}/api/v2/login",
+            json={"username": username, "password": password},
+            verify=False,
+            timeout=self.timeout,
+        )
+        if login_resp.status_code != 200:
+            raise EvalServerError(
+                "Login failed on remote server", 401, login_resp.text
+            )
+        session_id = login_resp.json().get("sessionId")
+
+        # 2. Get Evaluation List
+        evaluation_id = self.get_evaluation_id(session_id)
+
+        with self._lock:
+            self._logins[key] = (now + self.session_ttl, session_id, evaluation_id)
+        return {"sessionId": session_id, "evaluationId": evaluation_id}
+
+    def get_evaluation_id(self, session_id: str) -> str:
+        list_resp = self.http.get(
+            f"{self.base_url}/api/v2/client/evaluation/list",
+            params={"session": session_id},
+            timeout=self.timeout,
+        )
+        if list_resp.status_code != 200:
+            raise EvalServerError(
+                "Failed to get evaluation list", 400, list_resp.text
+            )
+
+        eval_list = list_resp.json()
+        if not eval_list:
+            raise EvalServerError("No evaluations found", 404)
+
+        # Lấy evaluation ID đầu tiên (theo logic submit.py mẫu)
+        return eval_list[0]["id"]
+
+    def invalidate(self, session_id: Optional[str] = None) -> None:
+        """Forget cached logins (all, or the ones using `session_id`)."""
+
+        with self._lock:
+            if session_id is None:
+                self._logins.clear()
+                return
+            for key, (_, cached_session, _) in list(self._logins.items()):
+                if cached_session == session_id:
+                    del self._logins[key]
+
+    def submit(
+        self, session_id: str, evaluation_id: str, video_id: str, time_ms: int
+    ) -> requests.Response:
+        payload = {
+            "answerSets": [
+                {
+                    "answers": [
+                        {
+                            "mediaItemName": video_id,
+                            "start": str(int(time_ms)),
+                            "end": str(int(time_ms)),
+                        }
+                    ]
+                }
+            ]
+        }
+
+        # Gửi request lên server đánh giá
+        response = self.http.post(
+            f"{self.base_url}/api/v2/submit/{evaluation_id}",
+            json=payload,
+            params={"session": session_id},
+            timeout=self.timeout,
+        )
+        if response.status_code == 401:
+            # Session hết hạn phía server: lần login sau phải lấy session mới
+            self.invalidate(session_id)
+        return response
+
+
+class SubmissionQueue:
+    """
+    Background submission worker: submit() returns a job id immediately and
+    the result is polled with status(). Only the last `max_jobs` are kept.
+    """
+
+    def __init__(self, client: EvalServerClient, workers: int = 2, max_jobs: int = 1000):
+        self.client = client
+        self.max_jobs = max_jobs
+        self._queue: "queue.Queue[Tuple[str, tuple]]" = queue.Queue()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        for i in range(workers):
+            threading.Thread(
+                target=self._worker, name=f"eval-submit-{i}", daemon=True
+            ).start()
+
+    def submit(self, session_id: str, evaluation_id: str, video_id: str, time_ms: int) -> str:
+        job_id = str(next(self._ids))
+        with self._lock:
+            self._jobs[job_id] = {
+                "jobId": job_id,
+                "status": "queued",
+                "videoId": video_id,
+                "timeMs": int(time_ms),
+                "queuedAt": time.time(),
+            }
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+        self._queue.put((job_id, (session_id, evaluation_id, video_id, time_ms)))
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _worker(self) -> None:
+        while True:
+            job_id, args = self._queue.get()
+            self._update(job_id, status="sending")
+            try:
+                response = self.client.submit(*args)
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = response.text
+
+                if response.status_code == 200:
+                    self._update(job_id, status="success", remote_response=body)
+                else:
+                    self._update(
+                        job_id,
+                        status="failed",
+                        status_code=response.status_code,
+                        error=body,
+                    )
+            except Exception as e:
+                logger.error(f"Async submit {job_id} failed: {e}")
+                self._update(job_id, status="failed", error=str(e))
+            finally:
+                self._update(job_id, completedAt=time.time())
+                self._queue.task_done()
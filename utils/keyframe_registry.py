@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.columnar import VIDEO_IDS, ResultFrame
+
+logger = logging.getLogger(__name__)
+
+
+class KeyframeRegistry:
+    """
+    Dense int64 id (kf_id) for every (video_id, keyframe_index), built at ingestion.
+
+    Ids are assigned in insertion order. ingest_data registers the embedding
+    corpus first, video by video in sorted order, so kf_id is also the row of
+    a keyframe in any corpus-aligned matrix. Milvus, MongoDB and Elasticsearch
+    store only kf_id. The search layer turns ids back into ResultFrames with
+    to_frame(), which is two array lookups.
+    """
+
+    def __init__(
+        self,
+        video_ids: Optional[List[str]] = None,
+        kf_video_codes: Optional[np.ndarray] = None,
+        kf_indices: Optional[np.ndarray] = None,
+        kf_representatives: Optional[np.ndarray] = None,
+    ):
+        self.video_ids: List[str] = list(video_ids or [])
+        self._video_codes: Dict[str, int] = {v: i for i, v in enumerate(self.video_ids)}
+
+        codes = np.asarray(
+            kf_video_codes if kf_video_codes is not None else [], dtype=np.int32
+        )
+        indices = np.asarray(kf_indices if kf_indices is not None else [], dtype=np.int64)
+        # Danh sách Python khi đang thêm, chuyển sang numpy khi tra cứu
+        self._codes: List[int] = codes.tolist()
+        self._indices: List[int] = indices.tolist()
+        self._arrays: Optional[Tuple[np.ndarray, np.ndarray]] = (codes, indices)
+        self._lookup: Optional[Dict[Tuple[int, int], int]] = None
+        self._frame_codes: Optional[np.ndarray] = None
+        self._frame_keys: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # Cụm near-duplicate: kf_id -> kf_id đại diện (chỉ đại diện có vector trong Milvus)
+        self._representatives = np.asarray(
+            kf_representatives if kf_representatives is not None else [], dtype=np.int64
+        )
+        self._members: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    @property
+    def num_videos(self) -> int:
+        return len(self.video_ids)
+
+    # --- Ingestion ---
+
+    def video_code(self, video_id: str) -> int:
+        code = self._video_codes.get(video_id)
+        if code is None:
+            code = len(self.video_ids)
+            self._video_codes[video_id] = code
+            self.video_ids.append(video_id)
+            self._frame_codes = None
+            self._frame_keys = None
+        return code
+
+    def _ensure_lookup(self) -> Dict[Tuple[int, int], int]:
+        if self._lookup is None:
+            self._lookup = {
+                key: kf_id for kf_id, key in enumerate(zip(self._codes, self._indices))
+            }
+        return self._lookup
+
+    def ids_for(self, video_id: str, keyframe_indices: Sequence[int]) -> np.ndarray:
+        """kf_ids of the keyframes of one video, registering unseen keyframes."""
+
+        code = self.video_code(video_id)
+        lookup = self._ensure_lookup()
+        ids = []
+        for keyframe_index in keyframe_indices:
+            key = (code, int(keyframe_index))
+            kf_id = lookup.get(key)
+            if kf_id is None:
+                kf_id = len(self._codes)
+                lookup[key] = kf_id
+                self._codes.append(code)
+                self._indices.append(key[1])
+                self._arrays = None
+                self._frame_keys = None
+            ids.append(kf_id)
+        return np.asarray(ids, dtype=np.int64)
+
+    def id_for(self, video_id: str, keyframe_index: int) -> int:
+        return int(self.ids_for(video_id, [keyframe_index])[0])
+
+    # --- Query time ---
+
+    def find_ids(self, pairs: Sequence[Tuple[str, int]]) -> np.ndarray:
+        """kf_ids of (video_id, keyframe_index) pairs, -1 for unknown keyframes."""
+
+        lookup = self._ensure_lookup()
+        ids = []
+        for video_id, keyframe_index in pairs:
+            code = self._video_codes.get(video_id)
+            ids.append(-1 if code is None else lookup.get((code, int(keyframe_index)), -1))
+        return np.asarray(ids, dtype=np.int64)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(video code, keyframe_index) per kf_id."""
+
+        if self._arrays is None:
+            self._arrays = (
+                np.asarray(self._codes, dtype=np.int32),
+                np.asarray(self._indices, dtype=np.int64),
+            )
+        return self._arrays
+
+    def to_frame(self, kf_ids: np.ndarray, **columns) -> ResultFrame:
+        """Build a ResultFrame from kf_ids (vectorized, no per-row Python)."""
+
+        kf_ids = np.asarray(kf_ids, dtype=np.int64)
+        codes, indices = self.arrays()
+        if self._frame_codes is None:
+            # Mã video của registry -> mã VIDEO_IDS dùng trong ResultFrame
+            self._frame_codes = VIDEO_IDS.encode(self.video_ids)
+        frame = ResultFrame(self._frame_codes[codes[kf_ids]], indices[kf_ids])
+        return frame.with_columns(**columns) if columns else frame
+
+    def frame_ids(self, frame: ResultFrame) -> np.ndarray:
+        """kf_ids of the rows of a ResultFrame, -1 for unknown keyframes (vectorized)."""
+
+        if self._frame_keys is None:
+            codes, indices = self.arrays()
+            if self._frame_codes is None:
+                self._frame_codes = VIDEO_IDS.encode(self.video_ids)
+            keys = (self._frame_codes[codes].astype(np.int64) << 32) | indices
+            order = np.argsort(keys, kind="stable")
+            self._frame_keys = (keys[order], order)
+
+        sorted_keys, order = self._frame_keys
+        if not len(sorted_keys):
+            return np.full(len(frame), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(sorted_keys, frame.keys), len(sorted_keys) - 1)
+        return np.where(sorted_keys[positions] == frame.keys, order[positions], -1).astype(np.int64)
+
+    # --- Near-duplicate clusters ---
+
+    def set_representatives(self, kf_ids: np.ndarray, representatives: np.ndarray) -> None:
+        """Record the cluster representative of each kf_id (ingestion)."""
+
+        kf_ids = np.asarray(kf_ids, dtype=np.int64)
+        if not len(kf_ids):
+            return
+        size = max(len(self._representatives), int(kf_ids.max()) + 1)
+        if size > len(self._representatives):
+            extra = np.arange(len(self._representatives), size, dtype=np.int64)
+            self._representatives = np.concatenate([self._representatives, extra])
+        self._representatives[kf_ids] = representatives
+        self._members = None
+
+    def representative_of(self, kf_ids: np.ndarray) -> np.ndarray:
+        """Representative of each kf_id (itself when not clustered); -1 stays -1."""
+
+        kf_ids = np.asarray(kf_ids, dtype=np.int64)
+        clustered = (kf_ids >= 0) & (kf_ids < len(self._representatives))
+        result = kf_ids.copy()
+        result[clustered] = self._representatives[kf_ids[clustered]]
+        return result
+
+    def expand_clusters(self, kf_ids: np.ndarray, **columns) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Replace each representative by its whole cluster (representative first,
+        then members by kf_id); member rows repeat the representative's columns.
+        """
+        kf_ids = np.asarray(kf_ids, dtype=np.int64)
+        if not len(self._representatives) or not len(kf_ids):
+            return kf_ids, columns
+
+        if self._members is None:
+            reps = self._representatives
+            ids = np.arange(len(reps), dtype=np.int64)
+            order = np.lexsort((ids, ids != reps, reps))
+            self._members = (reps[order], order)
+        sorted_reps, members = self._members
+
+        starts = np.searchsorted(sorted_reps, kf_ids, side="left")
+        counts = np.searchsorted(sorted_reps, kf_ids, side="right") - starts
+        # kf_id ngoài các cụm (chưa gom cụm) giữ nguyên một dòng
+        single = counts == 0
+        counts[single] = 1
+
+        rows = np.repeat(np.arange(len(kf_ids)), counts)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(starts, counts) + offsets
+        expanded = np.where(
+            np.repeat(single, counts),
+            kf_ids[rows],
+            members[np.minimum(positions, len(members) - 1)],
+        )
+        return expanded, {name: np.asarray(values)[rows] for name, values in columns.items()}
+
+    def cluster_first_mask(self, frame: ResultFrame) -> np.ndarray:
+        """Rows of a ResultFrame that are the first (best-ranked) of their cluster."""
+
+        keep = np.ones(len(frame), dtype=bool)
+        if not len(self._representatives) or not len(frame):
+            return keep
+        reps = self.representative_of(self.frame_ids(frame))
+        known = np.flatnonzero(reps >= 0)
+        _, first = np.unique(reps[known], return_index=True)
+        keep[known] = False
+        keep[known[first]] = True
+        return keep
+
+    def decode(self, kf_id: int) -> Tuple[str, int]:
+        return self.video_ids[self._codes[kf_id]], self._indices[kf_id]
+
+    # --- Persistence ---
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        codes, indices = self.arrays()
+        # np.savez tự thêm ".npz" nếu thiếu, ghi qua file tạm rồi rename
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            video_ids=np.array(self.video_ids, dtype=str),
+            kf_video_codes=codes,
+            kf_indices=indices,
+            kf_representatives=self._representatives,
+        )
+        os.replace(tmp_path, path)
+        logger.info(
+            f"Keyframe registry saved: {len(self)} keyframes, {self.num_videos} videos -> {path}"
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "KeyframeRegistry":
+        with np.load(path) as data:
+            return cls(
+                video_ids=data["video_ids"].tolist(),
+                kf_video_codes=data["kf_video_codes"],
+                kf_indices=data["kf_indices"],
+                # Registry cũ (trước khi có gom cụm) không có mảng này
+                kf_representatives=(
+                    data["kf_representatives"] if "kf_representatives" in data.files else None
+                ),
+            )
+
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def save_knn_graph(directory: str, neighbors: np.ndarray, scores: np.ndarray, **meta) -> None:
+    """Write the (num_keyframes, k) adjacency: neighbors.npy (int32), scores.npy (float16)."""
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "neighbors.npy"), neighbors.astype(np.int32))
+    np.save(os.path.join(directory, "scores.npy"), scores.astype(np.float16))
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"num_keyframes": len(neighbors), "k": int(neighbors.shape[1]), **meta}, f)
+    logger.info(f"kNN graph saved: {neighbors.shape[0]} keyframes x {neighbors.shape[1]} -> {directory}")
+
+
+class StaleKnnGraphError(FileNotFoundError):
+    """The graph was built for another ingest generation: its rows are not the current kf_ids."""
+
+
+class KnnGraph:
+    """
+    Top-k cosine neighbors of every embedded keyframe, row = kf_id.
+    Rows are sorted by score (descending) and padded with -1.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.neighbors = np.load(os.path.join(directory, "neighbors.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(directory, "scores.npy"), mmap_mode="r")
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+    @classmethod
+    def load(cls, directory: str, ingest_generation: Optional[int] = None) -> "KnnGraph":
+        """
+        Load the graph; with `ingest_generation`, refuse a graph built for another
+        generation (StaleKnnGraphError, handled like a missing graph by callers).
+        """
+        graph = cls(directory)
+        built_for = graph.meta.get("ingest_generation")
+        if ingest_generation is not None and built_for != ingest_generation:
+            raise StaleKnnGraphError(
+                f"kNN graph in {directory} was built for ingest generation {built_for}, "
+                f"current is {ingest_generation}: rebuild it with build_knn_graph.py."
+            )
+        logger.info(
+            f"kNN graph loaded: {len(graph)} keyframes, k={graph.k} from {directory} "
+            f"(ingest generation {graph.meta.get('ingest_generation')})"
+        )
+        return graph
+
+    def __len__(self) -> int:
+        return len(self.neighbors)
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1]
+
+    def neighbors_of(self, kf_id: int, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(kf_ids, scores) of the nearest keyframes, one row read from the mmap."""
+
+        if not 0 <= kf_id < len(self.neighbors):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        row = np.asarray(self.neighbors[kf_id, :k], dtype=np.int64)
+        scores = np.asarray(self.scores[kf_id, :k], dtype=np.float64)
+        keep = row >= 0
+        return row[keep], scores[keep]
+
+    def duplicate_mask(self, kf_ids: np.ndarray, threshold: Optional[float] = None) -> np.ndarray:
+        """
+        Greedy near-duplicate collapse over kf_ids in ranked order: a keyframe is
+        dropped if a higher-ranked kept keyframe is its neighbor with
+        score >= threshold (either direction). Returns the mask of kept rows.
+        """
+        threshold = config.NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+        kf_ids = np.asarray(kf_ids, dtype=np.int64)
+        keep = np.ones(len(kf_ids), dtype=bool)
+        in_graph = (kf_ids >= 0) & (kf_ids < len(self.neighbors))
+        if not in_graph.any():
+            return keep
+
+        rows = np.flatnonzero(in_graph)
+        neighbors = np.asarray(self.neighbors[kf_ids[rows]], dtype=np.int64)
+        close = np.asarray(self.scores[kf_ids[rows]], dtype=np.float32) >= threshold
+        # Danh sách láng giềng gần (đã lọc ngưỡng) của từng dòng
+        close_lists = {
+            row: set(neighbors[i][close[i]].tolist()) for i, row in enumerate(rows.tolist())
+        }
+
+        # covered: láng giềng gần của các keyframe đã giữ (quan hệ top-k không đối xứng)
+        kept, covered = set(), set()
+        for row, kf_id in enumerate(kf_ids.tolist()):
+            near = close_lists.get(row)
+            if near is None:
+                continue
+            if kf_id in kept or kf_id in covered or not near.isdisjoint(kept):
+                keep[row] = False
+                continue
+            kept.add(kf_id)
+            covered |= near
+        return keep
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+from utils.spatial import RELATIONS, region_mask
+
+logger = logging.getLogger(__name__)
+
+_ARRAYS = (
+    "label_ptr",
+    "det_kf_ids",
+    "det_confidences",
+    "det_cells_mask",
+    "det_areas",
+    "det_cx",
+    "det_cy",
+    "label_kf_ptr",
+    "label_kf_ids",
+    "label_kf_counts",
+)
+
+
+class LocalObjectIndexBuilder:
+    """Collects detections per label, then writes a LocalObjectIndex directory."""
+
+    def __init__(self):
+        self._kf_ids: Dict[str, List[int]] = defaultdict(list)
+        self._confidences: Dict[str, List[float]] = defaultdict(list)
+        # (area, cx, cy) và bitmask các ô của từng box, xem utils.spatial.box_grid
+        self._grid: Dict[str, List[tuple]] = defaultdict(list)
+        self._cells: Dict[str, List[int]] = defaultdict(list)
+        self.num_detections = 0
+
+    def add_frame(self, kf_id: int, objects: List[dict]) -> None:
+        for obj in objects:
+            grid = obj["grid"]
+            self._kf_ids[obj["class"]].append(kf_id)
+            self._confidences[obj["class"]].append(obj["confidence"])
+            self._grid[obj["class"]].append((grid["area"], grid["cx"], grid["cy"]))
+            self._cells[obj["class"]].append(grid["cells"])
+        self.num_detections += len(objects)
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+
+        labels = sorted(self._kf_ids)
+        label_ptr, label_kf_ptr = [0], [0]
+        det_kf_ids, det_confidences = [], []
+        det_grid, det_cells = [], []
+        label_kf_ids, label_kf_counts = [], []
+        for label in labels:
+            kf_ids = np.asarray(self._kf_ids[label], dtype=np.int64)
+            confidences = np.asarray(self._confidences[label], dtype=np.float32)
+
+            # Confidence tăng dần: ngưỡng c -> đoạn cuối [searchsorted(c), end)
+            order = np.argsort(confidences, kind="stable")
+            det_kf_ids.append(kf_ids[order])
+            det_confidences.append(confidences[order])
+            det_grid.append(np.asarray(self._grid[label], dtype=np.float64).reshape(-1, 3)[order])
+            det_cells.append(np.asarray(self._cells[label], dtype=np.int64)[order])
+            label_ptr.append(label_ptr[-1] + len(kf_ids))
+
+            unique_kf_ids, counts = np.unique(kf_ids, return_counts=True)
+            label_kf_ids.append(unique_kf_ids)
+            label_kf_counts.append(counts.astype(np.int32))
+            label_kf_ptr.append(label_kf_ptr[-1] + len(unique_kf_ids))
+
+        def concat(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype=dtype)
+
+        grid = concat(det_grid, np.float64).reshape(-1, 3)
+        arrays = {
+            "label_ptr": np.asarray(label_ptr, dtype=np.int64),
+            "det_kf_ids": concat(det_kf_ids, np.int64),
+            "det_confidences": concat(det_confidences, np.float32),
+            "det_cells_mask": concat(det_cells, np.int64),
+            "det_areas": grid[:, 0].astype(np.float32),
+            "det_cx": grid[:, 1].astype(np.float32),
+            "det_cy": grid[:, 2].astype(np.float32),
+            "label_kf_ptr": np.asarray(label_kf_ptr, dtype=np.int64),
+            "label_kf_ids": concat(label_kf_ids, np.int64),
+            "label_kf_counts": concat(label_kf_counts, np.int32),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), values)
+        with open(os.path.join(directory, "labels.json"), "w", encoding="utf-8") as f:
+            json.dump(labels, f, ensure_ascii=False)
+
+        logger.info(
+            f"Local object index saved: {self.num_detections} detections, "
+            f"{len(labels)} labels -> {directory}"
+        )
+
+
+class LocalObjectIndex:
+    """
+    In-process object filter over memory-mapped columnar arrays.
+
+    Per label it keeps the detections sorted by confidence (kf_id, confidence)
+    and the keyframes containing the label with their detection counts.
+    search() has the same semantics as the MongoDB pipeline of object_search:
+    a keyframe is a candidate if it has any detection of a queried label, and
+    it matches if, for every query, the number of detections of that label
+    with confidence >= threshold is within [min_instances, max_instances].
+    Spatial constraints (region, min_area, relation) are evaluated on the
+    per-detection grid columns of the same slice.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(directory, "labels.json"), "r", encoding="utf-8") as f:
+            self.labels: List[str] = json.load(f)
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+
+    @classmethod
+    def load(cls, directory: str) -> "LocalObjectIndex":
+        index = cls(directory)
+        logger.info(
+            f"Local object index loaded: {len(index.det_kf_ids)} detections, "
+            f"{len(index.labels)} labels from {directory}"
+        )
+        return index
+
+    def _keyframes_with_label(self, label_id: int) -> np.ndarray:
+        start, end = self.label_kf_ptr[label_id], self.label_kf_ptr[label_id + 1]
+        return np.asarray(self.label_kf_ids[start:end])
+
+    def _detections(self, label_id: int, min_confidence: float, region=None, min_area=None):
+        """
+        Detections of the label with confidence >= min_confidence inside the
+        spatial constraints: (kf_ids, slice, mask) where mask selects inside the slice.
+        """
+        start, end = self.label_ptr[label_id], self.label_ptr[label_id + 1]
+        confidences = self.det_confidences[start:end]
+        first = start + np.searchsorted(confidences, np.float32(min_confidence), side="left")
+        selected = slice(first, end)
+
+        kf_ids = np.asarray(self.det_kf_ids[selected])
+        mask = None
+        if region is not None:
+            # Box chồng lên ít nhất một ô của vùng
+            mask = (self.det_cells_mask[selected] & np.int64(region_mask(region))) != 0
+        if min_area is not None:
+            area_ok = self.det_areas[selected] >= np.float32(min_area)
+            mask = area_ok if mask is None else mask & area_ok
+        if mask is not None:
+            kf_ids = kf_ids[mask]
+        return kf_ids, selected, mask
+
+    def _relation_mask(self, candidates, subject, relation: dict) -> np.ndarray:
+        """Candidates with a (subject, object) pair in the requested relative position."""
+
+        kf_ids, selected, mask = subject
+        axis, direction = RELATIONS[relation["position"]]
+        column = self.det_cx if axis == "cx" else self.det_cy
+        subject_coords = np.asarray(column[selected])
+        if mask is not None:
+            subject_coords = subject_coords[mask]
+
+        object_label_id = self._label_ids.get(relation["label"], -1)
+        if object_label_id < 0:
+            return np.zeros(len(candidates), dtype=bool)
+        object_kf_ids, object_selected, _ = self._detections(
+            object_label_id, relation.get("confidence", 0.0)
+        )
+        object_coords = np.asarray(column[object_selected])
+        keep = np.isin(object_kf_ids, candidates)
+        object_kf_ids, object_coords = object_kf_ids[keep], object_coords[keep]
+
+        # left_of/above: min(subject) < max(object); right_of/below: max(subject) > min(object)
+        subject_pos = np.searchsorted(candidates, kf_ids)
+        object_pos = np.searchsorted(candidates, object_kf_ids)
+        if direction < 0:
+            subject_ext = np.full(len(candidates), np.inf)
+            object_ext = np.full(len(candidates), -np.inf)
+            np.minimum.at(subject_ext, subject_pos, subject_coords)
+            np.maximum.at(object_ext, object_pos, object_coords)
+            return subject_ext < object_ext
+
+        subject_ext = np.full(len(candidates), -np.inf)
+        object_ext = np.full(len(candidates), np.inf)
+        np.maximum.at(subject_ext, subject_pos, subject_coords)
+        np.minimum.at(object_ext, object_pos, object_coords)
+        return subject_ext > object_ext
+
+    def search(self, queries: List[dict]) -> np.ndarray:
+        """Sorted kf_ids of the keyframes matching every query."""
+
+        return self.search_scores(queries)[0]
+
+    def search_scores(self, queries: List[dict]):
+        """
+        (kf_ids, scores) of the keyframes matching every query, kf_ids sorted.
+        Score: mean over queries of the best matching detection confidence
+        (0 for a query without match), as object_score in the MongoDB pipeline.
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        for query in queries:
+            if query.get("min_instances") is None and query.get("max_instances") is None:
+                raise ValueError(
+                    f"Query for label '{query['label']}' must have at least min_instances or max_instances."
+                )
+
+        label_ids = [self._label_ids.get(query["label"], -1) for query in queries]
+        known = [label_id for label_id in set(label_ids) if label_id >= 0]
+        if not known:
+            return empty
+
+        # Ứng viên: keyframe có ít nhất một nhãn được hỏi (giống $match pre-filter)
+        candidates = np.unique(
+            np.concatenate([self._keyframes_with_label(label_id) for label_id in known])
+        )
+        mask = np.ones(len(candidates), dtype=bool)
+        score_sum = np.zeros(len(candidates), dtype=np.float64)
+
+        for query, label_id in zip(queries, label_ids):
+            counts = np.zeros(len(candidates), dtype=np.int64)
+            best = np.zeros(len(candidates), dtype=np.float64)
+            subject = None
+            if label_id >= 0:
+                subject = self._detections(
+                    label_id,
+                    query.get("confidence", 0.0),
+                    region=query.get("region"),
+                    min_area=query.get("min_area"),
+                )
+                kf_ids, kf_counts = np.unique(subject[0], return_counts=True)
+                counts[np.searchsorted(candidates, kf_ids)] = kf_counts
+                confidences = np.asarray(self.det_confidences[subject[1]])
+                if subject[2] is not None:
+                    confidences = confidences[subject[2]]
+                np.maximum.at(best, np.searchsorted(candidates, subject[0]), confidences)
+            score_sum += best
+
+            if query.get("min_instances") is not None:
+                mask &= counts >= query["min_instances"]
+            if query.get("max_instances") is not None:
+                mask &= counts <= query["max_instances"]
+            if query.get("relation"):
+                if subject is None:
+                    return empty
+                mask &= self._relation_mask(candidates, subject, query["relation"])
+            if not mask.any():
+                return empty
+
+        return candidates[mask], score_sum[mask] / len(queries)
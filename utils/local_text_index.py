@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+PHRASE_BOOST = 2.0
+PREFIX_BOOST = 0.5
+PREFIX_MAX_EXPANSIONS = 50
+
+_ARRAYS = (
+    "term_offsets",
+    "post_ptr",
+    "post_docs",
+    "post_tf",
+    "pos_ptr",
+    "positions",
+    "doc_kf_ids",
+    "doc_starts",
+    "doc_ends",
+    "doc_lengths",
+    "text_offsets",
+)
+
+
+@lru_cache(maxsize=65536)
+def fold(token: str) -> str:
+    """Lowercase + bỏ dấu tiếng Việt, giống analyzer lowercase/asciifolding của ES."""
+
+    token = token.lower().replace("đ", "d")
+    return "".join(
+        ch for ch in unicodedata.normalize("NFD", token) if unicodedata.category(ch) != "Mn"
+    )
+
+
+def tokenize(text: str) -> List[str]:
+    return [fold(token) for token in TOKEN_RE.findall(text)]
+
+
+class LocalTextIndexBuilder:
+    """Accumulates transcript segments in memory, then writes a LocalTextIndex directory."""
+
+    def __init__(self):
+        self._postings: Dict[str, List[Tuple[int, List[int]]]] = defaultdict(list)
+        self._kf_ids: List[int] = []
+        self._starts: List[float] = []
+        self._ends: List[float] = []
+        self._lengths: List[int] = []
+        self._texts: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._kf_ids)
+
+    def add(self, kf_id: int, start: float, end: float, text: str) -> None:
+        doc = len(self._kf_ids)
+        tokens = tokenize(text)
+        positions: Dict[str, List[int]] = defaultdict(list)
+        for position, term in enumerate(tokens):
+            positions[term].append(position)
+        for term, term_positions in positions.items():
+            self._postings[term].append((doc, term_positions))
+
+        self._kf_ids.append(kf_id)
+        self._starts.append(start)
+        self._ends.append(end)
+        self._lengths.append(len(tokens))
+        self._texts.append(text)
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+
+        terms = sorted(self._postings)
+        post_ptr = [0]
+        post_docs, post_tf, pos_ptr, positions = [], [], [0], []
+        for term in terms:
+            for doc, term_positions in self._postings[term]:
+                post_docs.append(doc)
+                post_tf.append(len(term_positions))
+                positions.extend(term_positions)
+                pos_ptr.append(len(positions))
+            post_ptr.append(len(post_docs))
+
+        term_bytes = [term.encode("utf-8") for term in terms]
+        text_bytes = [text.encode("utf-8") for text in self._texts]
+        arrays = {
+            "term_offsets": np.cumsum([0] + [len(b) for b in term_bytes], dtype=np.int64),
+            "post_ptr": np.asarray(post_ptr, dtype=np.int64),
+            "post_docs": np.asarray(post_docs, dtype=np.int32),
+            "post_tf": np.asarray(post_tf, dtype=np.int32),
+            "pos_ptr": np.asarray(pos_ptr, dtype=np.int64),
+            "positions": np.asarray(positions, dtype=np.int32),
+            "doc_kf_ids": np.asarray(self._kf_ids, dtype=np.int64),
+            "doc_starts": np.asarray(self._starts, dtype=np.float64),
+            "doc_ends": np.asarray(self._ends, dtype=np.float64),
+            "doc_lengths": np.asarray(self._lengths, dtype=np.int32),
+            "text_offsets": np.cumsum([0] + [len(b) for b in text_bytes], dtype=np.int64),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), values)
+        with open(os.path.join(directory, "terms.bin"), "wb") as f:
+            f.write(b"".join(term_bytes))
+        with open(os.path.join(directory, "texts.bin"), "wb") as f:
+            f.write(b"".join(text_bytes))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "num_docs": len(self._kf_ids),
+                    "num_terms": len(terms),
+                    "avg_doc_length": float(np.mean(self._lengths)) if self._lengths else 0.0,
+                },
+                f,
+            )
+        logger.info(
+            f"Local transcript index saved: {len(self._kf_ids)} segments, "
+            f"{len(terms)} terms, {len(positions)} positions -> {directory}"
+        )
+
+
+class LocalTextIndex:
+    """
+    In-process transcript index: BM25 over an inverted index with positional
+    postings, stored as .npy files opened with mmap.
+
+    Query semantics follow the Elasticsearch tiers of transcript_search:
+      - "exact": every query term must occur; phrase matches get a boost.
+      - "full": any query term (OR), phrase boost, and the last term is also
+        expanded as a prefix (search-as-you-type). Fuzzy matching is not
+        implemented; prefix expansion covers partially typed words.
+    Terms are folded (lowercase, no diacritics) like the standard ES mapping.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.num_docs = meta["num_docs"]
+        self.avg_doc_length = meta["avg_doc_length"] or 1.0
+
+        # Danh sách term đã sort nằm trong RAM để bisect (exact + prefix)
+        with open(os.path.join(directory, "terms.bin"), "rb") as f:
+            blob = f.read()
+        offsets = self.term_offsets.tolist()
+        self.terms = [
+            blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)
+        ]
+        texts_path = os.path.join(directory, "texts.bin")
+        # np.memmap không mở được file rỗng
+        self._texts = (
+            np.memmap(texts_path, dtype=np.uint8, mode="r")
+            if os.path.getsize(texts_path)
+            else np.empty(0, dtype=np.uint8)
+        )
+
+    @classmethod
+    def load(cls, directory: str) -> "LocalTextIndex":
+        index = cls(directory)
+        logger.info(f"Local transcript index loaded: {index.num_docs} segments from {directory}")
+        return index
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    # --- Term lookup ---
+
+    def term_id(self, term: str) -> int:
+        position = bisect.bisect_left(self.terms, term)
+        if position < len(self.terms) and self.terms[position] == term:
+            return position
+        return -1
+
+    def prefix_term_ids(self, prefix: str, limit: int = PREFIX_MAX_EXPANSIONS) -> range:
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, prefix + "\uffff")
+        return range(lo, min(hi, lo + limit))
+
+    # --- Scoring ---
+
+    def _bm25(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        p0, p1 = self.post_ptr[term_id], self.post_ptr[term_id + 1]
+        docs = np.asarray(self.post_docs[p0:p1])
+        tf = np.asarray(self.post_tf[p0:p1], dtype=np.float64)
+        df = len(docs)
+        idf = np.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+        lengths = np.asarray(self.doc_lengths[docs], dtype=np.float64)
+        norm = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * lengths / self.avg_doc_length)
+        return docs, idf * tf * (BM25_K1 + 1.0) / norm
+
+    def _term_positions(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc, position) of every occurrence of a term (postings are contiguous)."""
+
+        p0, p1 = self.post_ptr[term_id], self.post_ptr[term_id + 1]
+        positions = np.asarray(self.positions[self.pos_ptr[p0]:self.pos_ptr[p1]], dtype=np.int64)
+        docs = np.repeat(np.asarray(self.post_docs[p0:p1], dtype=np.int64), self.post_tf[p0:p1])
+        return docs, positions
+
+    def _phrase_docs(self, term_ids: List[int]) -> np.ndarray:
+        """Docs where the terms occur consecutively, in order."""
+
+        starts = None
+        for offset, term_id in enumerate(term_ids):
+            docs, positions = self._term_positions(term_id)
+            positions = positions - offset
+            keep = positions >= 0
+            keys = (docs[keep] << 32) | positions[keep]
+            starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=False)
+            if starts.size == 0:
+                break
+        return np.unique(starts >> 32) if starts is not None else np.empty(0, np.int64)
+
+    def search(
+        self, query: str, max_results: int = 200, tier: str = "full"
+    ) -> Dict[str, np.ndarray]:
+        """
+        Top segments for `query` as columns: kf_id, start, end, transcript_text,
+        transcript_score (sorted by score, descending).
+        """
+        tokens = tokenize(query)
+        if not tokens or self.num_docs == 0:
+            return self._columns(np.empty(0, np.int64), np.empty(0, np.float64))
+
+        term_ids = [self.term_id(token) for token in tokens]
+        unique_ids = list(dict.fromkeys(t for t in term_ids if t >= 0))
+        if tier == "exact" and (len(unique_ids) < len(set(tokens))):
+            return self._columns(np.empty(0, np.int64), np.empty(0, np.float64))
+
+        doc_parts, score_parts, term_parts = [], [], []
+        for index, term_id in enumerate(unique_ids):
+            docs, scores = self._bm25(term_id)
+            doc_parts.append(docs)
+            score_parts.append(scores)
+            term_parts.append(np.full(len(docs), index, dtype=np.int32))
+
+        if tier == "full":
+            # Từ cuối có thể đang gõ dở: mở rộng theo prefix
+            for term_id in self.prefix_term_ids(tokens[-1]):
+                if term_id in unique_ids:
+                    continue
+                docs, scores = self._bm25(term_id)
+                doc_parts.append(docs)
+                score_parts.append(scores * PREFIX_BOOST)
+                term_parts.append(np.full(len(docs), -1, dtype=np.int32))
+
+        if not doc_parts:
+            return self._columns(np.empty(0, np.int64), np.empty(0, np.float64))
+
+        all_docs = np.concatenate(doc_parts)
+        docs, inverse = np.unique(all_docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts), minlength=len(docs))
+
+        if tier == "exact":
+            # Mỗi term đóng góp đúng một posting cho mỗi doc chứa nó
+            matched = np.bincount(inverse, minlength=len(docs))
+            keep = matched == len(unique_ids)
+            docs, scores = docs[keep], scores[keep]
+
+        if len(term_ids) > 1 and min(term_ids) >= 0:
+            phrase_docs = self._phrase_docs(term_ids)
+            if phrase_docs.size:
+                scores = scores * np.where(np.isin(docs, phrase_docs), 1.0 + PHRASE_BOOST, 1.0)
+
+        if len(docs) > max_results:
+            top = np.argpartition(-scores, max_results - 1)[:max_results]
+            docs, scores = docs[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return self._columns(docs[order], scores[order])
+
+    def _text(self, doc: int) -> str:
+        start, end = self.text_offsets[doc], self.text_offsets[doc + 1]
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def _columns(self, docs: np.ndarray, scores: np.ndarray) -> Dict[str, np.ndarray]:
+        return {
+            "kf_id": np.asarray(self.doc_kf_ids[docs], dtype=np.int64),
+            "start": np.asarray(self.doc_starts[docs], dtype=np.float64),
+            "end": np.asarray(self.doc_ends[docs], dtype=np.float64),
+            "transcript_text": np.array([self._text(doc) for doc in docs.tolist()], dtype=object),
+            "transcript_score": np.asarray(scores, dtype=np.float64),
+        }
+
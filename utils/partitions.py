@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from utils.columnar import VIDEO_IDS, ResultFrame
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = "_default"
+PARTITION_PREFIX = "batch_"
+
+
+def video_batch(video_id: str) -> str:
+    """Batch of a video: the prefix before the first "_" (L01_V001 -> L01)."""
+
+    return video_id.split("_", 1)[0]
+
+
+def batch_partition(batch: str) -> str:
+    """Milvus partition name of a batch (letters, digits and "_" only)."""
+
+    return PARTITION_PREFIX + re.sub(r"\W", "_", batch)
+
+
+def batch_mask(frame: ResultFrame, batches: Iterable[str]) -> np.ndarray:
+    """Rows of a ResultFrame whose video belongs to one of the batches."""
+
+    batches = set(batches)
+    codes = np.unique(frame.video_codes)
+    wanted = [
+        code
+        for code, video_id in zip(codes, VIDEO_IDS.decode(codes))
+        if video_batch(video_id) in batches
+    ]
+    return np.isin(frame.video_codes, wanted)
+
+
+class BatchPartitions:
+    """
+    Partitions of the keyframe collection (one per video batch) and which of
+    them are loaded in memory.
+
+    With `loaded_batches` only those partitions are loaded at startup; other
+    batches are loaded on the first search that asks for them and can be
+    released again with release().
+    """
+
+    def __init__(self, collection, loaded_batches: Optional[List[str]] = None):
+        self.collection = collection
+        self._lock = threading.Lock()
+        self.names = {partition.name for partition in collection.partitions}
+        self.partial = bool(loaded_batches)
+        if self.partial:
+            self.loaded = set()
+            self.load(loaded_batches)
+        else:
+            collection.load()
+            self.loaded = set(self.names)
+
+    @property
+    def batches(self) -> List[str]:
+        return sorted(
+            name[len(PARTITION_PREFIX):] for name in self.names if name.startswith(PARTITION_PREFIX)
+        )
+
+    def load(self, batches: Iterable[str]) -> List[str]:
+        return self._load_names([batch_partition(batch) for batch in batches])
+
+    def _load_names(self, names: List[str]) -> List[str]:
+        with self._lock:
+            missing = [name for name in names if name in self.names and name not in self.loaded]
+            if missing:
+                self.collection.load(partition_names=sorted(self.loaded | set(missing)))
+                self.loaded.update(missing)
+                logger.info(f"Loaded Milvus partitions: {missing}")
+            return missing
+
+    def release(self, batches: Iterable[str]) -> List[str]:
+        with self._lock:
+            names = [batch_partition(batch) for batch in batches]
+            released = [name for name in names if name in self.loaded]
+            for name in released:
+                self.collection.partition(name).release()
+                self.loaded.discard(name)
+            # Thả một phần: search không lọc batch chỉ dùng các partition còn nạp
+            self.partial = self.partial or bool(released)
+            if released:
+                logger.info(f"Released Milvus partitions: {released}")
+            return released
+
+    def resolve(self, batches: Optional[Iterable[str]] = None) -> Optional[List[str]]:
+        """
+        partition_names for a search restricted to `batches`; None searches the
+        whole collection. An empty list means none of the batches exists.
+        """
+        if not batches:
+            return sorted(self.loaded) if self.partial else None
+
+        if not self.names - {DEFAULT_PARTITION}:
+            # Collection ingest trước khi chia partition: lọc batch sau khi search
+            return None
+
+        names = sorted({batch_partition(batch) for batch in batches} & self.names)
+        cold = sorted(set(names) - self.loaded)
+        if cold:
+            logger.warning(f"Loading cold partitions on demand: {cold}")
+            self._load_names(cold)
+        return names
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from utils.columnar import ResultFrame
+
+
+def exact_clip_scores(vectors: np.ndarray, query_vectors: np.ndarray, merge: str = "max") -> np.ndarray:
+    """Exact cosine of every vector against the query vectors, merged over queries (max/mean)."""
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    query_vectors = np.asarray(query_vectors, dtype=np.float32).reshape(-1, vectors.shape[1])
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query_vectors = query_vectors / np.maximum(
+        np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12
+    )
+    scores = (vectors @ query_vectors.T).astype(np.float64)
+    if merge == "max":
+        return scores.max(axis=1)
+    if merge == "mean":
+        return scores.mean(axis=1)
+    raise ValueError(f"Unknown merge mode '{merge}'.")
+
+
+def rescore_exact(
+    kf_ids: np.ndarray,
+    scores: np.ndarray,
+    found_ids: np.ndarray,
+    vectors: np.ndarray,
+    query_vectors: np.ndarray,
+    merge: str = "max",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Replace the approximate scores of kf_ids with the exact cosine of their
+    stored vectors (found_ids, vectors) and sort by it. Ids without a vector
+    keep their first-stage score.
+    """
+    scores = np.array(scores, dtype=np.float64)
+    if len(found_ids):
+        order = np.argsort(kf_ids)
+        positions = order[np.searchsorted(kf_ids, found_ids, sorter=order)]
+        scores[positions] = exact_clip_scores(vectors, query_vectors, merge)
+    order = np.argsort(-scores, kind="stable")
+    return kf_ids[order], scores[order]
+
+
+def transcript_proximity(frame: ResultFrame, transcript_frame: ResultFrame, window: int) -> np.ndarray:
+    """
+    Per row of `frame`: strength of the closest transcript hit of the same video,
+    decaying linearly to 0 at `window` keyframe indices (frames) away.
+    Strength is the hit's transcript_score relative to the best hit.
+    """
+    if not len(frame) or not len(transcript_frame):
+        return np.zeros(len(frame))
+
+    strength = transcript_frame.columns.get("transcript_score")
+    if strength is None:
+        strength = np.ones(len(transcript_frame))
+    else:
+        strength = np.nan_to_num(strength.astype(np.float64), nan=0.0)
+        strength = strength / strength.max() if strength.max() > 0 else np.ones(len(strength))
+
+    # Chỉ vài trăm ứng viên x vài trăm hit: ma trận N x M là đủ rẻ
+    same_video = frame.video_codes[:, None] == transcript_frame.video_codes[None, :]
+    distance = np.abs(frame.keyframe_indices[:, None] - transcript_frame.keyframe_indices[None, :])
+    decay = np.clip(1.0 - distance / max(window, 1), 0.0, None) * same_video
+    return (decay * strength[None, :]).max(axis=1)
+
+
+def object_evidence(frame: ResultFrame, object_frame: ResultFrame) -> np.ndarray:
+    """
+    Per row of `frame`: object_score of the keyframe in `object_frame` (best
+    matching detection confidence), 0 for keyframes absent from it. Frames
+    without object_score count 1 per matching keyframe.
+    """
+    matched = np.isin(frame.keys, object_frame.keys)
+    scores = object_frame.columns.get("object_score")
+    if scores is None or not matched.any():
+        return matched.astype(np.float64)
+
+    order = np.argsort(object_frame.keys, kind="stable")
+    positions = order[np.searchsorted(object_frame.keys, frame.keys[matched], sorter=order)]
+    evidence = np.zeros(len(frame))
+    evidence[matched] = np.nan_to_num(scores[positions].astype(np.float64), nan=0.0)
+    return evidence
+
+
+def rerank_frame(
+    frame: ResultFrame,
+    budget: int,
+    transcript_frame: Optional[ResultFrame] = None,
+    object_frame: Optional[ResultFrame] = None,
+    transcript_weight: float = 0.0,
+    object_weight: float = 0.0,
+    transcript_window: int = 250,
+) -> ResultFrame:
+    """
+    Re-rank the first `budget` rows by clip_score + weighted cross-modal
+    evidence; the remaining rows keep their order after them. The combined
+    score is added as rerank_score (NaN outside the budget).
+    """
+    head = min(budget, len(frame))
+    clip_scores = frame.columns.get("clip_score")
+    if not head or clip_scores is None:
+        return frame
+
+    top = frame.head(head)
+    scores = np.nan_to_num(clip_scores[:head].astype(np.float64), nan=0.0)
+    if transcript_frame is not None and transcript_weight:
+        scores = scores + transcript_weight * transcript_proximity(
+            top, transcript_frame, transcript_window
+        )
+    if object_frame is not None and object_weight:
+        scores = scores + object_weight * object_evidence(top, object_frame)
+
+    order = np.argsort(-scores, kind="stable")
+    rerank_scores = np.full(len(frame), np.nan)
+    rerank_scores[:head] = scores[order]
+    return frame.take(np.concatenate([order, np.arange(head, len(frame))])).with_columns(
+        rerank_score=rerank_scores
+    )
@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import config
+from utils.spatial import normalize_spatial
+
+logger = logging.getLogger(__name__)
+
+
+def read_ingest_generation(path: str) -> int:
+    """Generation number written by ingest_data.main, 0 if never recorded."""
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("generation", 0))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return 0
+
+
+def bump_ingest_generation(path: str) -> int:
+    """Increment the ingestion generation so running servers drop cached results."""
+
+    generation = read_ingest_generation(path) + 1
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # Ghi file tạm rồi rename để reader không bao giờ đọc phải file ghi dở
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "ingested_at": time.time()}, f)
+    os.replace(tmp_path, path)
+    return generation
+
+
+class IngestGeneration:
+    """Current ingestion generation, re-read from disk at most every `check_interval` seconds."""
+
+    def __init__(self, path: str, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._value = read_ingest_generation(path)
+        self._checked_at = time.monotonic()
+
+    def current(self) -> int:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._value = read_ingest_generation(self.path)
+            self._checked_at = now
+        return self._value
+
+
+class GenerationalLoader:
+    """
+    Value built by `load()` once per ingest generation.
+
+    Used for files that ingest_data rewrites before bumping the generation
+    (keyframe registry, local indexes): they are reloaded on the next get()
+    after a new generation is seen.
+    """
+
+    def __init__(self, load: Callable[[], Any], generation: IngestGeneration, name: str = ""):
+        self._load = load
+        self.generation = generation
+        self.name = name
+        self._value = None
+        self._loaded_generation = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        generation = self.generation.current()
+        value = self._value
+        if value is not None and generation == self._loaded_generation:
+            return value
+
+        with self._lock:
+            if self._value is None or generation != self._loaded_generation:
+                self._value = self._load()
+                self._loaded_generation = generation
+                logger.info(f"Loaded {self.name or 'data'} for ingest generation {generation}.")
+            return self._value
+
+
+class ResultCache:
+    """Thread-safe LRU cache with a per-entry TTL for full search result sets."""
+
+    def __init__(
+        self,
+        max_entries: int = 128,
+        ttl_seconds: float = 600.0,
+        generation: Optional[IngestGeneration] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = generation
+        self._generation_seen = generation.current() if generation else 0
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_generation(self) -> None:
+        # Gọi khi đang giữ lock: dữ liệu đã được ingest lại thì bỏ toàn bộ cache
+        if self.generation is None:
+            return
+        current = self.generation.current()
+        if current != self._generation_seen:
+            self._entries.clear()
+            self._generation_seen = current
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._check_generation()
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SubSearchCache:
+    """
+    Memory-bounded LRU cache for per-modality sub-search results.
+
+    Values are immutable ResultFrames (utils.columnar), sized by their
+    `nbytes`, so hits are returned without copying. Entries are keyed by the
+    sub-search arguments and dropped as soon as the ingestion generation
+    changes.
+    """
+
+    def __init__(self, max_bytes: int, generation: Optional[IngestGeneration] = None):
+        self.max_bytes = max_bytes
+        self.generation = generation
+        self._generation_seen = generation.current() if generation else 0
+        # key -> (size, frame); size is computed once on store
+        self._entries: "OrderedDict[Hashable, tuple[int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _check_generation(self) -> None:
+        if self.generation is None:
+            return
+        current = self.generation.current()
+        if current != self._generation_seen:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation_seen = current
+
+    def lookup(self, key: Hashable) -> tuple[Optional[Any], int]:
+        """Cached frame (or None) and the generation to pass back to store()."""
+
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, self._generation_seen
+            self._entries.move_to_end(key)
+            return entry[1], self._generation_seen
+
+    def store(self, key: Hashable, frame: Any, generation: int) -> None:
+        size = frame.nbytes
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_generation()
+            if self._generation_seen != generation:
+                # Có lần ingest mới trong lúc tính: kết quả này đã cũ
+                return
+
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._entries[key] = (size, frame)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        frame, generation = self.lookup(key)
+        if frame is not None:
+            return frame
+
+        # Tính ngoài lock để các truy vấn khác không phải chờ backend
+        frame = compute()
+        self.store(key, frame, generation)
+        return frame
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+def _keyframe_refs(refs) -> List[List[Any]]:
+    """[{"video_id", "keyframe_index"}] or [[video_id, keyframe_index]] -> sorted unique pairs."""
+
+    pairs = set()
+    for ref in refs or []:
+        if isinstance(ref, dict):
+            pairs.add((str(ref["video_id"]), int(ref["keyframe_index"])))
+        else:
+            video_id, keyframe_index = ref
+            pairs.add((str(video_id), int(keyframe_index)))
+    return [list(pair) for pair in sorted(pairs)]
+
+
+def normalize_query(query_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical form of a /search payload: only fields that affect the result set."""
+
+    normalized: Dict[str, Any] = {}
+
+    description = (query_data.get("description") or "").strip()
+    if description:
+        normalized["description"] = description
+        # Các cách diễn đạt khác (paraphrase, bản dịch...) tìm chung trong một lần gọi Milvus
+        variants = []
+        for variant in query_data.get("description_variants") or []:
+            variant = (variant or "").strip()
+            if variant and variant != description and variant not in variants:
+                variants.append(variant)
+        if variants:
+            normalized["description_variants"] = variants
+            merge = query_data.get("clip_merge")
+            if merge:
+                if merge not in config.CLIP_MERGE_MODES:
+                    raise ValueError(f"Unknown clip_merge '{merge}'.")
+                normalized["clip_merge"] = merge
+
+    # "More like this": ví dụ dương / âm là các keyframe (video_id, keyframe_index)
+    similar = query_data.get("similar")
+    if similar:
+        positives = _keyframe_refs(similar.get("positives"))
+        negatives = _keyframe_refs(similar.get("negatives"))
+        if not positives:
+            raise ValueError("similar.positives must contain at least one keyframe.")
+        if len(positives) + len(negatives) > config.SIMILAR_MAX_EXAMPLES:
+            raise ValueError(
+                f"At most {config.SIMILAR_MAX_EXAMPLES} similar examples are allowed."
+            )
+        normalized["similar"] = {"positives": positives, "negatives": negatives}
+
+    objects = []
+    for obj in query_data.get("objects") or []:
+        objects.append(
+            {
+                "label": obj["label"],
+                "confidence": float(obj.get("confidence", 0.0)),
+                "min_instances": obj.get("min_instances"),
+                "max_instances": obj.get("max_instances"),
+                **normalize_spatial(obj),
+            }
+        )
+    if objects:
+        normalized["objects"] = sorted(
+            objects, key=lambda o: json.dumps(o, sort_keys=True, ensure_ascii=False)
+        )
+
+    transcript = (query_data.get("transcript") or query_data.get("audio") or "").strip()
+    if transcript:
+        normalized["transcript"] = transcript
+        mode = query_data.get("transcript_mode")
+        if mode:
+            if mode not in config.TRANSCRIPT_SEARCH_MODES:
+                raise ValueError(f"Unknown transcript_mode '{mode}'.")
+            normalized["transcript_mode"] = mode
+
+    if query_data.get("collapse_duplicates"):
+        normalized["collapse_duplicates"] = True
+
+    # Giới hạn theo batch video (L01, L02...), mỗi batch một partition Milvus
+    batches = sorted({str(batch).strip() for batch in query_data.get("batches") or []} - {""})
+    if batches:
+        normalized["batches"] = batches
+
+    return normalized
+
+
+def query_key(normalized_query: Dict[str, Any]) -> str:
+    """Stable identifier of a normalized query, used as the result-set id."""
+
+    payload = json.dumps(normalized_query, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def encode_cursor(result_id: str, offset: int, page_size: int, sort_by: str) -> str:
+    payload = json.dumps(
+        {"id": result_id, "offset": offset, "size": page_size, "sort": sort_by}
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor."""
+
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return {
+            "id": str(data["id"]),
+            "offset": int(data["offset"]),
+            "size": int(data["size"]),
+            "sort": str(data["sort"]),
+        }
+    except (binascii.Error, UnicodeError, KeyError, TypeError, ValueError) as exc:
+        raise ValueError(f"Invalid cursor: {exc}") from exc
+
+
+SORT_OPTIONS = ("relevance", "clip_score", "transcript_score", "video")
+
+
+def page_params(data: Dict[str, Any]) -> tuple[int, str]:
+    """(page_size, sort_by) of a request, clamped to config; raises ValueError on bad input."""
+
+    page_size = int(data.get("page_size") or config.SEARCH_PAGE_SIZE)
+    page_size = max(1, min(page_size, config.SEARCH_MAX_PAGE_SIZE))
+    sort_by = data.get("sort_by") or "relevance"
+    if sort_by not in SORT_OPTIONS:
+        raise ValueError(f"Unknown sort_by '{sort_by}'.")
+    return page_size, sort_by
+
+
+def page_request(data: Dict[str, Any]) -> tuple[str, int, int, str]:
+    """
+    (result_id, offset, page_size, sort_by) of a /search/page body:
+    {"cursor": "..."} or {"result_id": "...", "offset": 0, "sort_by": ..., "page_size": ...}.
+    """
+    if data.get("cursor"):
+        cursor = decode_cursor(data["cursor"])
+        page_size, sort_by = page_params({"page_size": cursor["size"], "sort_by": cursor["sort"]})
+        return cursor["id"], max(0, cursor["offset"]), page_size, sort_by
+
+    page_size, sort_by = page_params(data)
+    return data["result_id"], max(0, int(data.get("offset") or 0)), page_size, sort_by
+
+
+def build_page(
+    result_id: str,
+    entry: Dict[str, Any],
+    offset: int,
+    page_size: int,
+    sort_by: str,
+    to_records: Callable[[Any], List[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """
+    One page of a cached result set ({"frame", "orders"}); the order of each
+    sort_by is computed once and kept in the entry.
+    """
+    frame = entry["frame"]
+    order = entry["orders"].get(sort_by)
+    if order is None:
+        order = frame.order(sort_by)
+        entry["orders"][sort_by] = order
+
+    next_offset = offset + page_size
+    cursor = None
+    if next_offset < len(frame):
+        cursor = encode_cursor(result_id, next_offset, page_size, sort_by)
+
+    return {
+        "result_id": result_id,
+        "results": to_records(frame.take(order[offset:next_offset])),
+        "total": len(frame),
+        "offset": offset,
+        "sort_by": sort_by,
+        "cursor": cursor,
+    }
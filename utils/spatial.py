@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import numpy as np
+
+import config
+
+# Vùng đặt tên sẵn, theo (hàng, cột) trên lưới GRID x GRID; lưới 4x4 mặc định
+_HALF = config.OBJECT_GRID_SIZE // 2
+_LOW = range(0, _HALF)
+_HIGH = range(_HALF, config.OBJECT_GRID_SIZE)
+_ALL = range(config.OBJECT_GRID_SIZE)
+_MIDDLE = range(config.OBJECT_GRID_SIZE // 4, config.OBJECT_GRID_SIZE - config.OBJECT_GRID_SIZE // 4)
+
+NAMED_REGIONS = {
+    "left": (_ALL, _LOW),
+    "right": (_ALL, _HIGH),
+    "top": (_LOW, _ALL),
+    "bottom": (_HIGH, _ALL),
+    "center": (_MIDDLE, _MIDDLE),
+    "top_left": (_LOW, _LOW),
+    "top_right": (_LOW, _HIGH),
+    "bottom_left": (_HIGH, _LOW),
+    "bottom_right": (_HIGH, _HIGH),
+}
+# position -> (trục, hướng): subject nằm phía nhỏ hơn (-1) / lớn hơn (+1) của object trên trục đó
+RELATIONS = {
+    "left_of": ("cx", -1),
+    "right_of": ("cx", 1),
+    "above": ("cy", -1),
+    "below": ("cy", 1),
+}
+
+
+def box_grid(x, y, width, height, frame_width: float, frame_height: float) -> Dict[str, np.ndarray]:
+    """
+    Grid features of bounding boxes (pixel x, y = top-left corner), vectorized:
+      cell: grid cell of the box center (row * GRID + col)
+      cells: bitmask of every cell the box overlaps (bit row * GRID + col),
+             region queries match it against region_mask
+      area: box area / frame area
+      cx, cy: box center, normalized to [0, 1]
+    """
+    grid = config.OBJECT_GRID_SIZE
+    x0 = np.clip(np.asarray(x, dtype=np.float64) / frame_width, 0.0, 1.0)
+    y0 = np.clip(np.asarray(y, dtype=np.float64) / frame_height, 0.0, 1.0)
+    x1 = np.clip(x0 + np.asarray(width, dtype=np.float64) / frame_width, 0.0, 1.0)
+    y1 = np.clip(y0 + np.asarray(height, dtype=np.float64) / frame_height, 0.0, 1.0)
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+
+    def to_cell(v):
+        return np.minimum((v * grid).astype(np.int64), grid - 1)
+
+    col0, col1, row0, row1 = to_cell(x0), to_cell(x1), to_cell(y0), to_cell(y1)
+    cells = np.zeros(len(x0), dtype=np.int64)
+    for row in range(grid):
+        for col in range(grid):
+            inside = (row0 <= row) & (row <= row1) & (col0 <= col) & (col <= col1)
+            cells |= inside.astype(np.int64) << (row * grid + col)
+
+    return {
+        "cell": to_cell(cy) * grid + to_cell(cx),
+        "cells": cells,
+        "area": (x1 - x0) * (y1 - y0),
+        "cx": cx,
+        "cy": cy,
+    }
+
+
+def region_cells(region: Any) -> List[int]:
+    """
+    Grid cells of a region: a name from NAMED_REGIONS or a normalized box
+    {"x0", "y0", "x1", "y1"} (cells whose center lies inside the box, or the
+    cell of the box center for a box smaller than a cell).
+    """
+    grid = config.OBJECT_GRID_SIZE
+    if isinstance(region, str):
+        if region not in NAMED_REGIONS:
+            raise ValueError(f"Unknown region '{region}'.")
+        rows, cols = NAMED_REGIONS[region]
+        return sorted(row * grid + col for row in rows for col in cols)
+
+    if isinstance(region, dict):
+        x0, y0 = float(region.get("x0", 0.0)), float(region.get("y0", 0.0))
+        x1, y1 = float(region.get("x1", 1.0)), float(region.get("y1", 1.0))
+        if not (0.0 <= x0 <= x1 <= 1.0 and 0.0 <= y0 <= y1 <= 1.0):
+            raise ValueError(f"Invalid region box: {region!r}")
+        centers = (np.arange(grid) + 0.5) / grid
+        cells = [
+            row * grid + col
+            for row in range(grid)
+            for col in range(grid)
+            if y0 <= centers[row] <= y1 and x0 <= centers[col] <= x1
+        ]
+        if not cells:
+            # Box không chứa tâm ô nào: mask rỗng sẽ không khớp gì, lấy ô chứa tâm box
+            row = min(int((y0 + y1) / 2 * grid), grid - 1)
+            col = min(int((x0 + x1) / 2 * grid), grid - 1)
+            cells = [row * grid + col]
+        return cells
+
+    raise ValueError(f"Invalid region: {region!r}")
+
+
+def region_mask(region: Any) -> int:
+    """Bitmask of the region cells: a box lies in the region if (box cells & mask) != 0."""
+
+    mask = 0
+    for cell in region_cells(region):
+        mask |= 1 << cell
+    return mask
+
+
+def normalize_spatial(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Validated spatial fields of an object query (region, min_area, relation)."""
+
+    spatial: Dict[str, Any] = {}
+    if query.get("region") is not None:
+        region_cells(query["region"])
+        spatial["region"] = query["region"]
+    if query.get("min_area") is not None:
+        spatial["min_area"] = float(query["min_area"])
+    relation = query.get("relation")
+    if relation:
+        if relation.get("position") not in RELATIONS:
+            raise ValueError(f"Unknown relation '{relation.get('position')}'.")
+        spatial["relation"] = {
+            "position": relation["position"],
+            "label": relation["label"],
+            "confidence": float(relation.get("confidence", 0.0)),
+        }
+    return spatial
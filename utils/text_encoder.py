@@ -1,4 +1,5 @@
 import logging
+import os
 
 import numpy as np
 import open_clip
@@ -6,13 +7,26 @@ import torch
 import torch.nn.functional as F
 
 import config
+from utils.result_cache import ResultCache
 
 logger = logging.getLogger(__name__)
 
 
+class _EncodeText(torch.nn.Module):
+    """encode_text as forward(), for tracing / ONNX export."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
 class TextEncoder:
-    def __init__(self, device: str = "cuda"):
+    def __init__(self, device: str = "cuda", cpu_mode: str = None):
         self.device = device
+        self.mode = "fp32"
         logger.info(f"Loading model '{config.CLIP_MODEL_NAME}' to device '{self.device}'...")
         self.model, _, _ = open_clip.create_model_and_transforms(
             config.CLIP_MODEL_NAME,
@@ -24,22 +38,115 @@ class TextEncoder:
         self.model = self.model.to(self.device)
         self.model.eval()
         self.tokenizer = open_clip.get_tokenizer(config.CLIP_MODEL_NAME)
+        self._encode_text = self.model.encode_text
+        if self.device == "cpu":
+            self._setup_cpu(cpu_mode or config.TEXT_ENCODER_CPU_MODE)
 
-        # Precompute common query tokens for performance
-        # Common query cache for performance
-        self.common_queries = ["person", "car", "building"]
+        # Tokenizer BPE (regex + vòng lặp Python) tốn đáng kể với query ngắn: cache theo chuỗi
+        self.token_cache = ResultCache(config.TEXT_TOKEN_CACHE_SIZE, float("inf"))
+        self.embedding_cache = ResultCache(config.TEXT_EMBEDDING_CACHE_SIZE, float("inf"))
 
-        self.precomputed_tokens = {
-            query: self.tokenizer([query]).to(self.device)
-            for query in self.common_queries
-        }
+        # Warm-up: chạy model một lần và nạp sẵn embedding của các query hay gặp
+        if config.TEXT_ENCODER_WARMUP_QUERIES:
+            self.encode_batch(config.TEXT_ENCODER_WARMUP_QUERIES)
         logger.info("TextEncoder initialized successfully.")
 
+    def _setup_cpu(self, mode: str):
+        if mode not in config.TEXT_ENCODER_CPU_MODES:
+            raise ValueError(f"Unknown text encoder CPU mode '{mode}'.")
+        if config.TEXT_ENCODER_THREADS:
+            torch.set_num_threads(config.TEXT_ENCODER_THREADS)
+
+        if mode == "int8":
+            # Chỉ các nn.Linear (MLP của transformer) được lượng tử hóa, attention giữ fp32
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            self._encode_text = self.model.encode_text
+        elif mode == "compile":
+            self._encode_text = torch.compile(self.model.encode_text)
+        elif mode == "torchscript":
+            example = self.tokenizer(["warmup"])
+            with torch.no_grad():
+                traced = torch.jit.trace(_EncodeText(self.model).eval(), example)
+            self._encode_text = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+        elif mode == "onnx":
+            try:
+                self._encode_text = self._onnx_session()
+            except ImportError:
+                logger.warning("onnxruntime is not installed, text encoder stays in fp32.")
+                return
+
+        self.mode = mode
+        logger.info(f"Text encoder CPU mode: {mode}, {torch.get_num_threads()} threads.")
+
+    def _onnx_session(self):
+        import onnxruntime
+
+        path = config.TEXT_ENCODER_ONNX_PATH
+        if not os.path.exists(path):
+            logger.info(f"Exporting text encoder to ONNX: {path}")
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            torch.onnx.export(
+                _EncodeText(self.model).eval(),
+                (self.tokenizer(["warmup"]),),
+                path,
+                input_names=["tokens"],
+                output_names=["features"],
+                dynamic_axes={"tokens": {0: "batch"}, "features": {0: "batch"}},
+                opset_version=17,
+                dynamo=False,
+            )
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = config.TEXT_ENCODER_THREADS or 0
+        session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        # Model PyTorch không còn dùng để suy luận
+        del self.model
+
+        def encode_text(tokens):
+            (features,) = session.run(None, {"tokens": tokens.numpy()})
+            return torch.from_numpy(features)
+
+        return encode_text
+
     def encode(self, query: str):
-        text_inputs = self.tokenizer([query]).to(self.device)
+        return self.encode_batch([query])
+
+    def warmup(self, batch_sizes=(1,)) -> None:
+        """Uncached forward passes at each batch size (kernel selection, allocator pools)."""
+        queries = config.TEXT_ENCODER_WARMUP_QUERIES or ["warmup"]
+        for batch_size in batch_sizes:
+            batch = [queries[i % len(queries)] for i in range(batch_size)]
+            self._encode_tokens(self.tokenize(batch))
+
+    def tokenize(self, queries: list[str]) -> torch.Tensor:
+        """Token ids of the queries on self.device; uncached ones go through the tokenizer in one call."""
+        rows = [self.token_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(q for q, row in zip(queries, rows) if row is None))
+        if missing:
+            fresh = dict(zip(missing, self.tokenizer(missing)))
+            for query, tokens in fresh.items():
+                self.token_cache.put(query, tokens)
+            rows = [fresh[q] if row is None else row for q, row in zip(queries, rows)]
+        return torch.stack(rows).to(self.device)
+
+    def encode_batch(self, queries: list[str]):
+        """Encode several queries in one forward pass -> (len(queries), dim) float32."""
+        vectors = [self.embedding_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(q for q, vec in zip(queries, vectors) if vec is None))
+        if missing:
+            fresh = dict(zip(missing, self._encode_tokens(self.tokenize(missing))))
+            for query, vec in fresh.items():
+                self.embedding_cache.put(query, vec)
+            vectors = [fresh[q] if vec is None else vec for q, vec in zip(queries, vectors)]
+        return np.vstack(vectors)
 
+    def _encode_tokens(self, text_inputs: torch.Tensor) -> np.ndarray:
         with torch.no_grad():
-            text_features = self.model.encode_text(text_inputs)
+            text_features = self._encode_text(text_inputs)
             if self.device  == "cuda":
                 text_features = text_features.cpu()
             return F.normalize(text_features, p=2, dim=-1).detach().numpy().astype(np.float32)